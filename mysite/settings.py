@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 import os.path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -52,14 +52,25 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# time every request and count its queries (see polls.middleware)
+POLLS_REQUEST_METRICS = config('POLLS_REQUEST_METRICS', cast=bool, default=False)
+if POLLS_REQUEST_METRICS:
+    MIDDLEWARE.insert(0, 'polls.middleware.RequestMetricsMiddleware')
+
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # compile every template once per process, also with DEBUG on
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -72,10 +83,23 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'mysite.wsgi.application'
 
-AUTHENTICATION_BACKENDS = [
-    # username/password authentication
-    'django.contrib.auth.backends.ModelBackend',
-]
+# where sessions are kept: db, cached_db (the 'auth' cache in front of the
+# database), cache or signed_cookies (no server side storage at all)
+SESSION_BACKEND = config('SESSION_BACKEND', cast=str, default='db')
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSION_BACKEND}'
+SESSION_CACHE_ALIAS = 'auth'
+
+# seconds the user of a session stays cached in the 'auth' cache (0 loads
+# it from the database on every request); saving or deleting a user and
+# logging out drop the entry
+POLLS_USER_CACHE_SECONDS = config('POLLS_USER_CACHE_SECONDS', cast=int, default=0)
+
+# username/password authentication. With the user cache on, new sessions
+# go through the ModelBackend with cached users (polls.auth); the plain
+# ModelBackend stays listed so that sessions started with it stay valid.
+AUTHENTICATION_BACKENDS = ['django.contrib.auth.backends.ModelBackend']
+if POLLS_USER_CACHE_SECONDS:
+    AUTHENTICATION_BACKENDS.insert(0, 'polls.auth.CachedModelBackend')
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
@@ -87,6 +111,152 @@ DATABASES = {
     }
 }
 
+# 'tuned' runs SQLite in WAL mode with the pragmas below, starts
+# transactions with BEGIN IMMEDIATE and keeps connections open for
+# CONN_MAX_AGE seconds; 'default' keeps SQLite's own settings.
+SQLITE_PROFILE = config('SQLITE_PROFILE', cast=str, default='tuned')
+if SQLITE_PROFILE == 'tuned':
+    DATABASES['default'].update({
+        'ENGINE': 'mysite.sqlite3',
+        'CONN_MAX_AGE': config('CONN_MAX_AGE', cast=int, default=600),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                # milliseconds a writer waits for the lock before failing
+                'busy_timeout': config(
+                    'SQLITE_BUSY_TIMEOUT', cast=int, default=5000),
+                # page cache of each connection, in KiB
+                'cache_size': -config(
+                    'SQLITE_CACHE_SIZE', cast=int, default=64 * 1024),
+                'mmap_size': config(
+                    'SQLITE_MMAP_SIZE', cast=int, default=256 * 1024 * 1024),
+            },
+        },
+    })
+
+# SQLite files holding read-only copies of the database, refreshed from it
+# by `python manage.py sync_replica`; poll pages read from them (see
+# polls.routers) except for POLLS_PRIMARY_STICKY_SECONDS after a user votes.
+POLLS_REPLICAS = []
+for number, name in enumerate(
+        config('DATABASE_REPLICAS', cast=Csv(), default=''), 1):
+    POLLS_REPLICAS.append(f'replica{number}')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'], 'NAME': BASE_DIR / name,
+        'TEST': {'MIRROR': 'default'}}
+POLLS_PRIMARY_STICKY_SECONDS = config(
+    'POLLS_PRIMARY_STICKY_SECONDS', cast=int, default=10)
+if POLLS_REPLICAS:
+    DATABASE_ROUTERS = ['polls.routers.PrimaryReplicaRouter']
+    MIDDLEWARE.append('polls.routers.StickyPrimaryMiddleware')
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # shared results cache for deployments with several worker processes
+    'results': {
+        'BACKEND': config(
+            'RESULTS_CACHE_BACKEND', cast=str,
+            default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config(
+            'RESULTS_CACHE_LOCATION', cast=str,
+            default=str(BASE_DIR / '.results_cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('RESULTS_CACHE_SIZE', cast=int, default=1000),
+        },
+    },
+    # cached sessions and users (see SESSION_BACKEND); with several worker
+    # processes point it at a shared backend, or a logout or password change
+    # only takes effect in the other processes when their entries expire
+    'auth': {
+        'BACKEND': config(
+            'AUTH_CACHE_BACKEND', cast=str,
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config(
+            'AUTH_CACHE_LOCATION', cast=str, default='polls-auth'),
+    },
+    # rendered choice lists of the poll pages ({% cache %}); point it at a
+    # shared backend (e.g. the file based one) for several worker processes
+    'template_fragments': {
+        'BACKEND': config(
+            'FRAGMENT_CACHE_BACKEND', cast=str,
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config(
+            'FRAGMENT_CACHE_LOCATION', cast=str, default='polls-fragments'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('FRAGMENT_CACHE_SIZE', cast=int, default=5000),
+        },
+    },
+}
+
+# where poll results are cached: 'locmem' for a bounded LRU in each process,
+# or the alias of a cache in CACHES (e.g. 'results') to share it.
+POLLS_RESULTS_CACHE = config('POLLS_RESULTS_CACHE', cast=str, default='locmem')
+POLLS_RESULTS_CACHE_SIZE = config('RESULTS_CACHE_SIZE', cast=int, default=1000)
+
+# seconds a reverse proxy may serve the poll list and results pages to
+# visitors without a session; browsers always revalidate (ETag)
+POLLS_PUBLIC_MAX_AGE = config('POLLS_PUBLIC_MAX_AGE', cast=int, default=5)
+
+# seconds before the in-memory schedule of voting periods is reloaded, to
+# pick up questions changed by other processes
+POLLS_SCHEDULE_TTL = config('POLLS_SCHEDULE_TTL', cast=int, default=60)
+
+# seconds after a poll closes before `archive_polls` moves its votes out of
+# the Vote table (leaves time for votes still queued for writing)
+POLLS_ARCHIVE_AFTER = config('POLLS_ARCHIVE_AFTER', cast=int, default=3600)
+
+# token buckets of the vote endpoint: votes per second and burst per user
+# and per client IP (0 turns a limit off), in this process or in the
+# SQLite file POLLS_RATE_LIMIT_DB shared by all workers (polls.ratelimit)
+POLLS_VOTE_RATE = config('POLLS_VOTE_RATE', cast=float, default=1.0)
+POLLS_VOTE_BURST = config('POLLS_VOTE_BURST', cast=int, default=5)
+POLLS_VOTE_IP_RATE = config('POLLS_VOTE_IP_RATE', cast=float, default=20.0)
+POLLS_VOTE_IP_BURST = config('POLLS_VOTE_IP_BURST', cast=int, default=100)
+POLLS_RATE_LIMIT_DB = config('POLLS_RATE_LIMIT_DB', cast=str, default='')
+# seconds a repeated identical vote is answered without voting again
+POLLS_VOTE_COALESCE_SECONDS = config(
+    'POLLS_VOTE_COALESCE_SECONDS', cast=float, default=3.0)
+
+# seconds of each bucket of the per-question vote rate series (polls.history)
+POLLS_RATE_BUCKET_SECONDS = config(
+    'POLLS_RATE_BUCKET_SECONDS', cast=int, default=60)
+
+# number of polls on each page of the poll list
+POLLS_INDEX_PAGE_SIZE = config('POLLS_INDEX_PAGE_SIZE', cast=int, default=20)
+
+# polls per page of the JSON poll list, and question ids accepted by one
+# JSON results request (polls.api)
+POLLS_API_PAGE_SIZE = config('POLLS_API_PAGE_SIZE', cast=int, default=100)
+POLLS_API_MAX_IDS = config('POLLS_API_MAX_IDS', cast=int, default=100)
+
+# serve index, detail, results and vote with the async views
+# (polls.async_views); only useful when running under mysite.asgi.
+POLLS_ASYNC_VIEWS = config('POLLS_ASYNC_VIEWS', cast=bool, default=False)
+
+# push live results to the results page (polls:results-stream); the stream
+# holds a connection open per viewer, so only turn it on under mysite.asgi.
+POLLS_LIVE_RESULTS = config('POLLS_LIVE_RESULTS', cast=bool, default=False)
+
+# at most one live results update per question is pushed every this many
+# seconds to the browsers on polls:results-stream (needs mysite.asgi)
+POLLS_LIVE_INTERVAL = config('POLLS_LIVE_INTERVAL', cast=float, default=1.0)
+
+# queue votes in memory and write them in batches from a background thread
+POLLS_VOTE_INGEST = config('POLLS_VOTE_INGEST', cast=bool, default=False)
+POLLS_VOTE_BATCH_SIZE = config('POLLS_VOTE_BATCH_SIZE', cast=int, default=500)
+# seconds a background batch waits to fill before it is written
+POLLS_VOTE_FLUSH_INTERVAL = config(
+    'POLLS_VOTE_FLUSH_INTERVAL', cast=float, default=0.5)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -107,6 +277,20 @@ LOGIN_REDIRECT_URL = '/polls/'    # show list of polls
 # redirect to smth after logout
 LOGOUT_REDIRECT_URL = '/accounts/login/'   # after logout, go where?
 
+# Logging
+# https://docs.djangoproject.com/en/4.1/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'polls': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 
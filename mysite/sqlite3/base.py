@@ -0,0 +1,42 @@
+"""SQLite backend that applies a tuning profile to every new connection.
+
+Used as ENGINE 'mysite.sqlite3'. Two extra keys are read from OPTIONS:
+
+``pragmas``
+    {name: value} run as ``PRAGMA name = value`` when a connection opens,
+    e.g. journal_mode, synchronous, busy_timeout, cache_size, mmap_size.
+``transaction_mode``
+    'DEFERRED' (SQLite's default), 'IMMEDIATE' or 'EXCLUSIVE'. IMMEDIATE
+    takes the write lock at BEGIN, so a transaction that reads before it
+    writes waits out busy_timeout instead of failing with "database is
+    locked" when it tries to upgrade its lock.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        options = self.settings_dict['OPTIONS']
+        for name, value in options.get('pragmas', {}).items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode is None:
+            return super()._start_transaction_under_autocommit()
+        if mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f'transaction_mode must be one of {", ".join(TRANSACTION_MODES)}.')
+        self.cursor().execute(f'BEGIN {mode.upper()}')
@@ -6,6 +6,9 @@ from .models import Choice, Question
 class ChoiceInline(admin.TabularInline):
     model = Choice
     extra = 3
+    # the stored counter, loaded with the choices in the same query.
+    fields = ('choice_text', 'vote_count')
+    readonly_fields = ('vote_count',)
 
 
 class QuestionAdmin(admin.ModelAdmin):
@@ -16,9 +19,35 @@ class QuestionAdmin(admin.ModelAdmin):
     ]
     inlines = [ChoiceInline]
     list_display = ('question_text', 'pub_date', 'end_date',
-                    'was_published_recently', 'can_vote')
+                    'published_recently', 'is_open', 'total_votes')
     list_filter = ['pub_date']
     search_fields = ['question_text']
+    # skip the COUNT(*) of the whole table next to every search result.
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        """Compute the list columns in the same query as the rows."""
+        return (super().get_queryset(request).with_published_recently()
+                .with_is_open().with_total_votes())
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search questions and choices through the full-text index."""
+        if not search_term.strip():
+            return queryset, False
+        return queryset.search(search_term), False
+
+    @admin.display(boolean=True, ordering='published_recently',
+                   description='Published recently?')
+    def published_recently(self, question):
+        return question.published_recently
+
+    @admin.display(boolean=True, ordering='is_open', description='Can vote?')
+    def is_open(self, question):
+        return question.is_open
+
+    @admin.display(ordering='total_votes', description='Total votes')
+    def total_votes(self, question):
+        return question.total_votes
 
 
 admin.site.register(Question, QuestionAdmin)
@@ -0,0 +1,230 @@
+"""JSON read API for dashboards.
+
+`api/polls/` lists the published polls, newest first, a page at a time
+(`?status=open` or `closed`, `?after=` the `next` cursor of the previous
+page). `api/results/?ids=1,2,3` returns the results of many polls in one
+request. Each answer is read with a single query joining the questions to
+their results snapshots (see polls.snapshots), and encoded with orjson
+when it is installed.
+
+`api/polls/<id>/history/?at=` gives the results of a poll as they were at
+a past moment, and `api/polls/<id>/rate/` its votes per time window for
+charts (see polls.history).
+
+The ETag of an answer is computed from the versions of the rows it shows,
+so an unchanged answer is a 304 and shared caches may keep it for
+settings.POLLS_PUBLIC_MAX_AGE seconds (see polls.conditional).
+"""
+import datetime
+import json
+import math
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+
+from . import conditional, history, snapshots
+from .export import parse_moment
+from .models import Question, QuestionResultSnapshot, voting_period_q
+from .pagination import keyset_paginate
+from .results import build_results
+from .schedule import get_schedule
+
+try:
+    import orjson
+except ImportError:  # optional, the standard json module is used instead
+    orjson = None
+
+STATUSES = ('all', 'open', 'closed')
+# SQLite integers are 64-bit: larger ids cannot even be looked up.
+MAX_INT = 2 ** 63 - 1
+
+
+def dumps(data):
+    """return `data` as compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'),
+                      ensure_ascii=False).encode()
+
+
+def json_response(data, status=200):
+    """return an HttpResponse of `data` encoded with dumps()."""
+    return HttpResponse(dumps(data), status=status,
+                        content_type='application/json')
+
+
+def _bad_request(message):
+    return json_response({'error': message}, status=400)
+
+
+def _published():
+    """Published questions with their results snapshot, in one query."""
+    return Question.objects.published().select_related('snapshot')
+
+
+def _snapshots_of(questions):
+    """return {question id: snapshot} of questions loaded with
+    _published(), counting the missing snapshots."""
+    found, missing = {}, []
+    for question in questions:
+        try:
+            found[question.pk] = question.snapshot
+        except QuestionResultSnapshot.DoesNotExist:
+            missing.append(question.pk)
+    if missing:
+        found.update((snapshot.question_id, snapshot)
+                     for snapshot in snapshots.rebuild(missing))
+    return found
+
+
+def _date(moment):
+    return moment.isoformat() if moment else None
+
+
+def _poll(question, snapshot):
+    return {
+        'id': question.pk,
+        'text': question.question_text,
+        'pub_date': _date(question.pub_date),
+        'end_date': _date(question.end_date),
+        'is_open': question.is_open,
+        'total_votes': snapshot.total,
+        'version': snapshot.version,
+    }
+
+
+def _results(question, choices, **extra):
+    results = build_results(question.pk, map(tuple, choices))
+    return {
+        'id': question.pk,
+        'text': question.question_text,
+        **extra,
+        'total': results.total,
+        'choices': [{'id': choice.id, 'text': choice.choice_text,
+                     'votes': choice.votes, 'percent': choice.percent}
+                    for choice in results.choices],
+    }
+
+
+def _respond(request, state, build):
+    """return the 304 or the JSON answer of `build()` for an answer whose
+    rows are described by `state`."""
+    version = conditional.api_version(state)
+    response = conditional.not_modified(request, version)
+    if response is None:
+        response = json_response(build())
+    return conditional.add_headers(request, response, version)
+
+
+@require_GET
+def poll_list(request):
+    """One page of the published polls, open, closed or all."""
+    status = request.GET.get('status', 'all')
+    if status not in STATUSES:
+        return _bad_request(f'status must be one of {", ".join(STATUSES)}.')
+    now = timezone.now()
+    questions = _published()
+    if status == 'open':
+        questions = questions.filter(voting_period_q(now))
+    elif status == 'closed':
+        questions = questions.filter(end_date__lt=now)
+    page = keyset_paginate(questions, ('pub_date', 'pk'),
+                           request.GET.get('after'),
+                           settings.POLLS_API_PAGE_SIZE)
+    found = _snapshots_of(page.items)
+    schedule = get_schedule()
+    for question in page.items:
+        question.is_open = question.can_vote(schedule)
+    state = (status, page.next_cursor, [
+        (question.pk, question.updated_at, question.is_open,
+         found[question.pk].version) for question in page.items])
+    return _respond(request, state, lambda: {
+        'polls': [_poll(question, found[question.pk])
+                  for question in page.items],
+        'next': page.next_cursor,
+    })
+
+
+@require_GET
+def results(request):
+    """Results of the published polls listed in `?ids=`."""
+    try:
+        ids = list(dict.fromkeys(
+            int(pk) for pk in request.GET.get('ids', '').split(',') if pk))
+        if any(abs(pk) > MAX_INT for pk in ids):
+            raise ValueError(ids)
+    except ValueError:
+        return _bad_request('ids must be question ids separated by commas.')
+    if not ids:
+        return _bad_request('ids is required.')
+    if len(ids) > settings.POLLS_API_MAX_IDS:
+        return _bad_request(
+            f'at most {settings.POLLS_API_MAX_IDS} ids per request.')
+    questions = {question.pk: question
+                 for question in _published().filter(pk__in=ids)}
+    found = _snapshots_of(questions.values())
+    shown = [pk for pk in ids if pk in questions]
+    state = [(pk, questions[pk].updated_at, found[pk].version)
+             for pk in shown]
+    return _respond(request, state, lambda: {
+        'results': [_results(questions[pk], found[pk].choices,
+                             version=found[pk].version) for pk in shown],
+        'missing': [pk for pk in ids if pk not in questions],
+    })
+
+
+def _not_found():
+    return json_response({'error': 'No poll found matching the query.'},
+                         status=404)
+
+
+@require_GET
+def results_at(request, pk):
+    """Results of a published poll as they were at `?at=`."""
+    try:
+        moment = parse_moment(request.GET.get('at', ''))
+    except ValueError:
+        return _bad_request('at must be an ISO date or datetime.')
+    question = Question.objects.published().filter(pk=pk).first()
+    if question is None:
+        return _not_found()
+    choices = history.choices_at(pk, moment) or []
+    return json_response(_results(question, choices, at=_date(moment)))
+
+
+@require_GET
+def vote_rate(request, pk):
+    """Votes of a published poll per time window, for charts: `since` and
+    `until` (default the last day), `step` in seconds (default the range
+    in at most history.MAX_WINDOWS windows)."""
+    until = timezone.now()
+    try:
+        if request.GET.get('until'):
+            until = parse_moment(request.GET['until'], True)
+        since = until - datetime.timedelta(days=1)
+        if request.GET.get('since'):
+            since = parse_moment(request.GET['since'])
+        step = int(request.GET.get('step') or 0)
+        if not step:
+            # as many windows as allowed, one of them for the start of the
+            # range rounded down to a whole window
+            step = math.ceil((until - since).total_seconds()
+                             / (history.MAX_WINDOWS - 1))
+        step = history.window_seconds(step)
+        windows = history.rate_series(pk, since, until, step)
+    except OverflowError:
+        return _bad_request('since and until must be dates within years '
+                            '1 to 9999.')
+    except ValueError as error:
+        return _bad_request(str(error))
+    if not Question.objects.published().filter(pk=pk).exists():
+        return _not_found()
+    return json_response({
+        'id': pk,
+        'step': step,
+        'windows': [{'start': _date(start), 'votes': votes,
+                     'changes': changes, 'withdrawals': withdrawals}
+                    for start, votes, changes, withdrawals in windows],
+    })
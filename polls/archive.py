@@ -0,0 +1,110 @@
+"""Archival of the votes of closed polls.
+
+A question that closed more than settings.POLLS_ARCHIVE_AFTER seconds ago
+never gets another vote. `archive_question()` freezes its final tallies,
+counted from its Vote rows, into a QuestionArchive row and moves those
+rows to the ArchivedVote table, so the Vote table only holds the votes of
+polls that can still change. The results page of an archived question is
+built from its QuestionArchive row alone.
+
+Votes are moved with INSERT ... SELECT and DELETE, without the Vote
+signals: the choice vote counters do not change. `restore_question()`
+moves them back, e.g. when a closed poll is reopened
+(`python manage.py archive_polls`).
+"""
+import datetime
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .cache import invalidate_results
+from .models import ArchivedVote, Choice, Question, QuestionArchive, Vote
+from .results import build_results
+
+VOTE_COLUMNS = 'id, user_id, question_id, choice_id'
+
+
+def archivable(now=None):
+    """return the closed questions whose votes are due to be archived."""
+    now = now or timezone.now()
+    return Question.objects.db_manager(hints={'fresh': True}).filter(
+        end_date__lt=now - datetime.timedelta(
+            seconds=settings.POLLS_ARCHIVE_AFTER),
+        archive__isnull=True)
+
+
+def _move_votes(source, target, question_id):
+    """Move the vote rows of a question from table `source` to `target`;
+    return how many were moved."""
+    using = router.db_for_write(Vote)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {target} ({VOTE_COLUMNS}) SELECT {VOTE_COLUMNS}'
+            f' FROM {source} WHERE question_id = %s', (question_id,))
+        cursor.execute(f'DELETE FROM {source} WHERE question_id = %s',
+                       (question_id,))
+        return cursor.rowcount
+
+
+def archive_question(question_id):
+    """Freeze the results of a question and archive its votes; return the
+    number of votes archived."""
+    with transaction.atomic():
+        counted = dict(Vote.objects.filter(question_id=question_id)
+                       .values('choice').annotate(total=Count('id'))
+                       .values_list('choice', 'total'))
+        choices = [[pk, text, counted.get(pk, 0)] for pk, text in
+                   Choice.objects.db_manager(hints={'fresh': True})
+                   .filter(question_id=question_id).order_by('pk')
+                   .values_list('pk', 'choice_text')]
+        QuestionArchive.objects.create(
+            question_id=question_id, choices=choices,
+            total=sum(votes for _, _, votes in choices))
+        moved = _move_votes(Vote._meta.db_table,
+                            ArchivedVote._meta.db_table, question_id)
+        invalidate_results(question_id)
+    return moved
+
+
+def archive_closed(now=None, limit=None):
+    """Archive the questions due, one transaction each, and return
+    [(question id, votes archived)]."""
+    question_ids = archivable(now).order_by('end_date', 'pk').values_list(
+        'pk', flat=True)
+    if limit is not None:
+        question_ids = question_ids[:limit]
+    return [(pk, archive_question(pk)) for pk in list(question_ids)]
+
+
+def restore_question(question_id):
+    """Move the archived votes of a question back to the Vote table and
+    drop its frozen results; return the number of votes restored."""
+    with transaction.atomic():
+        restored = _move_votes(ArchivedVote._meta.db_table,
+                               Vote._meta.db_table, question_id)
+        QuestionArchive.objects.filter(question_id=question_id).delete()
+        invalidate_results(question_id)
+    return restored
+
+
+def is_archived(question_id):
+    """return True if the votes of a question are archived."""
+    return QuestionArchive.objects.db_manager(hints={'fresh': True}).filter(
+        question_id=question_id).exists()
+
+
+def archived_results(question):
+    """return the frozen QuestionResults of an archived question, None if
+    it is not archived.
+
+    Load the question with select_related('archive') to avoid a query.
+    """
+    try:
+        archive = question.archive
+    except QuestionArchive.DoesNotExist:
+        return None
+    # each archiving of the question freezes results of its own
+    return build_results(question.pk, map(tuple, archive.choices),
+                         f'archived {archive.archived_at.isoformat()}')
@@ -0,0 +1,182 @@
+"""Async versions of the poll views, used when settings.POLLS_ASYNC_VIEWS
+is on and the site is served through mysite.asgi.
+
+They read through Django's async ORM API and never touch the lazy
+``request.user`` from the event loop. The session and user are loaded in
+one thread hop, and only when the request carries a session cookie.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (Http404, HttpResponse, HttpResponseRedirect,
+                         StreamingHttpResponse)
+from django.shortcuts import render
+from django.urls import reverse
+from django.views import View
+
+from . import conditional
+from .archive import archived_results
+from .cache import get_results_cache
+from .ingest import get_vote_ingestor
+from .live import event_stream
+from .models import Choice, Question
+from .pagination import akeyset_paginate
+from .ratelimit import client_ip, get_vote_limiter, too_many_votes
+from .routers import stick_to_primary
+from .schedule import aget_schedule
+from .voting import cast_vote
+
+
+def _load_user(request):
+    return request.user if request.user.is_authenticated else None
+
+
+async def aget_user(request):
+    """return the authenticated user of the request or None."""
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return None
+    return await sync_to_async(_load_user)(request)
+
+
+async def _aget_question(pk):
+    """return the question with its choices prefetched, or raise Http404."""
+    try:
+        return await Question.objects.prefetch_related('choice_set').aget(pk=pk)
+    except Question.DoesNotExist:
+        raise Http404('No question found matching the query')
+
+
+class AsyncIndexView(View):
+    """Index view of index.html"""
+
+    async def get(self, request):
+        page = await akeyset_paginate(
+            Question.objects.published(), ('pub_date', 'pk'),
+            request.GET.get('after'), settings.POLLS_INDEX_PAGE_SIZE)
+        schedule = await aget_schedule()
+        for question in page.items:
+            question.is_open = question.can_vote(schedule)
+        version = conditional.index_version(
+            request, page.items, page.next_cursor)
+        response = conditional.not_modified(request, version)
+        if response is not None:
+            return response
+        await aget_user(request)
+        response = render(request, 'polls/index.html', {
+            'latest_question_list': page.items,
+            'next_cursor': page.next_cursor,
+        })
+        return conditional.add_headers(request, response, version)
+
+
+class AsyncDetailView(View):
+    """Detail view of detail.html"""
+
+    async def get(self, request, pk):
+        user = await aget_user(request)
+        if user is None:
+            return redirect_to_login(request.get_full_path())
+        try:
+            question = await Question.objects.prefetch_related(
+                'choice_set').aget(pk=pk)
+        except Question.DoesNotExist:
+            messages.error(request, "Poll dosen't exist.")
+            return HttpResponseRedirect(reverse('polls:index'))
+        if not question.can_vote(await aget_schedule()):
+            messages.error(request, "Voting is not allowed on this question")
+            return HttpResponseRedirect(reverse('polls:index'))
+        vote_info = await Choice.objects.db_manager(
+            hints={'fresh': True}).filter(
+            vote__user=user, vote__question=question).afirst()
+        return render(request, 'polls/detail.html',
+                      {'question': question, 'vote_info': vote_info})
+
+
+class AsyncResultsView(View):
+    """Results view of results.html"""
+
+    async def get(self, request, pk):
+        try:
+            question = await Question.objects.select_related(
+                'archive').aget(pk=pk)
+        except Question.DoesNotExist:
+            raise Http404('No question found matching the query')
+        version = conditional.results_version(question)
+        response = conditional.not_modified(request, version)
+        if response is not None:
+            return response
+        results = (archived_results(question)
+                   or await get_results_cache().aget(question.pk))
+        response = render(request, 'polls/results.html', {
+            'question': question,
+            'results': results,
+            'live_results': settings.POLLS_LIVE_RESULTS,
+        })
+        return conditional.add_headers(request, response, version)
+
+
+async def vote(request, question_id):
+    """Vote function for voting button"""
+    user = await aget_user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+    choice_id = request.POST.get('choice')
+    results = stick_to_primary(HttpResponseRedirect(
+        reverse('polls:results', args=(question_id,))))
+    limiter = get_vote_limiter()
+    if choice_id and limiter.coalesce(user.id, question_id, choice_id):
+        # the same vote was accepted a moment ago (e.g. a double click)
+        return results
+    if settings.POLLS_RATE_LIMIT_DB:
+        # the shared buckets are a SQLite file: keep it off the event loop
+        retry_after = await sync_to_async(limiter.check)(
+            user.id, client_ip(request))
+    else:
+        retry_after = limiter.check(user.id, client_ip(request))
+    if retry_after:
+        limiter.forget(user.id, question_id, choice_id)
+        return too_many_votes(retry_after)
+    question = await _aget_question(question_id)
+    if not question.can_vote(await aget_schedule()):
+        limiter.forget(user.id, question_id, choice_id)
+        messages.error(request, "Voting is not allowed on this question")
+        return HttpResponseRedirect(reverse('polls:index'))
+    choices = {str(choice.pk): choice for choice in question.choice_set.all()}
+    selected_choice = choices.get(choice_id)
+    if selected_choice is None:
+        limiter.forget(user.id, question_id, choice_id)
+        # Redisplay the question voting form.
+        return render(request, 'polls/detail.html', {
+            'question': question,
+            'error_message': "You didn't select a choice.",
+        })
+    if settings.POLLS_VOTE_INGEST:
+        get_vote_ingestor().submit(user.id, question.id, selected_choice.id)
+        return results
+    try:
+        await sync_to_async(cast_vote)(
+            user.id, question.id, selected_choice.id)
+    except Exception:
+        limiter.forget(user.id, question_id, choice_id)
+        raise
+    return results
+
+
+async def results_stream(request, pk):
+    """Server-Sent Events stream of the live results of a question.
+
+    Under WSGI the never ending stream would be read to its end before
+    anything is sent, holding a worker forever: answer 204 No Content
+    instead, which tells EventSource not to reconnect.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    if not await Question.objects.filter(pk=pk).aexists():
+        raise Http404('No question found matching the query')
+    response = StreamingHttpResponse(event_stream(pk),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
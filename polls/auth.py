@@ -0,0 +1,44 @@
+"""Authentication backend that caches the users of logged in sessions.
+
+Every authenticated request loads its user by the id stored in the
+session. CachedModelBackend keeps those users in the 'auth' cache for
+settings.POLLS_USER_CACHE_SECONDS. The signal handlers in polls.signals
+drop a user's entry when the user is saved (new password, deactivation,
+last login) or deleted and on logout, so a changed password still ends
+the other sessions: their session hash no longer matches the fresh user.
+Updates that bypass save(), e.g. QuerySet.update(), show after the
+timeout.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+
+def _cache():
+    return caches['auth']
+
+
+def _key(user_id):
+    return f'polls:user:{user_id}'
+
+
+def forget_user(user_id):
+    """Drop the cached user `user_id`."""
+    if settings.POLLS_USER_CACHE_SECONDS:
+        _cache().delete(_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose get_user() is served from the 'auth' cache."""
+
+    def get_user(self, user_id):
+        timeout = settings.POLLS_USER_CACHE_SECONDS
+        if not timeout:
+            return super().get_user(user_id)
+        key = _key(user_id)
+        user = _cache().get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                _cache().set(key, user, timeout)
+        return user
@@ -0,0 +1,421 @@
+"""Synthetic load generator and benchmark harness for the polls views.
+
+`generate()` fills the database with questions, choices, users and votes,
+and `run_scenario()` drives one view through the Django test client from
+several threads (WSGI) or `run_scenario_async()` from several asyncio tasks
+(ASGI), reporting latency percentiles, throughput and queries per request.
+`run_vote_stress()` casts votes at a fixed rate from several threads and
+counts "database is locked" errors, and `run_render()` times the rendering
+of the poll page templates alone. The `benchmark` management command ties
+them together.
+"""
+import asyncio
+import datetime
+import math
+import random
+import statistics
+import threading
+import time
+from typing import Callable, NamedTuple
+from urllib.parse import urlencode
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.template.loader import render_to_string
+from django.db import OperationalError, connection
+from django.test import AsyncClient, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import snapshots, tally
+from .cache import get_results_cache
+from .models import Choice, Question, Vote
+from .schedule import get_schedule, refresh_schedule
+from .voting import cast_vote
+
+
+# words the generated questions are made of, and searched for.
+TOPICS = ('python', 'django', 'sqlite', 'coffee', 'music', 'football',
+          'holiday', 'weather', 'election', 'library', 'cinema', 'garden',
+          'breakfast', 'bicycle', 'mountain', 'ocean', 'festival', 'camera',
+          'keyboard', 'language', 'history', 'science', 'painting', 'theatre',
+          'picnic', 'market', 'winter', 'summer', 'museum', 'podcast')
+
+# polls whose results one api_results request fetches, as a dashboard
+# would otherwise scrape that many results pages.
+RESULTS_PER_DASHBOARD = 20
+
+
+class Dataset(NamedTuple):
+    """Primary keys of the generated objects."""
+    question_ids: list
+    choice_ids: dict  # question id -> [choice ids]
+    user_ids: list
+
+
+def generate(questions, choices, users, votes, seed=0, batch_size=5000):
+    """Create synthetic polls and return their Dataset.
+
+    Every question is open and mentions three TOPICS, each has `choices`
+    choices, and `votes` random (user, question) pairs vote, at most once
+    per question.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    password = make_password(None)
+    User.objects.bulk_create(
+        [User(username=f'bench{number}', password=password)
+         for number in range(users)], batch_size=batch_size)
+    user_ids = list(User.objects.filter(username__startswith='bench')
+                    .order_by('pk').values_list('pk', flat=True))
+    Question.objects.bulk_create(
+        [Question(question_text=f'Benchmark question {number} about '
+                                f'{" and ".join(rng.sample(TOPICS, 3))}',
+                  pub_date=now - datetime.timedelta(minutes=number))
+         for number in range(questions)], batch_size=batch_size)
+    question_ids = list(Question.objects.filter(
+        question_text__startswith='Benchmark question')
+        .order_by('pk').values_list('pk', flat=True))
+    Choice.objects.bulk_create(
+        [Choice(question_id=question_id, choice_text=f'Choice {number}')
+         for question_id in question_ids for number in range(choices)],
+        batch_size=batch_size)
+    choice_ids = {}
+    # a range, not __in: SQLite limits the number of query parameters
+    for pk, question_id in (Choice.objects.filter(
+            question_id__gte=question_ids[0],
+            question_id__lte=question_ids[-1])
+            .order_by('pk').values_list('pk', 'question_id')):
+        choice_ids.setdefault(question_id, []).append(pk)
+    votes = min(votes, len(user_ids) * len(question_ids))
+    ballots = set()
+    while len(ballots) < votes:
+        ballots.add((rng.choice(user_ids), rng.choice(question_ids)))
+    Vote.objects.bulk_create(
+        [Vote(user_id=user_id, question_id=question_id,
+              choice_id=rng.choice(choice_ids[question_id]))
+         for user_id, question_id in ballots], batch_size=batch_size)
+    tally.rebuild()
+    snapshots.rebuild(question_ids)
+    refresh_schedule()
+    return Dataset(question_ids, choice_ids, user_ids)
+
+
+class Request(NamedTuple):
+    """One request of a scenario."""
+    method: str
+    path: str
+    data: dict
+
+
+class Scenario(NamedTuple):
+    """A view to drive: `build(dataset, rng)` returns the next Request."""
+    name: str
+    login: bool
+    build: Callable
+
+
+def _question(dataset, rng):
+    return rng.choice(dataset.question_ids)
+
+
+def _index(dataset, rng):
+    return Request('get', reverse('polls:index'), {})
+
+
+def _detail(dataset, rng):
+    question_id = _question(dataset, rng)
+    return Request('get', reverse('polls:detail', args=(question_id,)), {})
+
+
+def _results(dataset, rng):
+    question_id = _question(dataset, rng)
+    return Request('get', reverse('polls:results', args=(question_id,)), {})
+
+
+def _search(dataset, rng):
+    # a whole word or, half of the time, a three letter prefix
+    word = rng.choice(TOPICS)
+    return Request('get', reverse('polls:search'),
+                   {'q': word if rng.random() < 0.5 else word[:3]})
+
+
+def _api_polls(dataset, rng):
+    return Request('get', reverse('polls:api-polls'), {})
+
+
+def _api_results(dataset, rng):
+    question_ids = rng.sample(
+        dataset.question_ids,
+        min(RESULTS_PER_DASHBOARD, len(dataset.question_ids)))
+    return Request('get', reverse('polls:api-results'),
+                   {'ids': ','.join(map(str, question_ids))})
+
+
+def _vote(dataset, rng):
+    question_id = _question(dataset, rng)
+    return Request('post', reverse('polls:vote', args=(question_id,)),
+                   {'choice': rng.choice(dataset.choice_ids[question_id])})
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (
+    Scenario('index', False, _index),
+    Scenario('detail', True, _detail),
+    Scenario('results', False, _results),
+    Scenario('vote', True, _vote),
+    Scenario('search', False, _search),
+    Scenario('api_polls', False, _api_polls),
+    Scenario('api_results', False, _api_results),
+)}
+
+
+def percentile(samples, percent):
+    """return the `percent` percentile of samples (nearest rank)."""
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    rank = math.ceil(percent / 100 * len(ordered)) - 1
+    return ordered[max(0, min(len(ordered) - 1, rank))]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    """return the report of one scenario run (latencies in seconds)."""
+    count = len(latencies)
+    milliseconds = [latency * 1000 for latency in latencies]
+    if queries is not None:
+        queries = round(sum(queries) / count, 2) if count else None
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput_rps': round(count / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'mean': round(statistics.fmean(milliseconds), 3) if count else None,
+            'p50': _round(percentile(milliseconds, 50)),
+            'p95': _round(percentile(milliseconds, 95)),
+            'p99': _round(percentile(milliseconds, 99)),
+            'max': _round(max(milliseconds, default=None)),
+        },
+        'queries_per_request': queries,
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+FORM = 'application/x-www-form-urlencoded'
+
+
+def _send(client, request):
+    """Send a Request; return the response or its awaitable (AsyncClient)."""
+    if request.method == 'post':
+        return client.post(request.path, urlencode(request.data),
+                           content_type=FORM)
+    return client.get(request.path, request.data)
+
+
+def _worker(scenario, dataset, user_id, requests, seed, results, lock):
+    """Send `requests` requests of a scenario with one client."""
+    rng = random.Random(seed)
+    client = Client()
+    if scenario.login:
+        client.force_login(User.objects.get(pk=user_id))
+    latencies, queries, errors = [], [], 0
+    try:
+        for _ in range(requests):
+            request = scenario.build(dataset, rng)
+            # the query log is bounded; once full it would count nothing
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                try:
+                    response = _send(client, request)
+                    failed = response.status_code >= 400
+                except Exception:
+                    failed = True
+                latencies.append(time.perf_counter() - started)
+            queries.append(len(captured))
+            errors += failed
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+    with lock:
+        results.append((latencies, queries, errors))
+
+
+def run_scenario(scenario, dataset, requests=200, concurrency=4, seed=0):
+    """Run `requests` requests of a scenario spread over `concurrency`
+    threads and return its summary."""
+    results, lock = [], threading.Lock()
+    shares = [requests // concurrency + (index < requests % concurrency)
+              for index in range(concurrency)]
+    arguments = [(scenario, dataset,
+                  dataset.user_ids[index % len(dataset.user_ids)],
+                  share, seed + index, results, lock)
+                 for index, share in enumerate(shares) if share]
+    started = time.perf_counter()
+    if len(arguments) == 1:
+        _worker(*arguments[0])
+    else:
+        threads = [threading.Thread(target=_worker, args=args)
+                   for args in arguments]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+    latencies = [value for result in results for value in result[0]]
+    queries = [value for result in results for value in result[1]]
+    errors = sum(result[2] for result in results)
+    return summarize(latencies, queries, errors, elapsed)
+
+
+async def _async_worker(scenario, dataset, client, requests, seed):
+    """Send `requests` requests of a scenario with one AsyncClient."""
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    for _ in range(requests):
+        request = scenario.build(dataset, rng)
+        started = time.perf_counter()
+        try:
+            response = await _send(client, request)
+            failed = response.status_code >= 400
+        except Exception:
+            failed = True
+        latencies.append(time.perf_counter() - started)
+        errors += failed
+    return latencies, errors
+
+
+def run_scenario_async(scenario, dataset, requests=200, concurrency=4, seed=0):
+    """Like run_scenario() but through the ASGI handler, with `concurrency`
+    asyncio tasks; queries per request are not counted."""
+    shares = [requests // concurrency + (index < requests % concurrency)
+              for index in range(concurrency)]
+    clients = []
+    for index in range(concurrency):
+        client = AsyncClient()
+        if scenario.login:
+            client.force_login(User.objects.get(
+                pk=dataset.user_ids[index % len(dataset.user_ids)]))
+        clients.append(client)
+
+    async def run_all():
+        return await asyncio.gather(*(
+            _async_worker(scenario, dataset, client, share, seed + index)
+            for index, (client, share) in enumerate(zip(clients, shares))
+            if share))
+
+    started = time.perf_counter()
+    results = asyncio.run(run_all())
+    elapsed = time.perf_counter() - started
+    latencies = [value for result in results for value in result[0]]
+    errors = sum(result[1] for result in results)
+    return summarize(latencies, None, errors, elapsed)
+
+
+def _stress_worker(dataset, votes, interval, started, seed, results, lock):
+    """Cast `votes` votes, one every `interval` seconds from `started`."""
+    rng = random.Random(seed)
+    latencies, errors, locked = [], 0, 0
+    try:
+        for number in range(votes):
+            delay = started + number * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            question_id = rng.choice(dataset.question_ids)
+            begin = time.perf_counter()
+            try:
+                cast_vote(rng.choice(dataset.user_ids), question_id,
+                          rng.choice(dataset.choice_ids[question_id]))
+            except OperationalError as error:
+                errors += 1
+                locked += 'locked' in str(error)
+            latencies.append(time.perf_counter() - begin)
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+    with lock:
+        results.append((latencies, errors, locked))
+
+
+def run_vote_stress(dataset, rate, seconds, concurrency=4, seed=0):
+    """Cast `rate` votes per second for `seconds` seconds with cast_vote()
+    from `concurrency` threads and return the summary, with the number of
+    "database is locked" errors as `lock_errors`."""
+    votes = round(rate * seconds)
+    shares = [votes // concurrency + (index < votes % concurrency)
+              for index in range(concurrency)]
+    results, lock = [], threading.Lock()
+    started = time.perf_counter()
+    arguments = [(dataset, share, concurrency / rate, started + index / rate,
+                  seed + index, results, lock)
+                 for index, share in enumerate(shares) if share]
+    if len(arguments) == 1:
+        _stress_worker(*arguments[0])
+    else:
+        threads = [threading.Thread(target=_stress_worker, args=args)
+                   for args in arguments]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+    latencies = [value for result in results for value in result[0]]
+    summary = summarize(latencies, None, sum(r[1] for r in results), elapsed)
+    summary['target_rps'] = rate
+    summary['lock_errors'] = sum(result[2] for result in results)
+    return summary
+
+
+def _index_context(dataset, rng):
+    schedule = get_schedule()
+    questions = list(Question.objects.published().order_by('-pub_date')[:20])
+    for question in questions:
+        question.is_open = question.can_vote(schedule)
+    return 'polls/index.html', {'latest_question_list': questions}
+
+
+def _detail_context(dataset, rng):
+    # as seen by a user who has not voted on the question yet
+    question = Question.objects.get(pk=_question(dataset, rng))
+    return 'polls/detail.html', {'question': question}
+
+
+def _results_context(dataset, rng):
+    question = Question.objects.get(pk=_question(dataset, rng))
+    return 'polls/results.html', {
+        'question': question,
+        'results': get_results_cache().get(question.pk)}
+
+
+RENDER_PAGES = {'index': _index_context, 'detail': _detail_context,
+                'results': _results_context}
+
+
+def run_render(dataset, repeat=200, seed=0):
+    """Render each poll page `repeat` times for random questions, with the
+    context its view would build, and return the summary per page.
+
+    Only render_to_string() is timed, including the queries the template
+    itself runs (e.g. the choices of the detail page).
+    """
+    rng = random.Random(seed)
+    request = RequestFactory().get('/')
+    request.user = User.objects.get(pk=dataset.user_ids[0])
+    report = {}
+    for page, build in RENDER_PAGES.items():
+        latencies, queries = [], []
+        started = time.perf_counter()
+        for _ in range(repeat):
+            template_name, context = build(dataset, rng)
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as captured:
+                begin = time.perf_counter()
+                render_to_string(template_name, context, request)
+                latencies.append(time.perf_counter() - begin)
+            queries.append(len(captured))
+        report[page] = summarize(latencies, queries, 0,
+                                 time.perf_counter() - started)
+    return report
@@ -0,0 +1,248 @@
+"""Per-question cache of poll results.
+
+Results only change when a vote is written, so they are cached until the
+signal handlers in polls.signals invalidate them. Each entry is tagged with
+the generation of its question, which every invalidation renews: results
+loaded before a vote and stored after its invalidation carry an old
+generation and are never served. The store is pluggable:
+a bounded in-process LRU by default, or any Django cache (file based,
+database, ...) so several worker processes share the same entries.
+
+The choice lists of the poll pages are cached as template fragments
+({% cache %}) keyed by a per-question choice-set version, which changes
+whenever a choice is added, edited or deleted; the results table also by
+the version of the results it shows (see QuestionResults.version).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.dispatch import Signal
+
+from .results import aload_results, load_results
+
+
+class LRUStore:
+    """Thread-safe in-memory store that evicts the least recently used key."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def get_many(self, keys):
+        return {key: value for key, value in
+                ((key, self.get(key)) for key in keys) if value is not None}
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aget_many(self, keys):
+        return self.get_many(keys)
+
+    async def aset(self, key, value):
+        self.set(key, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DjangoCacheStore:
+    """Store backed by a configured Django cache, shared between processes."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def set(self, key, value):
+        self.cache.set(key, value, timeout=None)
+
+    async def aget(self, key):
+        return await self.cache.aget(key)
+
+    async def aget_many(self, keys):
+        return await self.cache.aget_many(keys)
+
+    async def aset(self, key, value):
+        await self.cache.aset(key, value, timeout=None)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class ResultsCache:
+    """Cache of QuestionResults keyed per question, with hit/miss counters."""
+
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(question_id):
+        return f'polls:results:{question_id}'
+
+    @staticmethod
+    def generation_key(question_id):
+        return f'polls:results-generation:{question_id}'
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _lookup(self, question_id, found):
+        """return (cached results or None, current generation) from the
+        entries `found` in the store."""
+        generation = found.get(self.generation_key(question_id))
+        entry = found.get(self.key(question_id))
+        if (generation is not None and entry is not None
+                and entry[0] == generation):
+            self._count('hits')
+            return entry[1], generation
+        self._count('misses')
+        return None, generation
+
+    def get(self, question_id):
+        """return QuestionResults of a question, loading it on a miss."""
+        results, generation = self._lookup(question_id, self.store.get_many(
+            [self.key(question_id), self.generation_key(question_id)]))
+        if results is not None:
+            return results
+        if generation is None:
+            # a generation lost from the store restarts at a new value.
+            generation = time.time_ns()
+            self.store.set(self.generation_key(question_id), generation)
+        results = load_results(question_id)
+        self.store.set(self.key(question_id), (generation, results))
+        return results
+
+    async def aget(self, question_id):
+        """Async get()."""
+        results, generation = self._lookup(
+            question_id, await self.store.aget_many(
+                [self.key(question_id), self.generation_key(question_id)]))
+        if results is not None:
+            return results
+        if generation is None:
+            generation = time.time_ns()
+            await self.store.aset(self.generation_key(question_id),
+                                  generation)
+        results = await aload_results(question_id)
+        await self.store.aset(self.key(question_id), (generation, results))
+        return results
+
+    def invalidate(self, question_id):
+        """Forget the cached results of a question, and any being loaded."""
+        self.store.set(self.generation_key(question_id), time.time_ns())
+        self.store.delete(self.key(question_id))
+
+    def clear(self):
+        """Forget every cached result and reset the counters."""
+        self.store.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """return counters for monitoring."""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'store': type(self.store).__name__,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / lookups, 3) if lookups else None,
+        }
+
+
+def _create_store():
+    """Build the store selected by settings.POLLS_RESULTS_CACHE."""
+    backend = getattr(settings, 'POLLS_RESULTS_CACHE', 'locmem')
+    if backend == 'locmem':
+        return LRUStore(getattr(settings, 'POLLS_RESULTS_CACHE_SIZE', 1000))
+    return DjangoCacheStore(backend)
+
+
+_results_cache = None
+
+
+def get_results_cache():
+    """return the process wide ResultsCache."""
+    global _results_cache
+    if _results_cache is None:
+        _results_cache = ResultsCache(_create_store())
+    return _results_cache
+
+
+# sent with `question_id` after a committed change to a question's results.
+results_changed = Signal()
+
+
+def _results_changed(question_id):
+    get_results_cache().invalidate(question_id)
+    results_changed.send(sender=ResultsCache, question_id=question_id)
+
+
+def invalidate_results(question_id):
+    """Drop cached results of a question once the change is committed."""
+    transaction.on_commit(lambda: _results_changed(question_id))
+
+
+def _fragment_cache():
+    """return the cache the {% cache %} template tag stores fragments in."""
+    if 'template_fragments' in settings.CACHES:
+        return caches['template_fragments']
+    return caches['default']
+
+
+def _choices_version_key(question_id):
+    return f'polls:choices-version:{question_id}'
+
+
+def choices_version(question_id):
+    """return the current version of the choice set of a question."""
+    # a version lost from the cache restarts at a new, never used value.
+    return _fragment_cache().get_or_set(
+        _choices_version_key(question_id), time.time_ns, None)
+
+
+def bump_choices_version(question_id):
+    """Start a new choice set version once the change is committed."""
+    transaction.on_commit(lambda: _fragment_cache().set(
+        _choices_version_key(question_id), time.time_ns(), None))
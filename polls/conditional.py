@@ -0,0 +1,82 @@
+"""Conditional GET for the index and results pages and the JSON API.
+
+The version of a page is computed from the rows its view loads anyway,
+before anything is rendered. A request whose If-None-Match (or, for
+results, If-Modified-Since) matches gets 304 Not Modified. Pages requested
+without a session cookie are marked public for settings.POLLS_PUBLIC_MAX_AGE
+seconds so a reverse proxy can serve them; the others must be revalidated
+by the browser.
+"""
+import hashlib
+from typing import NamedTuple
+
+from django.conf import settings
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+
+
+class PageVersion(NamedTuple):
+    """Validators of one rendition of a page."""
+    etag: str
+    last_modified: object  # aware datetime or None
+
+
+def _microseconds(moment):
+    return int(moment.timestamp() * 1_000_000) if moment else 0
+
+
+def results_version(question):
+    """return the PageVersion of the results page of a question."""
+    changed = (question.updated_at, question.results_changed_at)
+    return PageVersion(
+        quote_etag(f'r{question.pk}.{_microseconds(changed[0])}.'
+                   f'{_microseconds(changed[1])}'),
+        max(filter(None, changed)))
+
+
+def index_version(request, questions, next_cursor):
+    """return the PageVersion of a page of the poll list.
+
+    `questions` need the `is_open` annotation. Polls close without any
+    write, so the list has no Last-Modified date.
+    """
+    state = [(question.pk, _microseconds(question.updated_at),
+              question.is_open) for question in questions]
+    # the page shows login or logout buttons: vary with the session.
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')
+    digest = hashlib.md5(repr((state, next_cursor, session)).encode())
+    return PageVersion(quote_etag(f'i{digest.hexdigest()}'), None)
+
+
+def api_version(state):
+    """return the PageVersion of a JSON API answer; `state` holds the
+    parameters of the answer and the versions of the rows it shows."""
+    digest = hashlib.md5(repr(state).encode())
+    return PageVersion(quote_etag(f'a{digest.hexdigest()}'), None)
+
+
+def not_modified(request, version):
+    """return a 304 response if the client has this version, else None."""
+    last_modified = version.last_modified
+    response = get_conditional_response(
+        request, etag=version.etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None)
+    if response is not None:
+        add_headers(request, response, version)
+    return response
+
+
+def add_headers(request, response, version):
+    """Add the validators and caching headers of a page to `response`."""
+    response.headers.setdefault('ETag', version.etag)
+    if version.last_modified:
+        response.headers.setdefault(
+            'Last-Modified', http_date(version.last_modified.timestamp()))
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=0,
+                            s_maxage=settings.POLLS_PUBLIC_MAX_AGE)
+    patch_vary_headers(response, ('Cookie',))
+    return response
@@ -0,0 +1,108 @@
+"""Streaming export of poll results and raw votes as CSV or JSON Lines.
+
+Rows are read with QuerySet.iterator(chunk_size=...) and formatted one line
+at a time, so memory stays flat however many votes are exported.
+"""
+import csv
+import datetime
+import itertools
+import json
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ArchivedVote, Choice, Vote
+
+CHUNK_SIZE = 2000
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+KINDS = ('results', 'votes')
+
+RESULT_COLUMNS = ('question_id', 'question_text', 'choice_id', 'choice_text',
+                  'votes')
+VOTE_COLUMNS = ('vote_id', 'question_id', 'choice_id', 'user_id')
+
+
+def parse_moment(value, end_of_day=False):
+    """return an aware datetime from an ISO date or datetime string."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'invalid date: {value}')
+        moment = datetime.datetime.combine(
+            day, datetime.time.max if end_of_day else datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_filters(question=None, choice=None, since=None, until=None):
+    """return queryset filters for the given (string) export options.
+
+    `since` and `until` bound the publication date of the questions.
+    Raise ValueError for values that cannot be parsed.
+    """
+    filters = {}
+    if question:
+        filters['question_id__in'] = [int(pk) for pk in str(question).split(',')]
+    if choice:
+        filters['choice_id__in'] = [int(pk) for pk in str(choice).split(',')]
+    if since:
+        filters['question__pub_date__gte'] = parse_moment(since)
+    if until:
+        filters['question__pub_date__lte'] = parse_moment(until, True)
+    return filters
+
+
+def result_rows(filters):
+    """Yield a results row per choice matching `filters`."""
+    choice_filters = {
+        ('pk__in' if key == 'choice_id__in' else key): value
+        for key, value in filters.items()}
+    return (Choice.objects.filter(**choice_filters)
+            .order_by('question_id', 'pk')
+            .values_list('question_id', 'question__question_text', 'pk',
+                         'choice_text', 'vote_count')
+            .iterator(chunk_size=CHUNK_SIZE))
+
+
+def vote_rows(filters):
+    """Yield a row per raw vote matching `filters`, the votes of open polls
+    first, then the archived ones."""
+    return itertools.chain.from_iterable(
+        model.objects.filter(**filters).order_by('pk')
+        .values_list('pk', 'question_id', 'choice_id', 'user_id')
+        .iterator(chunk_size=CHUNK_SIZE)
+        for model in (Vote, ArchivedVote))
+
+
+class _Line:
+    """File-like object whose write() hands back the written line."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    """Yield CSV lines, the header first."""
+    writer = csv.writer(_Line())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(columns, rows):
+    """Yield one JSON object per line."""
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row))) + '\n'
+
+
+def export_lines(kind, fmt, filters):
+    """Yield the lines of an export of `kind` in format `fmt`."""
+    if kind == 'results':
+        columns, rows = RESULT_COLUMNS, result_rows(filters)
+    else:
+        columns, rows = VOTE_COLUMNS, vote_rows(filters)
+    if fmt == 'csv':
+        return csv_lines(columns, rows)
+    return jsonl_lines(columns, rows)
@@ -0,0 +1,173 @@
+"""History of poll results: point-in-time results and vote rate series.
+
+The vote changelog (VoteChange, appended with every vote change, see
+polls.snapshots) records when each vote was cast, moved to another choice
+or withdrawn. Two things are derived from it:
+
+- `checkpoint()` copies the results snapshot of every question whose
+  results changed since its last ResultsCheckpoint; run it periodically
+  (`python manage.py checkpoint_results`). `choices_at()` rebuilds the
+  results of a question at any moment by replaying, forwards or
+  backwards, only the changes between that moment and the nearest
+  checkpoint or the current snapshot.
+- VoteRateBucket rows count the changes of each question per
+  settings.POLLS_RATE_BUCKET_SECONDS. They are added to in the same
+  transaction as the changes are logged (`count_changes()`), so
+  `rate_series()` reads a few rows instead of scanning the votes.
+
+Votes loaded in bulk (fixture import, benchmark data) are not in the
+changelog: results before the first checkpoint taken after the load count
+them as if they had always been there.
+"""
+import datetime
+import math
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import (QuestionResultSnapshot, ResultsCheckpoint, VoteChange,
+                     VoteRateBucket)
+
+# windows one rate_series() call may return, and the longest window.
+MAX_WINDOWS = 1000
+MAX_STEP = 366 * 24 * 60 * 60
+
+
+def _fresh(model):
+    # read from the primary (see polls.routers): the changelog and the
+    # snapshots must be of the same moment.
+    return model.objects.db_manager(hints={'fresh': True})
+
+
+def _epoch(seconds):
+    return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+
+
+def bucket_start(moment):
+    """return the start of the rate bucket `moment` falls in."""
+    seconds = moment.timestamp()
+    return _epoch(seconds - seconds % settings.POLLS_RATE_BUCKET_SECONDS)
+
+
+def count_changes(changes, moment):
+    """Add (question id, old choice id, new choice id) vote changes made at
+    `moment` to the rate buckets, one upsert per question."""
+    totals = {}
+    for question_id, old, new in changes:
+        kind = 0 if old is None else 2 if new is None else 1
+        totals.setdefault(question_id, [0, 0, 0])[kind] += 1
+    if not totals:
+        return
+    connection = connections[router.db_for_write(VoteRateBucket)]
+    table = connection.ops.quote_name(VoteRateBucket._meta.db_table)
+    start = connection.ops.adapt_datetimefield_value(bucket_start(moment))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table} (question_id, start, votes, changes,'
+            f' withdrawals) VALUES (%s, %s, %s, %s, %s)'
+            f' ON CONFLICT (question_id, start) DO UPDATE SET'
+            f' votes = votes + excluded.votes,'
+            f' changes = changes + excluded.changes,'
+            f' withdrawals = withdrawals + excluded.withdrawals',
+            [(question_id, start, *counts)
+             for question_id, counts in totals.items()])
+
+
+def checkpoint():
+    """Copy the snapshot of every question whose results changed since its
+    last checkpoint; return how many checkpoints were taken."""
+    last_version = (ResultsCheckpoint.objects.filter(
+        question_id=OuterRef('pk')).order_by('-change_id', '-pk')
+        .values('version')[:1])
+    changed = (_fresh(QuestionResultSnapshot)
+               .annotate(last_version=Coalesce(Subquery(last_version), 0))
+               .exclude(version=F('last_version'))
+               .values_list('pk', 'change_id', 'version', 'choices'))
+    with transaction.atomic():
+        return len(ResultsCheckpoint.objects.bulk_create(
+            [ResultsCheckpoint(question_id=question_id, change_id=change_id,
+                               version=version, choices=choices)
+             for question_id, change_id, version, choices in changed],
+            batch_size=2000))
+
+
+def _replay(counts, changes, sign):
+    for old, new in changes:
+        if old is not None:
+            counts[old] = counts.get(old, 0) - sign
+        if new is not None:
+            counts[new] = counts.get(new, 0) + sign
+
+
+def choices_at(question_id, moment):
+    """return [[choice id, choice text, votes], ...] of a question as they
+    were at `moment`, None if the question has no results to start from."""
+    changes = _fresh(VoteChange).filter(question_id=question_id)
+    target = changes.filter(changed_at__lte=moment).aggregate(
+        last=Max('id'))['last'] or 0
+    checkpoints = _fresh(ResultsCheckpoint).filter(question_id=question_id)
+    candidates = [
+        checkpoints.filter(change_id__lte=target)
+        .order_by('-change_id', '-pk').values_list('change_id', 'choices')
+        .first(),
+        checkpoints.filter(change_id__gt=target).order_by('change_id', 'pk')
+        .values_list('change_id', 'choices').first(),
+        _fresh(QuestionResultSnapshot).filter(pk=question_id)
+        .values_list('change_id', 'choices').first(),
+    ]
+    candidates = [candidate for candidate in candidates if candidate]
+    if not candidates:
+        return None
+    # the nearest: fewest changes to replay, earlier ones on a tie
+    change_id, choices = min(candidates, key=lambda candidate: (
+        abs(candidate[0] - target), candidate[0] > target))
+    counts = {pk: votes for pk, _, votes in choices}
+    between = changes.filter(id__gt=min(change_id, target),
+                             id__lte=max(change_id, target)).values_list(
+        'old_choice_id', 'new_choice_id')
+    _replay(counts, between, 1 if change_id <= target else -1)
+    texts = {}
+    for _, candidate in candidates:
+        texts.update((pk, text) for pk, text, _ in candidate)
+    shown = {pk for pk, _, _ in choices}
+    shown.update(pk for pk, votes in counts.items() if votes)
+    return [[pk, texts.get(pk, ''), counts.get(pk, 0)]
+            for pk in sorted(shown)]
+
+
+def window_seconds(step=None):
+    """return `step` seconds rounded up to whole rate buckets (one bucket
+    if None)."""
+    size = settings.POLLS_RATE_BUCKET_SECONDS
+    return max(1, -(-(step or size) // size)) * size
+
+
+def rate_series(question_id, since, until, step=None):
+    """return [(window start, new votes, changed votes, deleted votes)] of
+    a question from `since` to `until`, in windows of `step` seconds
+    rounded up to whole buckets, empty windows included.
+
+    Raise ValueError if that is more than MAX_WINDOWS windows or windows
+    longer than MAX_STEP seconds.
+    """
+    step = window_seconds(step)
+    if step > MAX_STEP:
+        raise ValueError(f'step must be at most {MAX_STEP} seconds')
+    first = int(since.timestamp()) // step * step
+    end = until.timestamp()
+    if (end - first) / step > MAX_WINDOWS:
+        raise ValueError(f'more than {MAX_WINDOWS} windows, use a larger step')
+    windows = {}
+    for start, *counts in (
+            _fresh(VoteRateBucket).filter(
+                question_id=question_id, start__gte=_epoch(first),
+                start__lt=until).values_list(
+                'start', 'votes', 'changes', 'withdrawals')):
+        window = windows.setdefault(
+            int(start.timestamp()) // step * step, [0, 0, 0])
+        for index, count in enumerate(counts):
+            window[index] += count
+    return [(_epoch(start), *windows.get(start, (0, 0, 0)))
+            for start in range(first, math.ceil(end), step)]
@@ -0,0 +1,127 @@
+"""Bulk import of poll and user fixtures (the loaddata JSON format).
+
+The fixture array is parsed one object at a time and the objects are
+written with bulk_create in batches, users before questions before choices
+before votes, all inside a single transaction.
+"""
+import json
+import re
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.serializers.python import Deserializer
+from django.db import transaction
+
+from . import snapshots, tally
+from .cache import invalidate_results
+from .models import Choice, Question, Vote
+from .schedule import refresh_schedule
+
+# models in the order they have to be written.
+IMPORT_ORDER = (User, Question, Choice, Vote)
+SEPARATOR = re.compile(r'[\s,]*')
+
+
+def iter_fixture(path, chunk_size=1 << 16):
+    """Yield the objects of a JSON fixture array without loading it whole."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as fixture:
+        buffer = fixture.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f'{path} is not a JSON array')
+        position, eof = 1, False
+        while True:
+            position = SEPARATOR.match(buffer, position).end()
+            if buffer.startswith(']', position):
+                return
+            try:
+                obj, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = fixture.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield obj
+
+
+class FixtureImporter:
+    """Write deserialized fixture objects with bulk_create."""
+
+    def __init__(self, batch_size=5000, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.pending = defaultdict(list)
+        self.m2m = []
+        self.counts = defaultdict(int)
+        self.choice_questions = {}
+        self.vote_deltas = defaultdict(int)
+        self.questions = set()
+
+    def run(self, paths):
+        """Import every fixture file; return {model: objects imported}."""
+        with transaction.atomic():
+            for path in paths:
+                for deserialized in Deserializer(iter_fixture(path)):
+                    self.add(deserialized)
+            self.flush()
+            for through, objects in self.m2m:
+                through.objects.bulk_create(objects, batch_size=self.batch_size)
+            tally.apply_deltas(self.vote_deltas)
+            snapshots.rebuild(self.questions)
+            Question.objects.filter(pk__in=self.questions).touch_results()
+            for question_id in self.questions:
+                invalidate_results(question_id)
+            transaction.on_commit(refresh_schedule)
+        return dict(self.counts)
+
+    def add(self, deserialized):
+        """Queue one deserialized fixture object."""
+        obj = deserialized.object
+        if type(obj) not in IMPORT_ORDER:
+            raise ValueError(f'cannot import {obj._meta.label} objects')
+        for name, pks in (deserialized.m2m_data or {}).items():
+            if pks:
+                field = obj._meta.get_field(name)
+                through = field.remote_field.through
+                self.m2m.append((through, [through(**{
+                    f'{field.m2m_field_name()}_id': obj.pk,
+                    f'{field.m2m_reverse_field_name()}_id': pk,
+                }) for pk in pks]))
+        self.pending[type(obj)].append(obj)
+        if sum(len(objects) for objects in self.pending.values()) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the pending objects, dependencies first."""
+        for model in IMPORT_ORDER:
+            objects = self.pending.pop(model, [])
+            if not objects:
+                continue
+            if model is Choice:
+                for choice in objects:
+                    choice.vote_count = 0
+                    self.choice_questions[choice.pk] = choice.question_id
+                    self.questions.add(choice.question_id)
+            elif model is Vote:
+                self._prepare_votes(objects)
+            model.objects.bulk_create(objects, batch_size=self.batch_size)
+            self.counts[model._meta.label] += len(objects)
+        if self.progress:
+            self.progress(dict(self.counts))
+
+    def _prepare_votes(self, votes):
+        """Fill in the question of votes and count them per choice."""
+        unknown = {vote.choice_id for vote in votes
+                   if vote.choice_id not in self.choice_questions}
+        if unknown:
+            self.choice_questions.update(Choice.objects.db_manager(
+                hints={'fresh': True}).filter(
+                pk__in=unknown).values_list('pk', 'question_id'))
+        for vote in votes:
+            if vote.question_id is None:
+                vote.question_id = self.choice_questions.get(vote.choice_id)
+            self.vote_deltas[vote.choice_id] += 1
+            self.questions.add(vote.question_id)
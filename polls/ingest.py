@@ -0,0 +1,181 @@
+"""Write-behind vote ingestion.
+
+When settings.POLLS_VOTE_INGEST is on, vote() only validates the ballot and
+puts it on an in-process queue. A background thread drains the queue and
+writes each batch with bulk_create/bulk_update inside one transaction, so
+hundreds of ballots share one write lock instead of taking it each. A batch
+that fails (e.g. a ballot for a choice deleted since it was queued) is
+written again ballot by ballot, and only the ballots that cannot be stored
+are dropped.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+
+from . import snapshots, tally
+from .cache import invalidate_results
+from .models import Question, Vote
+from .voting import cast_vote
+
+logger = logging.getLogger(__name__)
+
+
+def _latest(batch):
+    """return {(user id, question id): choice id} of the last ballots."""
+    ballots = {}
+    for user_id, question_id, choice_id in batch:
+        ballots[user_id, question_id] = choice_id
+    return ballots
+
+
+class VoteIngestor:
+    """Queue of ballots flushed to the database in batches."""
+
+    def __init__(self, batch_size=500, flush_interval=0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def submit(self, user_id, question_id, choice_id):
+        """Queue a ballot; a later ballot of the same user wins."""
+        self.queue.put((user_id, question_id, choice_id))
+
+    def start(self):
+        """Start the background writer and flush what is left on exit."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name='polls-vote-ingest', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the background writer and write every queued ballot."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        """Write every queued ballot now, batch_size ballots at a time."""
+        written = 0
+        while True:
+            batch = self._take(self.batch_size)
+            if not batch:
+                return written
+            written += self._store(batch)
+
+    def _take(self, limit, timeout=None):
+        """Remove up to `limit` ballots, waiting `timeout` for the first."""
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=timeout)
+                         if timeout else self.queue.get_nowait())
+            while len(batch) < limit:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._take(self.batch_size, timeout=self.flush_interval)
+            if not batch:
+                continue
+            # give a batch that started small the rest of the interval to fill.
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                batch.extend(self._take(self.batch_size - len(batch),
+                                        timeout=remaining))
+            try:
+                self._store(batch)
+            except Exception:
+                logger.exception('failed to write %d queued votes', len(batch))
+            finally:
+                close_old_connections()
+
+    def _store(self, batch):
+        """Write a batch, or its ballots one by one if the batch fails;
+        return how many of its ballots were not dropped."""
+        try:
+            self._write(batch)
+            return len(batch)
+        except DatabaseError:
+            logger.warning('failed to write %d queued votes at once, '
+                           'writing them one by one', len(batch),
+                           exc_info=True)
+        dropped = set()
+        with self._flush_lock:
+            for (user_id, question_id), choice_id in _latest(batch).items():
+                try:
+                    cast_vote(user_id, question_id, choice_id)
+                except DatabaseError:
+                    logger.exception('dropped the queued vote of user %s on '
+                                     'question %s', user_id, question_id)
+                    dropped.add((user_id, question_id))
+        return sum((user_id, question_id) not in dropped
+                   for user_id, question_id, _ in batch)
+
+    def _write(self, batch):
+        """Upsert a batch of ballots and adjust the counters in one transaction."""
+        ballots = _latest(batch)
+        with self._flush_lock, transaction.atomic():
+            existing = Vote.objects.filter(
+                user_id__in={user_id for user_id, _ in ballots},
+                question_id__in={q_id for _, q_id in ballots},
+            ).values_list('pk', 'user_id', 'question_id', 'choice_id')
+            found = {(user_id, q_id): (pk, choice_id)
+                     for pk, user_id, q_id, choice_id in existing}
+            deltas = defaultdict(int)
+            created, changed, changes = [], [], []
+            for key, choice_id in ballots.items():
+                if key not in found:
+                    created.append(Vote(user_id=key[0], question_id=key[1],
+                                        choice_id=choice_id))
+                    deltas[choice_id] += 1
+                    changes.append((*key, None, choice_id))
+                    continue
+                pk, old_choice_id = found[key]
+                if old_choice_id != choice_id:
+                    changed.append(Vote(pk=pk, choice_id=choice_id))
+                    deltas[old_choice_id] -= 1
+                    deltas[choice_id] += 1
+                    changes.append((*key, old_choice_id, choice_id))
+            Vote.objects.bulk_create(created, batch_size=self.batch_size)
+            Vote.objects.bulk_update(changed, ['choice'],
+                                     batch_size=self.batch_size)
+            tally.apply_deltas(deltas)
+            snapshots.log_changes(changes)
+            question_ids = {q_id for _, q_id in ballots}
+            Question.objects.filter(pk__in=question_ids).touch_results()
+            for question_id in question_ids:
+                invalidate_results(question_id)
+
+
+_ingestor = None
+_ingestor_lock = threading.Lock()
+
+
+def get_vote_ingestor():
+    """return the process wide VoteIngestor, started on first use."""
+    global _ingestor
+    with _ingestor_lock:
+        if _ingestor is None:
+            _ingestor = VoteIngestor(
+                batch_size=settings.POLLS_VOTE_BATCH_SIZE,
+                flush_interval=settings.POLLS_VOTE_FLUSH_INTERVAL)
+            _ingestor.start()
+    return _ingestor
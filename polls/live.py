@@ -0,0 +1,161 @@
+"""Live results pushed to browsers with Server-Sent Events.
+
+Each question with viewers has one ResultsChannel running on the event
+loop. Votes only mark the channel stale; at most once per
+settings.POLLS_LIVE_INTERVAL the channel loads the results with one query
+and fans the same message out to every subscriber, so N viewers cost one
+query per tick instead of N. Everything lives in the ASGI process; no
+broker is needed.
+"""
+import asyncio
+import json
+
+from django.conf import settings
+from django.dispatch import receiver
+
+from .cache import ResultsCache, results_changed
+from .results import aload_results
+
+
+def results_message(results):
+    """return the JSON text sent to browsers for QuestionResults."""
+    return json.dumps({
+        'question_id': results.question_id,
+        'total': results.total,
+        'choices': [{'id': choice.id, 'votes': choice.votes,
+                     'percent': choice.percent}
+                    for choice in results.choices],
+    })
+
+
+class ResultsChannel:
+    """Subscribers of one question and the task that broadcasts to them."""
+
+    def __init__(self, publisher, question_id):
+        self.publisher = publisher
+        self.question_id = question_id
+        self.subscribers = set()
+        self.version = 0
+        self.sent_version = 0
+        self.message = None
+        self.loop = asyncio.get_running_loop()
+        self.task = None
+
+    async def current_message(self):
+        """return the latest message, loading it for the first viewer."""
+        if self.message is None:
+            self.message = await self.publisher.load(self.question_id)
+        return self.message
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = self.loop.create_task(self._run())
+
+    async def _run(self):
+        while self.subscribers:
+            await asyncio.sleep(self.publisher.interval)
+            version = self.version
+            if version == self.sent_version or not self.subscribers:
+                continue
+            self.message = await self.publisher.load(self.question_id)
+            self.sent_version = version
+            self.publisher.broadcasts += 1
+            for queue in self.subscribers:
+                _replace(queue, self.message)
+
+
+def _replace(queue, message):
+    """Put `message` on a one-slot queue, dropping an unread older one."""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+class Subscription:
+    """One viewer of a ResultsChannel."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.queue = asyncio.Queue(maxsize=1)
+        channel.subscribers.add(self.queue)
+        channel.start()
+
+    async def current(self):
+        """return the latest results message."""
+        return await self.channel.current_message()
+
+    async def next(self, timeout=None):
+        """return the next broadcast message, or None after `timeout`."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        channel = self.channel
+        channel.subscribers.discard(self.queue)
+        publisher = channel.publisher
+        if (not channel.subscribers
+                and publisher.channels.get(channel.question_id) is channel):
+            del publisher.channels[channel.question_id]
+
+
+class ResultsPublisher:
+    """In-process registry of ResultsChannel per question."""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.channels = {}
+        self.loads = 0
+        self.broadcasts = 0
+
+    async def load(self, question_id):
+        self.loads += 1
+        return results_message(await aload_results(question_id))
+
+    def notify(self, question_id):
+        """Mark the results of a question stale; safe from any thread."""
+        channel = self.channels.get(question_id)
+        if channel is not None:
+            channel.version += 1
+
+    def subscribe(self, question_id):
+        """return a Subscription to the results of a question."""
+        channel = self.channels.get(question_id)
+        if channel is None or channel.loop is not asyncio.get_running_loop():
+            channel = self.channels[question_id] = ResultsChannel(
+                self, question_id)
+        return Subscription(channel)
+
+    def stats(self):
+        """return counters for monitoring."""
+        return {
+            'channels': len(self.channels),
+            'subscribers': sum(len(channel.subscribers)
+                               for channel in list(self.channels.values())),
+            'loads': self.loads,
+            'broadcasts': self.broadcasts,
+        }
+
+
+publisher = ResultsPublisher(settings.POLLS_LIVE_INTERVAL)
+
+
+@receiver(results_changed, sender=ResultsCache)
+def mark_results_stale(sender, question_id, **kwargs):
+    publisher.notify(question_id)
+
+
+async def event_stream(question_id, heartbeat=15):
+    """Yield Server-Sent Events with the live results of a question."""
+    subscription = publisher.subscribe(question_id)
+    try:
+        yield f'data: {await subscription.current()}\n\n'
+        while True:
+            message = await subscription.next(timeout=heartbeat)
+            if message is None:
+                yield ': keep-alive\n\n'
+            else:
+                yield f'data: {message}\n\n'
+    finally:
+        subscription.close()
@@ -0,0 +1,36 @@
+"""Archive the votes of closed polls, or restore them."""
+from django.core.management.base import BaseCommand, CommandError
+
+from polls import archive
+
+
+class Command(BaseCommand):
+    help = ('Freeze the results of polls closed for POLLS_ARCHIVE_AFTER '
+            'seconds and move their votes out of the Vote table. Safe to '
+            'run repeatedly, e.g. from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', type=int,
+            help='Archive at most this many polls in this run.')
+        parser.add_argument(
+            '--restore', type=int, nargs='+', metavar='QUESTION_ID',
+            help='Move the archived votes of these polls back instead.')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            for question_id in options['restore']:
+                if not archive.is_archived(question_id):
+                    raise CommandError(
+                        f'question {question_id} is not archived.')
+                restored = archive.restore_question(question_id)
+                self.stdout.write(
+                    f'question {question_id}: {restored} vote(s) restored')
+            return
+        archived = archive.archive_closed(limit=options['limit'])
+        for question_id, votes in archived:
+            self.stdout.write(
+                f'question {question_id}: {votes} vote(s) archived')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(archived)} poll(s) archived, '
+            f'{sum(votes for _, votes in archived)} vote(s) moved.'))
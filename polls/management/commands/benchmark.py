@@ -0,0 +1,147 @@
+"""Benchmark the polls views against a generated SQLite database."""
+import json
+import platform
+import subprocess
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.utils import timezone
+
+from polls import benchmark
+
+
+def _check_scratch_file(path, overwrite):
+    """Refuse to run on a file of a configured database, or on any existing
+    file unless `overwrite`: the run deletes and recreates it."""
+    target = Path(path).resolve()
+    for alias, database in settings.DATABASES.items():
+        name = str(database.get('NAME') or '')
+        if name and name != ':memory:' and Path(name).resolve() == target:
+            raise CommandError(
+                f'{path} is the file of the {alias!r} database; give '
+                f'--db a scratch file.')
+    if target.exists() and not overwrite:
+        raise CommandError(
+            f'{path} exists and would be overwritten; remove it or pass '
+            f'--keepdb or --force.')
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True, cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Generate synthetic polls in a scratch SQLite file and measure '
+            'latency, throughput and queries per request of the views.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=100)
+        parser.add_argument('--choices', type=int, default=4,
+                            help='Choices per question.')
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--votes', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per scenario.')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Client threads per scenario.')
+        parser.add_argument('--scenario', action='append',
+                            choices=sorted(benchmark.SCENARIOS),
+                            help='Scenario to run (repeatable), default all.')
+        parser.add_argument('--interface', choices=('wsgi', 'asgi'),
+                            default='wsgi',
+                            help='Drive the views through the WSGI or the '
+                                 'ASGI handler. Set POLLS_ASYNC_VIEWS=True '
+                                 'to measure the async views.')
+        parser.add_argument('--render', type=int, metavar='REPEAT',
+                            help='Also time the rendering of each poll page '
+                                 'template REPEAT times.')
+        parser.add_argument('--stress-rate', type=float,
+                            help='Also cast this many votes per second '
+                                 'from --concurrency threads and count '
+                                 '"database is locked" errors.')
+        parser.add_argument('--stress-seconds', type=float, default=10)
+        parser.add_argument('--db', default='benchmark.sqlite3',
+                            help='SQLite file used for the run.')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the SQLite file after the run.')
+        parser.add_argument('--force', action='store_true',
+                            help='Overwrite the --db file if it exists.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', '-o',
+                            help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The benchmark runs on SQLite only.')
+        _check_scratch_file(options['db'],
+                            options['keepdb'] or options['force'])
+        connection.settings_dict['TEST']['NAME'] = options['db']
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # the scratch database has no replicas, and a few clients
+            # casting many votes must not be rate limited
+            with override_settings(POLLS_REPLICAS=[], POLLS_VOTE_RATE=0,
+                                   POLLS_VOTE_IP_RATE=0,
+                                   POLLS_VOTE_COALESCE_SECONDS=0):
+                report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(text + '\n')
+        self.stdout.write(text)
+
+    def run(self, options):
+        dataset = benchmark.generate(
+            options['questions'], options['choices'], options['users'],
+            options['votes'], seed=options['seed'])
+        run_scenario = benchmark.run_scenario
+        if options['interface'] == 'asgi':
+            run_scenario = benchmark.run_scenario_async
+        scenarios = {}
+        for name in options['scenario'] or benchmark.SCENARIOS:
+            self.stderr.write(f'running {name} ...')
+            scenarios[name] = run_scenario(
+                benchmark.SCENARIOS[name], dataset, options['requests'],
+                options['concurrency'], options['seed'])
+        render = None
+        if options['render']:
+            self.stderr.write('rendering pages ...')
+            render = benchmark.run_render(dataset, options['render'],
+                                          options['seed'])
+        stress = None
+        if options['stress_rate']:
+            self.stderr.write(f'casting {options["stress_rate"]} votes/s ...')
+            stress = benchmark.run_vote_stress(
+                dataset, options['stress_rate'], options['stress_seconds'],
+                options['concurrency'], options['seed'])
+        parameters = {key: options[key] for key in (
+            'questions', 'choices', 'users', 'votes', 'requests',
+            'concurrency', 'seed', 'interface')}
+        parameters['async_views'] = settings.POLLS_ASYNC_VIEWS
+        parameters['sqlite_profile'] = settings.SQLITE_PROFILE
+        return {
+            'revision': _git_revision(),
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'parameters': parameters,
+            'scenarios': scenarios,
+            'render': render,
+            'vote_stress': stress,
+        }
@@ -0,0 +1,25 @@
+"""Verify the per-question results snapshots against the votes."""
+from django.core.management.base import BaseCommand, CommandError
+
+from polls import snapshots
+
+
+class Command(BaseCommand):
+    help = ('Compare every results snapshot with a count of the votes and '
+            'exit non-zero if any drifted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repair', action='store_true',
+            help='Rewrite the snapshots that drifted from a count instead.')
+
+    def handle(self, *args, **options):
+        drift = snapshots.repair() if options['repair'] else snapshots.find_drift()
+        for question_id, stored, counted in drift:
+            self.stdout.write(
+                f'question {question_id}: stored {stored}, counted {counted}')
+        if drift and not options['repair']:
+            raise CommandError(f'{len(drift)} results snapshot(s) out of date.')
+        verb = 'repaired' if options['repair'] else 'out of date'
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(drift)} results snapshot(s) {verb}.'))
@@ -0,0 +1,16 @@
+"""Take checkpoints of the poll results for point-in-time results."""
+from django.core.management.base import BaseCommand
+
+from polls import history
+
+
+class Command(BaseCommand):
+    help = ('Copy the results snapshot of every poll whose results changed '
+            'since its last checkpoint. Run it periodically, e.g. from '
+            'cron: results at a past moment replay the vote changes from '
+            'the nearest checkpoint.')
+
+    def handle(self, *args, **options):
+        taken = history.checkpoint()
+        self.stdout.write(self.style.SUCCESS(
+            f'{taken} checkpoint(s) taken.'))
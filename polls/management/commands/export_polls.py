@@ -0,0 +1,33 @@
+"""Stream poll results or raw votes to a file as CSV or JSON Lines."""
+from django.core.management.base import BaseCommand, CommandError
+
+from polls import export
+
+
+class Command(BaseCommand):
+    help = 'Export poll results or raw votes as CSV or JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=export.KINDS)
+        parser.add_argument('--format', choices=list(export.FORMATS),
+                            default='csv')
+        parser.add_argument('--question', help='Question id(s), comma separated.')
+        parser.add_argument('--choice', help='Choice id(s), comma separated.')
+        parser.add_argument('--since', help='Questions published on or after.')
+        parser.add_argument('--until', help='Questions published on or before.')
+        parser.add_argument('--output', '-o', help='File to write, default stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            filters = export.parse_filters(
+                question=options['question'], choice=options['choice'],
+                since=options['since'], until=options['until'])
+        except ValueError as error:
+            raise CommandError(error)
+        lines = export.export_lines(options['kind'], options['format'], filters)
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,37 @@
+"""Load poll and user fixtures with bulk inserts instead of loaddata."""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from polls.importer import FixtureImporter
+
+
+class Command(BaseCommand):
+    help = ('Import fixtures such as data/polls.json and data/users.json '
+            'with bulk inserts in a single transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures', nargs='+', help='Fixture file paths.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Objects written per bulk insert.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        progress = None
+        if options['verbosity'] > 1:
+            progress = self.report_progress
+        importer = FixtureImporter(options['batch_size'], progress)
+        try:
+            counts = importer.run(options['fixtures'])
+        except (OSError, ValueError, DatabaseError) as error:
+            raise CommandError(f'Import failed: {error}')
+        total = sum(counts.values())
+        if options['verbosity'] > 0:
+            self.stdout.write(self.style.SUCCESS(
+                f'Imported {total} object(s) in '
+                f'{time.perf_counter() - started:.2f}s.'))
+
+    def report_progress(self, counts):
+        self.stdout.write(', '.join(
+            f'{label}: {count}' for label, count in counts.items()))
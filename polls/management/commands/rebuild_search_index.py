@@ -0,0 +1,21 @@
+"""Refill the full-text poll search index from the poll tables."""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from polls import search
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the SQLite FTS5 index of question and choice texts '
+            'used by the poll search and the admin.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database to rebuild the index of.')
+
+    def handle(self, *args, **options):
+        if connections[options['database']].vendor != 'sqlite':
+            raise CommandError('The search index exists on SQLite only.')
+        count = search.rebuild(options['database'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{count} question(s) indexed.'))
@@ -0,0 +1,24 @@
+"""Rebuild or verify the per-choice vote counters from the Vote table."""
+from django.core.management.base import BaseCommand, CommandError
+
+from polls import tally
+
+
+class Command(BaseCommand):
+    help = 'Recount Choice.vote_count from the Vote table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report wrong counters and exit non-zero if any.')
+
+    def handle(self, *args, **options):
+        drift = tally.find_drift() if options['check'] else tally.rebuild()
+        for choice, stored, real in drift:
+            self.stdout.write(
+                f'choice {choice.pk}: stored {stored}, counted {real}')
+        if options['check'] and drift:
+            raise CommandError(f'{len(drift)} vote counter(s) out of date.')
+        verb = 'out of date' if options['check'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(drift)} vote counter(s) {verb}.'))
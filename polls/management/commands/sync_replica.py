@@ -0,0 +1,32 @@
+"""Copy the primary SQLite database to the read replicas."""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from polls.routers import sync_replica
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database to every replica in '
+            'DATABASE_REPLICAS.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            help='Keep syncing every this many seconds until interrupted.')
+
+    def handle(self, *args, **options):
+        if not settings.POLLS_REPLICAS:
+            raise CommandError('No replicas configured; set DATABASE_REPLICAS.')
+        while True:
+            started = time.perf_counter()
+            for alias in settings.POLLS_REPLICAS:
+                sync_replica(connections[alias].settings_dict['NAME'])
+            self.stdout.write(self.style.SUCCESS(
+                f'synced {len(settings.POLLS_REPLICAS)} replica(s) in '
+                f'{time.perf_counter() - started:.3f}s.'))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,149 @@
+"""Per-request timing and SQL accounting.
+
+RequestMetricsMiddleware measures wall time, number of queries, database
+time and repeated queries of every request. It logs one structured line
+per request to the ``polls.metrics`` logger, adds a ``Server-Timing``
+header and keeps rolling latency histograms per view, shown on the
+staff-only ``polls:stats`` page.
+"""
+import json
+import logging
+import math
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from django.db import connections
+
+logger = logging.getLogger('polls.metrics')
+
+# upper bounds (milliseconds) of the histogram buckets; the last is open.
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class QueryRecorder:
+    """Database execute wrapper that counts and times queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql, repr(params)] += 1
+
+    @property
+    def duplicates(self):
+        """Queries that ran again with the very same parameters."""
+        return sum(count - 1 for count in self.statements.values())
+
+
+class EndpointStats:
+    """Latency histogram and recent samples of one view."""
+
+    def __init__(self, window=1000):
+        self.requests = 0
+        self.total_ms = 0.0
+        self.queries = 0
+        self.duplicates = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.recent = deque(maxlen=window)
+
+    def add(self, wall_ms, queries, duplicates):
+        self.requests += 1
+        self.total_ms += wall_ms
+        self.queries += queries
+        self.duplicates += duplicates
+        index = next((i for i, bound in enumerate(BUCKETS_MS)
+                      if wall_ms <= bound), len(BUCKETS_MS))
+        self.buckets[index] += 1
+        self.recent.append(wall_ms)
+
+    def as_dict(self):
+        recent = sorted(self.recent)
+
+        def pick(percent):
+            if not recent:
+                return None
+            rank = math.ceil(percent / 100 * len(recent)) - 1
+            return round(recent[max(0, rank)], 3)
+
+        labels = [f'<={bound}ms' for bound in BUCKETS_MS]
+        labels.append(f'>{BUCKETS_MS[-1]}ms')
+        return {
+            'requests': self.requests,
+            'mean_ms': round(self.total_ms / self.requests, 3),
+            'recent_p50_ms': pick(50),
+            'recent_p95_ms': pick(95),
+            'recent_p99_ms': pick(99),
+            'queries_per_request': round(self.queries / self.requests, 2),
+            'duplicate_queries': self.duplicates,
+            'histogram': dict(zip(labels, self.buckets)),
+        }
+
+
+class RequestMetrics:
+    """Thread-safe collection of EndpointStats keyed by view name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, wall_ms, queries, duplicates):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, EndpointStats())
+            stats.add(wall_ms, queries, duplicates)
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: stats.as_dict()
+                    for endpoint, stats in sorted(self._endpoints.items())}
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+request_metrics = RequestMetrics()
+
+
+class RequestMetricsMiddleware:
+    """Record timing and query accounting of every request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        wall_ms = (time.perf_counter() - started) * 1000
+        db_ms = recorder.seconds * 1000
+        match = request.resolver_match
+        endpoint = match.view_name if match else 'unresolved'
+        request_metrics.record(endpoint, wall_ms, recorder.count,
+                               recorder.duplicates)
+        logger.info(json.dumps({
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'wall_ms': round(wall_ms, 3),
+            'db_ms': round(db_ms, 3),
+            'queries': recorder.count,
+            'duplicate_queries': recorder.duplicates,
+        }))
+        response['Server-Timing'] = (
+            f'total;dur={wall_ms:.3f}, '
+            f'db;dur={db_ms:.3f};desc="{recorder.count} queries"')
+        return response
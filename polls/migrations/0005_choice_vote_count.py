@@ -0,0 +1,28 @@
+# Generated by Django 4.1.13 on 2026-10-18 05:14
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_votes(apps, schema_editor):
+    Choice = apps.get_model('polls', 'Choice')
+    choices = Choice.objects.using(schema_editor.connection.alias)
+    for choice in choices.annotate(total=Count('vote')):
+        if choice.total:
+            choices.filter(pk=choice.pk).update(vote_count=choice.total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_remove_vote_question'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='choice',
+            name='vote_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='vote count'),
+        ),
+        migrations.RunPython(count_existing_votes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.1.13 on 2026-10-18 05:19
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def backfill_vote_question(apps, schema_editor):
+    """Copy choice.question onto every vote and keep the newest vote of a
+    user per question, so the unique constraint can be added."""
+    db = schema_editor.connection.alias
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+    Vote.objects.using(db).update(question_id=Subquery(
+        Choice.objects.filter(pk=OuterRef('choice_id')).values('question_id')))
+    duplicates = (Vote.objects.using(db).filter(user__isnull=False)
+                  .values('user_id', 'question_id')
+                  .annotate(total=Count('id'), newest=Max('id'))
+                  .filter(total__gt=1))
+    removed = 0
+    for row in list(duplicates):
+        removed += Vote.objects.using(db).filter(
+            user_id=row['user_id'], question_id=row['question_id'],
+        ).exclude(pk=row['newest']).delete()[0]
+    if removed:
+        choices = Choice.objects.using(db)
+        for choice in choices.annotate(total=Count('vote')):
+            if choice.vote_count != choice.total:
+                choices.filter(pk=choice.pk).update(vote_count=choice.total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('polls', '0005_choice_vote_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.RunPython(backfill_vote_question, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('user', 'question'), name='one_vote_per_question'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['question', 'choice'], name='vote_question_choice_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_question_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='results_changed_at',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='results last changed'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='last edited'),
+        ),
+    ]
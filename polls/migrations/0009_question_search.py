@@ -0,0 +1,65 @@
+from django.db import migrations
+
+REINDEX = """
+    DELETE FROM polls_question_search WHERE rowid = {id};
+    INSERT INTO polls_question_search(rowid, question_text, choice_text)
+    SELECT q.id, q.question_text,
+           coalesce((SELECT group_concat(c.choice_text, char(10))
+                     FROM polls_choice c WHERE c.question_id = q.id), '')
+    FROM polls_question q WHERE q.id = {id};
+"""
+
+CREATE = [
+    """CREATE VIRTUAL TABLE polls_question_search USING fts5(
+           question_text, choice_text, tokenize = 'unicode61 remove_diacritics 2')""",
+    """INSERT INTO polls_question_search(rowid, question_text, choice_text)
+       SELECT q.id, q.question_text,
+              coalesce((SELECT group_concat(c.choice_text, char(10))
+                        FROM polls_choice c WHERE c.question_id = q.id), '')
+       FROM polls_question q""",
+    f"""CREATE TRIGGER polls_question_search_ai AFTER INSERT ON polls_question
+        BEGIN {REINDEX.format(id='NEW.id')} END""",
+    f"""CREATE TRIGGER polls_question_search_au
+        AFTER UPDATE OF question_text ON polls_question
+        BEGIN {REINDEX.format(id='NEW.id')} END""",
+    """CREATE TRIGGER polls_question_search_ad AFTER DELETE ON polls_question
+       BEGIN DELETE FROM polls_question_search WHERE rowid = OLD.id; END""",
+    f"""CREATE TRIGGER polls_choice_search_ai AFTER INSERT ON polls_choice
+        BEGIN {REINDEX.format(id='NEW.question_id')} END""",
+    f"""CREATE TRIGGER polls_choice_search_au
+        AFTER UPDATE OF choice_text, question_id ON polls_choice
+        BEGIN {REINDEX.format(id='OLD.question_id')}
+              {REINDEX.format(id='NEW.question_id')} END""",
+    f"""CREATE TRIGGER polls_choice_search_ad AFTER DELETE ON polls_choice
+        BEGIN {REINDEX.format(id='OLD.question_id')} END""",
+]
+
+DROP = [
+    'DROP TRIGGER IF EXISTS polls_choice_search_ad',
+    'DROP TRIGGER IF EXISTS polls_choice_search_au',
+    'DROP TRIGGER IF EXISTS polls_choice_search_ai',
+    'DROP TRIGGER IF EXISTS polls_question_search_ad',
+    'DROP TRIGGER IF EXISTS polls_question_search_au',
+    'DROP TRIGGER IF EXISTS polls_question_search_ai',
+    'DROP TABLE IF EXISTS polls_question_search',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_question_change_times'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def snapshot_existing_results(apps, schema_editor):
+    Choice = apps.get_model('polls', 'Choice')
+    QuestionResultSnapshot = apps.get_model('polls', 'QuestionResultSnapshot')
+    alias = schema_editor.connection.alias
+    choices = {}
+    for pk, question_id, text, votes in (
+            Choice.objects.using(alias).order_by('pk').values_list(
+                'pk', 'question_id', 'choice_text', 'vote_count')):
+        choices.setdefault(question_id, []).append([pk, text, votes])
+    QuestionResultSnapshot.objects.using(alias).bulk_create(
+        [QuestionResultSnapshot(
+            question_id=question_id, choices=rows,
+            total=sum(votes for _, _, votes in rows))
+         for question_id, rows in choices.items()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('polls', '0010_vote_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionResultSnapshot',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='polls.question')),
+                ('total', models.IntegerField(default=0, verbose_name='total votes')),
+                ('choices', models.JSONField(default=list)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('change_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VoteChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='changed')),
+                ('new_choice', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='polls.choice')),
+                ('old_choice', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='polls.choice')),
+                ('question', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='polls.question')),
+                ('user', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question', 'id'], name='vote_change_question_idx')],
+            },
+        ),
+        migrations.RunPython(snapshot_existing_results,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_result_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultsCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('change_id', models.BigIntegerField()),
+                ('version', models.PositiveIntegerField()),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='taken')),
+                ('choices', models.JSONField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VoteRateBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('votes', models.IntegerField(default=0, verbose_name='new votes')),
+                ('changes', models.IntegerField(default=0, verbose_name='changed votes')),
+                ('withdrawals', models.IntegerField(default=0, verbose_name='deleted votes')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='votechange',
+            index=models.Index(fields=['question', 'changed_at'], name='vote_change_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='voteratebucket',
+            name='question',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='polls.question'),
+        ),
+        migrations.AddField(
+            model_name='resultscheckpoint',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='polls.question'),
+        ),
+        migrations.AddConstraint(
+            model_name='voteratebucket',
+            constraint=models.UniqueConstraint(fields=('question', 'start'), name='one_bucket_per_start'),
+        ),
+        migrations.AddIndex(
+            model_name='resultscheckpoint',
+            index=models.Index(fields=['question', 'change_id'], name='checkpoint_question_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:45
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0012_vote_history'),
+    ]
+
+    # the default is applied by Django, not by the database: only the
+    # state changes. (Remaking polls_question in SQLite would also trip
+    # over the search triggers of polls_choice that refer to it.)
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='question',
+                    name='updated_at',
+                    field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='last edited'),
+                ),
+            ],
+        ),
+    ]
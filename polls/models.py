@@ -2,42 +2,127 @@
 import datetime
 
 from django.db import models
+from django.db.models import (BooleanField, ExpressionWrapper, OuterRef, Q,
+                              Subquery, Sum)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib import admin
 from django.contrib.auth.models import User
 
+from . import search
+from .schedule import DAY, get_schedule, now_micros
+
+
+def voting_period_q(now):
+    """return Q matching questions that can be voted on at `now`."""
+    return Q(pub_date__lte=now) & (Q(end_date__isnull=True) | Q(end_date__gte=now))
+
+
+class QuestionQuerySet(models.QuerySet):
+    """Queries on questions shared by the views."""
+
+    def published(self, now=None):
+        """Questions whose publication date has passed."""
+        return self.filter(pub_date__lte=now or timezone.localtime())
+
+    def with_is_open(self, now=None):
+        """Annotate `is_open`, can_vote() computed by the database."""
+        return self.annotate(is_open=ExpressionWrapper(
+            voting_period_q(now or timezone.localtime()),
+            output_field=BooleanField()))
+
+    def with_published_recently(self, now=None):
+        """Annotate `published_recently`, was_published_recently() computed
+        by the database."""
+        now = now or timezone.localtime()
+        return self.annotate(published_recently=ExpressionWrapper(
+            Q(pub_date__gte=now - datetime.timedelta(days=1), pub_date__lte=now),
+            output_field=BooleanField()))
+
+    def with_total_votes(self):
+        """Annotate `total_votes`, the sum of the choice vote counters."""
+        totals = (Choice.objects.filter(question=OuterRef('pk'))
+                  .values('question').annotate(total=Sum('vote_count'))
+                  .values('total'))
+        return self.annotate(total_votes=Coalesce(Subquery(totals), 0))
+
+    def search(self, text):
+        """Questions whose text or choices contain every word of `text`
+        (as a prefix), found through the full-text index."""
+        expression = search.match_expression(text)
+        if not expression:
+            return self.none()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {search.TABLE} WHERE {search.TABLE} MATCH %s',
+            (expression,)))
+
+    def touch_results(self, now=None):
+        """Record that the results of these questions changed."""
+        return self.update(results_changed_at=now or timezone.now())
+
 
 class Question(models.Model):
     """Model for Poll Question."""
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published')
     end_date = models.DateTimeField('end date', null=True, blank=True)
+    # set on every save(); a default rather than auto_now so that fixtures
+    # loaded without the column (raw saves skip auto_now) still get one.
+    updated_at = models.DateTimeField('last edited', default=timezone.now,
+                                      editable=False)
+    results_changed_at = models.DateTimeField(
+        'results last changed', null=True, editable=False)
+
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pub_date'], name='question_pub_date_idx'),
+            models.Index(fields=['pub_date', 'end_date'],
+                         name='question_period_idx'),
+        ]
 
     def __str__(self):
         """str -- Poll Question text."""
         return self.question_text
 
+    def save(self, *args, **kwargs):
+        """Record the time of the edit."""
+        self.updated_at = timezone.now()
+        super().save(*args, **kwargs)
+
     @admin.display(
         boolean=True,
         ordering='pub_date',
         description='Published recently?',)
-    def was_published_recently(self):
+    def was_published_recently(self, schedule=None):
         """Check that question is published less than 1 day or not
         return True if question was published less than 1 day, False otherwise.
         """
+        period = (schedule or get_schedule()).period(self)
+        if period is not None:
+            now = now_micros()
+            return now - DAY <= period[0] <= now
         now = timezone.localtime()
         return now - datetime.timedelta(days=1) <= self.pub_date <= now
 
-    def is_published(self):
+    def is_published(self, schedule=None):
         """return True if current date is on or after
         question’s publication date."""
+        period = (schedule or get_schedule()).period(self)
+        if period is not None:
+            return now_micros() >= period[0]
         now = timezone.localtime()
         return now >= self.pub_date
 
-    def can_vote(self):
+    def can_vote(self, schedule=None):
         """check user in the voting period or not then
         return True if voting is allowed for this question.
         """
+        is_open = (schedule or get_schedule()).is_open(self)
+        if is_open is not None:
+            return is_open
         now = timezone.localtime()
         if self.end_date is None:
             return self.pub_date <= now
@@ -48,10 +133,23 @@ class Choice(models.Model):
     """Model for choice in Polls."""
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
+    vote_count = models.IntegerField('vote count', default=0, editable=False)
 
     def votes(self):
-        """return vote amount of that choice."""
-        return Vote.objects.filter(choice=self).count()
+        """return vote amount of that choice (kept up to date by polls.tally)."""
+        return self.vote_count
+
+    def save(self, *args, **kwargs):
+        """Save an existing choice without its vote count, which polls.tally
+        moves in the database: a choice loaded before a vote would write
+        back a stale count."""
+        if (not self._state.adding and not args
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'vote_count']
+        super().save(*args, **kwargs)
 
     def __str__(self):
         """str -- Poll choice text."""
@@ -61,13 +159,155 @@ class Choice(models.Model):
 class Vote(models.Model):
     """Model for votes in Polls."""
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    # copy of choice.question so one vote per question is a database rule.
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'question'],
+                                    name='one_vote_per_question'),
+        ]
+        indexes = [
+            models.Index(fields=['question', 'choice'],
+                         name='vote_question_choice_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember which choice this vote is counted for when loaded."""
+        instance = super().from_db(db, field_names, values)
+        instance._tallied_choice_id = instance.__dict__.get('choice_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Fill in the question from the selected choice."""
+        if self.question_id is None:
+            self.question_id = self.choice.question_id
+        super().save(*args, **kwargs)
+
     def __str__(self) -> str:
         """str -- Polls user"""
         return self.user
 
-    @property
-    def question(self):
-        """return question that selected."""
-        return self.choice.question
+
+class QuestionArchive(models.Model):
+    """Final results of a closed question whose votes were archived."""
+    question = models.OneToOneField(Question, on_delete=models.CASCADE,
+                                    primary_key=True, related_name='archive')
+    total = models.IntegerField('total votes')
+    # [[choice id, choice text, votes], ...] in choice order
+    choices = models.JSONField()
+    archived_at = models.DateTimeField('archived', auto_now_add=True)
+
+    def __str__(self):
+        """str -- Archived question"""
+        return f'Archive of question {self.question_id}'
+
+
+class ArchivedVote(models.Model):
+    """A vote of an archived question, moved out of the Vote table."""
+    # the id it had as a Vote, kept so it can be restored as it was.
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+
+
+class VoteChange(models.Model):
+    """One change of a vote, appended to the vote changelog.
+
+    A new vote has no old choice, a deleted vote has no new one. Rows are
+    never updated; they point at ids only, so history outlives the choices
+    and users it mentions.
+    """
+    question = models.ForeignKey(
+        Question, on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name='+')
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, null=True,
+        related_name='+')
+    old_choice = models.ForeignKey(
+        Choice, on_delete=models.DO_NOTHING, db_constraint=False, null=True,
+        related_name='+')
+    new_choice = models.ForeignKey(
+        Choice, on_delete=models.DO_NOTHING, db_constraint=False, null=True,
+        related_name='+')
+    changed_at = models.DateTimeField('changed', default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['question', 'id'],
+                         name='vote_change_question_idx'),
+            models.Index(fields=['question', 'changed_at'],
+                         name='vote_change_time_idx'),
+        ]
+
+    def __str__(self):
+        """str -- Vote change"""
+        return (f'question {self.question_id}: '
+                f'{self.old_choice_id} -> {self.new_choice_id}')
+
+
+class QuestionResultSnapshot(models.Model):
+    """Current results of a question as one row, refreshed from the vote
+    changelog (see polls.snapshots)."""
+    question = models.OneToOneField(Question, on_delete=models.CASCADE,
+                                    primary_key=True, related_name='snapshot')
+    total = models.IntegerField('total votes', default=0)
+    # [[choice id, choice text, votes], ...] in choice order
+    choices = models.JSONField(default=list)
+    # bumped whenever the results change
+    version = models.PositiveIntegerField(default=0)
+    # id of the last VoteChange applied
+    change_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        """str -- Snapshot of question results"""
+        return f'Results of question {self.question_id}'
+
+
+class ResultsCheckpoint(models.Model):
+    """Results of a question as they were after one vote change, copied
+    from its snapshot (see polls.history)."""
+    question = models.ForeignKey(Question, on_delete=models.CASCADE,
+                                 related_name='checkpoints')
+    # id of the last VoteChange counted and version of the snapshot copied
+    change_id = models.BigIntegerField()
+    version = models.PositiveIntegerField()
+    taken_at = models.DateTimeField('taken', default=timezone.now)
+    # [[choice id, choice text, votes], ...] in choice order
+    choices = models.JSONField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['question', 'change_id'],
+                         name='checkpoint_question_idx'),
+        ]
+
+    def __str__(self):
+        """str -- Checkpoint of question results"""
+        return f'Results of question {self.question_id} at {self.taken_at}'
+
+
+class VoteRateBucket(models.Model):
+    """Vote changes of a question within one time bucket (see
+    polls.history)."""
+    # like VoteChange, written while a question's votes are being deleted
+    question = models.ForeignKey(
+        Question, on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name='+')
+    start = models.DateTimeField()
+    votes = models.IntegerField('new votes', default=0)
+    changes = models.IntegerField('changed votes', default=0)
+    withdrawals = models.IntegerField('deleted votes', default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'start'],
+                                    name='one_bucket_per_start'),
+        ]
+
+    def __str__(self):
+        """str -- Vote rate bucket"""
+        return f'Votes on question {self.question_id} from {self.start}'
@@ -0,0 +1,86 @@
+"""Keyset (cursor) pagination.
+
+Instead of OFFSET, the next page starts after the ordering values of the
+last row shown, so every page is one index range scan however deep it is.
+"""
+import base64
+import json
+from typing import List, NamedTuple, Optional
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+# SQLite integers are 64-bit; a larger one in a cursor cannot be queried.
+MAX_INT = 2 ** 63 - 1
+
+
+class KeysetPage(NamedTuple):
+    """One page of rows and the cursor of the page after it."""
+    items: List
+    next_cursor: Optional[str]
+
+
+def encode_cursor(values):
+    """return an opaque URL-safe cursor for a tuple of ordering values."""
+    raw = json.dumps(list(values), cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """return the ordering values in `cursor`, or None if it is invalid."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or any(
+            isinstance(value, int) and abs(value) > MAX_INT
+            for value in values):
+        return None
+    return values
+
+
+def _after(fields, values):
+    """return Q for rows after `values` in descending `fields` order."""
+    condition = Q()
+    for index in reversed(range(len(fields))):
+        step = Q(**{f'{fields[index]}__lt': values[index]})
+        if index < len(fields) - 1:
+            step |= Q(**{fields[index]: values[index]}) & condition
+        condition = step
+    return condition
+
+
+def _page_queryset(queryset, fields, cursor, size):
+    """return the query of one page plus one row to tell if more follow."""
+    queryset = queryset.order_by(*(f'-{field}' for field in fields))
+    values = decode_cursor(cursor) if cursor else None
+    if values is not None and len(values) == len(fields):
+        try:
+            queryset = queryset.filter(_after(fields, values))
+        except (ValidationError, ValueError, TypeError):
+            pass  # a tampered cursor shows the first page
+    return queryset[:size + 1]
+
+
+def _page(items, fields, size):
+    next_cursor = None
+    if len(items) > size:
+        items = items[:size]
+        last = items[-1]
+        next_cursor = encode_cursor(
+            getattr(last, field) for field in fields)
+    return KeysetPage(items, next_cursor)
+
+
+def keyset_paginate(queryset, fields, cursor=None, size=20):
+    """return a KeysetPage of `queryset` ordered by descending `fields`."""
+    items = list(_page_queryset(queryset, fields, cursor, size))
+    return _page(items, fields, size)
+
+
+async def akeyset_paginate(queryset, fields, cursor=None, size=20):
+    """Async keyset_paginate() using the async ORM iterator."""
+    items = [item async for item in _page_queryset(queryset, fields, cursor, size)]
+    return _page(items, fields, size)
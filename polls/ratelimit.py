@@ -0,0 +1,226 @@
+"""Rate limiting and duplicate coalescing for the vote endpoint.
+
+Every vote request takes a token from two token buckets, one for the user
+and one for the client IP. A bucket holds up to `burst` tokens and refills
+at `rate` tokens per second; a request finding either bucket empty is
+answered 429 Too Many Requests without touching the database. Buckets live
+in this process, or in a SQLite file shared by all worker processes when
+settings.POLLS_RATE_LIMIT_DB is set.
+
+A submission repeating the last one accepted from the same user on the
+same question less than settings.POLLS_VOTE_COALESCE_SECONDS ago (a
+double click) is coalesced: it is answered with the redirect to the
+results straight away.
+"""
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+
+class MemoryBuckets:
+    """Token buckets of this process, the least recently used evicted
+    beyond `max_keys` (an evicted bucket comes back full)."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """Take a token; return (allowed, tokens left)."""
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class SQLiteBuckets:
+    """Token buckets in a SQLite file shared by several processes.
+
+    A token is taken with one UPSERT ... RETURNING statement, atomic across
+    processes. Buckets idle long enough to be full again are pruned.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY,'
+                ' tokens REAL NOT NULL, updated REAL NOT NULL,'
+                ' allowed INTEGER NOT NULL) WITHOUT ROWID')
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, rate, burst, now):
+        """Take a token; return (allowed, tokens left)."""
+        connection = self._connection()
+        refilled = 'min(:burst, tokens + (:now - updated) * :rate)'
+        allowed, tokens = connection.execute(
+            f'INSERT INTO bucket (key, tokens, updated, allowed)'
+            f' VALUES (:key, :burst - 1, :now, 1)'
+            f' ON CONFLICT (key) DO UPDATE SET'
+            f'  allowed = {refilled} >= 1,'
+            f'  tokens = {refilled} - ({refilled} >= 1),'
+            f'  updated = :now'
+            f' RETURNING allowed, tokens',
+            {'key': key, 'rate': rate, 'burst': burst, 'now': now}).fetchone()
+        self._calls += 1
+        if self._calls % self.PRUNE_EVERY == 0:
+            connection.execute('DELETE FROM bucket WHERE updated < ?',
+                               (now - burst / rate,))
+        return bool(allowed), tokens
+
+
+class RecentSubmissions:
+    """Last value submitted under each key in the last `window` seconds."""
+
+    def __init__(self, window, max_keys=100000):
+        self.window = window
+        self.max_keys = max_keys
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key, value, now):
+        """Record `value` as the last submission of `key`; return False if
+        it repeats the recent one."""
+        with self._lock:
+            expiry, last = self._recent.get(key, (0, None))
+            if expiry > now and last == value:
+                return False
+            self._recent.pop(key, None)
+            self._recent[key] = (now + self.window, value)
+            # entries are in expiry order: drop the expired and the excess
+            while self._recent and (
+                    len(self._recent) > self.max_keys
+                    or next(iter(self._recent.values()))[0] <= now):
+                self._recent.popitem(last=False)
+            return True
+
+    def forget(self, key, value):
+        """Let a submission through again, e.g. when it failed."""
+        with self._lock:
+            if key in self._recent and self._recent[key][1] == value:
+                del self._recent[key]
+
+
+class VoteLimiter:
+    """Per user and per IP token buckets plus duplicate coalescing."""
+
+    def __init__(self, buckets, user_rate, user_burst, ip_rate, ip_burst,
+                 coalesce_seconds):
+        self.buckets = buckets
+        self.limits = {'user': (user_rate, user_burst),
+                       'ip': (ip_rate, ip_burst)}
+        self.recent = RecentSubmissions(coalesce_seconds)
+        self.coalesce_seconds = coalesce_seconds
+        self._lock = threading.Lock()
+        self.counters = {'allowed': 0, 'rejected_user': 0, 'rejected_ip': 0,
+                         'coalesced': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def coalesce(self, user_id, question_id, choice_id, now=None):
+        """return True if this submission repeats a recent one and can be
+        answered without voting again."""
+        if not self.coalesce_seconds:
+            return False
+        now = time.monotonic() if now is None else now
+        if self.recent.claim((user_id, question_id), choice_id, now):
+            return False
+        self._count('coalesced')
+        return True
+
+    def forget(self, user_id, question_id, choice_id):
+        """The submission failed: do not coalesce its retries."""
+        self.recent.forget((user_id, question_id), choice_id)
+
+    def check(self, user_id, ip, now=None):
+        """Take a token for the user and the IP; return 0 if the vote may
+        go ahead, else the seconds after which to retry."""
+        now = time.time() if now is None else now
+        for kind, value in (('user', user_id), ('ip', ip)):
+            rate, burst = self.limits[kind]
+            if not rate:
+                continue
+            allowed, tokens = self.buckets.take(
+                f'{kind}:{value}', rate, burst, now)
+            if not allowed:
+                self._count(f'rejected_{kind}')
+                return (1 - tokens) / rate
+        self._count('allowed')
+        return 0
+
+    def stats(self):
+        """return counters for monitoring."""
+        with self._lock:
+            stats = dict(self.counters)
+        stats['shared'] = isinstance(self.buckets, SQLiteBuckets)
+        return stats
+
+
+_limiter = None
+
+
+def get_vote_limiter():
+    """return the process wide VoteLimiter configured from settings."""
+    global _limiter
+    if _limiter is None:
+        buckets = (SQLiteBuckets(settings.POLLS_RATE_LIMIT_DB)
+                   if settings.POLLS_RATE_LIMIT_DB else MemoryBuckets())
+        _limiter = VoteLimiter(
+            buckets, settings.POLLS_VOTE_RATE, settings.POLLS_VOTE_BURST,
+            settings.POLLS_VOTE_IP_RATE, settings.POLLS_VOTE_IP_BURST,
+            settings.POLLS_VOTE_COALESCE_SECONDS)
+    return _limiter
+
+
+def reset_vote_limiter():
+    """Start over with full buckets and zero counters."""
+    global _limiter
+    _limiter = None
+
+
+@receiver(setting_changed)
+def _settings_changed(setting, **kwargs):
+    if setting.startswith(('POLLS_VOTE_', 'POLLS_RATE_LIMIT_')):
+        reset_vote_limiter()
+
+
+def too_many_votes(retry_after):
+    """return the 429 response of a rate limited vote."""
+    response = HttpResponse('Too many votes, please slow down.',
+                            status=429, content_type='text/plain')
+    response['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+def client_ip(request):
+    """return the address the request came from (REMOTE_ADDR; behind a
+    reverse proxy, have it set REMOTE_ADDR to the real client)."""
+    return request.META.get('REMOTE_ADDR', '')
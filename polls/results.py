@@ -0,0 +1,53 @@
+"""Results of a poll question, read from its results snapshot row."""
+from typing import NamedTuple, Tuple, Union
+
+from asgiref.sync import sync_to_async
+
+from .models import QuestionResultSnapshot
+from .snapshots import get_snapshot
+
+
+class ChoiceResult(NamedTuple):
+    """Vote count of one choice."""
+    id: int
+    choice_text: str
+    votes: int
+    percent: float
+
+
+class QuestionResults(NamedTuple):
+    """All choice counts of one question with their total, and the version
+    of what they were read from: the results snapshot version, or the
+    archive time of frozen results."""
+    question_id: int
+    total: int
+    choices: Tuple[ChoiceResult, ...]
+    version: Union[int, str, None] = None
+
+
+def build_results(question_id, rows, version=None):
+    """return QuestionResults from (choice id, choice text, votes) rows."""
+    rows = list(rows)
+    total = sum(votes for _, _, votes in rows)
+    choices = tuple(
+        ChoiceResult(pk, text, votes,
+                     round(100 * votes / total, 1) if total else 0.0)
+        for pk, text, votes in rows)
+    return QuestionResults(question_id, total, choices, version)
+
+
+def load_results(question_id):
+    """return QuestionResults of a question from its snapshot row."""
+    choices, version = get_snapshot(question_id)
+    return build_results(question_id, map(tuple, choices), version)
+
+
+async def aload_results(question_id):
+    """Async load_results()."""
+    snapshot = await QuestionResultSnapshot.objects.db_manager(
+        hints={'fresh': True}).filter(pk=question_id).values_list(
+        'choices', 'version').afirst()
+    if snapshot is None:
+        snapshot = await sync_to_async(get_snapshot)(question_id)
+    choices, version = snapshot
+    return build_results(question_id, map(tuple, choices), version)
@@ -0,0 +1,115 @@
+"""Read-replica routing for the polls app.
+
+Question and Choice reads go to a random alias of settings.POLLS_REPLICAS.
+Everything else stays on the primary ('default'):
+  - all writes;
+  - Vote reads, so a voter always sees their own vote, and the objects
+    related to a vote, as related objects follow their instance;
+  - querysets with the hint ``fresh=True``, e.g. results loaded into the
+    results cache, so a lagging replica is never cached;
+  - the requests of a user for POLLS_PRIMARY_STICKY_SECONDS after they
+    voted, so detail and results show the new vote before the replicas
+    are synced (`python manage.py sync_replica`).
+"""
+import contextvars
+import random
+import sqlite3
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+STICKY_COOKIE = 'polls_primary'
+
+_use_primary = contextvars.ContextVar('polls_use_primary', default=False)
+
+
+@contextmanager
+def use_primary():
+    """Send the polls reads inside the block to the primary."""
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def stick_to_primary(response):
+    """Keep the user's next requests on the primary for a short while."""
+    response.set_cookie(STICKY_COOKIE, '1', httponly=True, samesite='Lax',
+                        max_age=settings.POLLS_PRIMARY_STICKY_SECONDS)
+    return response
+
+
+def sync_replica(path, timeout=30):
+    """Copy the primary SQLite database to the file `path`.
+
+    The online backup API copies a consistent snapshot while the primary
+    keeps taking votes; readers of the replica see the old or the new copy.
+    """
+    primary = connections[DEFAULT_DB_ALIAS]
+    primary.ensure_connection()
+    replica = sqlite3.connect(path, timeout=timeout)
+    try:
+        with primary.wrap_database_errors:
+            primary.connection.backup(replica)
+    finally:
+        replica.close()
+
+
+class PrimaryReplicaRouter:
+    """Route polls reads to the replicas and writes to the primary."""
+
+    def _replicas(self):
+        return settings.POLLS_REPLICAS
+
+    def db_for_read(self, model, **hints):
+        replicas = self._replicas()
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # related objects are read where their instance came from
+            return instance._state.db
+        if (not replicas or model._meta.app_label != 'polls'
+                or model._meta.model_name == 'vote'
+                or hints.get('fresh') or _use_primary.get()):
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS if self._replicas() else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *self._replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas are whole-file copies of the primary
+        return False if db in self._replicas() else None
+
+
+class StickyPrimaryMiddleware:
+    """Serve a request from the primary while the sticky cookie is set."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if STICKY_COOKIE not in request.COOKIES:
+            return self.get_response(request)
+        with use_primary():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if STICKY_COOKIE not in request.COOKIES:
+            return await self.get_response(request)
+        with use_primary():
+            return await self.get_response(request)
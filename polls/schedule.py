@@ -0,0 +1,163 @@
+"""In-memory schedule of when questions open and close for voting.
+
+The publication and end dates of every question are kept as integer epoch
+microseconds, read as such from SQLite, together with the sorted instants
+at which any question opens or closes. Between two such transitions the
+set of open questions cannot change, so "which polls are open now" is a
+bisect into the transitions and the open set of the current segment is
+reused until the next transition. Whether one question is open is two
+comparisons against its own period. No datetime is built to answer a
+lookup.
+
+Questions already closed when the schedule is loaded are left out: they
+can only reopen through an edit, which reloads the schedule.
+
+The schedule is reloaded after a Question is saved or deleted in this
+process and at least every settings.POLLS_SCHEDULE_TTL seconds, for
+changes made by other processes; while one thread reloads it the others
+keep answering from the previous schedule. Questions whose dates differ
+from the schedule (unsaved, or edited elsewhere) are answered from their
+own dates.
+"""
+import bisect
+import datetime
+import math
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+# one day in microseconds.
+DAY = 24 * 60 * 60 * 1000000
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_micros(moment):
+    """return an aware datetime as integer epoch microseconds."""
+    return (moment - EPOCH) // MICROSECOND
+
+
+def now_micros():
+    """return the current time as integer epoch microseconds."""
+    return time.time_ns() // 1000
+
+
+def _micros_sql(column):
+    # the stored "YYYY-MM-DD HH:MM:SS[.ffffff]" (UTC) as epoch microseconds,
+    # without building a datetime per row in Python.
+    return RawSQL(
+        f"CAST(strftime('%%s', \"polls_question\".\"{column}\") AS INTEGER)"
+        f" * 1000000 + CAST(substr(\"polls_question\".\"{column}\", 21)"
+        f" AS INTEGER)", ())
+
+
+class QuestionSchedule:
+    """Voting periods of all questions with a sorted list of transitions."""
+
+    def __init__(self, rows):
+        """`rows` are (pk, start, end) of every question, in epoch
+        microseconds, end None for questions that never close."""
+        self.periods = {}
+        transitions = set()
+        for pk, start, end in rows:
+            transitions.add(start)
+            if end is None:
+                end = math.inf
+            else:
+                # voting is still allowed at end_date itself
+                transitions.add(end + 1)
+            self.periods[pk] = (start, end)
+        self.transitions = sorted(transitions)
+        self.loaded_at = time.monotonic()
+        self._segment = (None, frozenset())
+
+    def open_ids(self, now=None):
+        """return the ids of the questions open for voting at `now`
+        (epoch microseconds)."""
+        now = now_micros() if now is None else now
+        segment = bisect.bisect_right(self.transitions, now)
+        index, open_ids = self._segment
+        if index != segment:
+            open_ids = frozenset(pk for pk, (start, end) in self.periods.items()
+                                 if start <= now <= end)
+            self._segment = (segment, open_ids)
+        return open_ids
+
+    def period(self, question):
+        """return (start, end) of a question, None if it is not known with
+        the same dates."""
+        period = self.periods.get(question.pk)
+        if period is None or period != (
+                to_micros(question.pub_date),
+                math.inf if question.end_date is None
+                else to_micros(question.end_date)):
+            return None
+        return period
+
+    def is_open(self, question, now=None):
+        """return True if voting on `question` is allowed at `now`, None
+        if the question is not in the schedule."""
+        period = self.period(question)
+        if period is None:
+            return None
+        now = now_micros() if now is None else now
+        return period[0] <= now <= period[1]
+
+
+_schedule = None
+_lock = threading.Lock()
+
+
+def _load():
+    from .models import Question
+
+    # read from the primary (see polls.routers), it gates voting.
+    return QuestionSchedule(
+        Question.objects.db_manager(hints={'fresh': True})
+        .filter(Q(end_date__isnull=True) | Q(end_date__gte=timezone.now()))
+        .annotate(start=_micros_sql('pub_date'), end=_micros_sql('end_date'))
+        .values_list('pk', 'start', 'end').iterator())
+
+
+def _is_stale(schedule):
+    return (schedule is None or time.monotonic() - schedule.loaded_at
+            > settings.POLLS_SCHEDULE_TTL)
+
+
+def get_schedule():
+    """return the process wide QuestionSchedule, loading it if needed."""
+    global _schedule
+    schedule = _schedule
+    if not _is_stale(schedule):
+        return schedule
+    if schedule is None:
+        _lock.acquire()
+    elif not _lock.acquire(blocking=False):
+        return schedule  # being reloaded by another thread
+    try:
+        schedule = _schedule
+        if _is_stale(schedule):
+            schedule = _schedule = _load()
+    finally:
+        _lock.release()
+    return schedule
+
+
+async def aget_schedule():
+    """Async get_schedule()."""
+    schedule = _schedule
+    if _is_stale(schedule):
+        schedule = await sync_to_async(get_schedule)()
+    return schedule
+
+
+def refresh_schedule():
+    """Reload the schedule on its next use."""
+    global _schedule
+    _schedule = None
@@ -0,0 +1,101 @@
+"""Full-text search over questions and their choices.
+
+The SQLite FTS5 table ``polls_question_search`` holds one row per question
+(rowid = question id) with the question text and the text of all its
+choices. Triggers created by migration 0009 keep it in step with every
+insert, update and delete of polls_question and polls_choice, including
+bulk_create and raw SQL; `rebuild()` refills it from scratch
+(`python manage.py rebuild_search_index`).
+
+Matches are ranked with BM25, a match in the question text weighing more
+than one in a choice, and paged with a keyset on (rank, question id).
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.utils import timezone
+
+from .pagination import KeysetPage, decode_cursor, encode_cursor
+
+TABLE = 'polls_question_search'
+
+# BM25 weights of the question_text and choice_text columns.
+WEIGHTS = (2.0, 1.0)
+
+# words of a query beyond this are ignored.
+MAX_WORDS = 8
+
+WORD = re.compile(r'\w+')
+
+
+def match_expression(text):
+    """return an FTS5 MATCH expression finding every word of `text` as a
+    prefix, or '' if `text` has no words.
+
+    Each word is quoted, so user input never reaches the FTS5 query syntax.
+    """
+    words = WORD.findall(text)[:MAX_WORDS]
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _after(cursor):
+    """return the (rank, id) a page starts after, or None."""
+    values = decode_cursor(cursor) if cursor else None
+    if (values is None or len(values) != 2
+            or not isinstance(values[0], (int, float))
+            or not isinstance(values[1], int)):
+        return None
+    return values
+
+
+def search_questions(text, cursor=None, size=20, now=None):
+    """return a KeysetPage of the published questions matching `text`,
+    best match first.
+
+    The questions carry their BM25 `rank` (lower is better).
+    """
+    from .models import Question
+
+    expression = match_expression(text)
+    if not expression:
+        return KeysetPage([], None)
+    using = router.db_for_read(Question)
+    ops = connections[using].ops
+    weights = ', '.join(str(weight) for weight in WEIGHTS)
+    params = [expression,
+              ops.adapt_datetimefield_value(now or timezone.now())]
+    after = ''
+    values = _after(cursor)
+    if values is not None:
+        after = 'AND (s.rank > %s OR (s.rank = %s AND s.rowid > %s))'
+        params += [values[0], values[0], values[1]]
+    params.append(size + 1)
+    items = list(Question.objects.raw(
+        f'SELECT q.*, s.rank FROM ('
+        f'  SELECT rowid, bm25({TABLE}, {weights}) AS rank FROM {TABLE}'
+        f'  WHERE {TABLE} MATCH %s) s'
+        f' JOIN {Question._meta.db_table} q ON q.id = s.rowid'
+        f' WHERE q.pub_date <= %s {after}'
+        f' ORDER BY s.rank, s.rowid LIMIT %s', params, using=using))
+    next_cursor = None
+    if len(items) > size:
+        items = items[:size]
+        next_cursor = encode_cursor((items[-1].rank, items[-1].pk))
+    return KeysetPage(items, next_cursor)
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    """Refill the search index from the questions and choices, merge its
+    b-trees and return the number of questions indexed."""
+    with transaction.atomic(using=using), \
+            connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        cursor.execute(
+            f'INSERT INTO {TABLE}(rowid, question_text, choice_text)'
+            f' SELECT q.id, q.question_text,'
+            f'  coalesce((SELECT group_concat(c.choice_text, char(10))'
+            f'   FROM polls_choice c WHERE c.question_id = q.id), \'\')'
+            f' FROM polls_question q')
+        cursor.execute(f'INSERT INTO {TABLE}({TABLE}) VALUES (\'optimize\')')
+        cursor.execute(f'SELECT count(*) FROM {TABLE}')
+        return cursor.fetchone()[0]
@@ -0,0 +1,107 @@
+"""Signal handlers that keep derived and cached poll data up to date."""
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import archive, snapshots, tally
+from .auth import forget_user
+from .cache import bump_choices_version, invalidate_results
+from .models import (Choice, Question, QuestionResultSnapshot, Vote,
+                     VoteChange, VoteRateBucket)
+from .schedule import refresh_schedule
+
+
+def _sync_cached_choice(vote, delta):
+    """Keep an already-loaded Choice on `vote` in step with the database."""
+    if Vote.choice.is_cached(vote):
+        vote.choice.vote_count += delta
+
+
+def _results_changed(question_id):
+    Question.objects.filter(pk=question_id).touch_results()
+    invalidate_results(question_id)
+
+
+@receiver(post_save, sender=Vote)
+def count_saved_vote(sender, instance, **kwargs):
+    """Count a new vote, or move it when its choice was changed."""
+    old_choice_id = getattr(instance, '_tallied_choice_id', None)
+    if old_choice_id != instance.choice_id:
+        tally.record_vote(old_choice_id, instance.choice_id)
+        snapshots.log_change(instance.user_id, instance.question_id,
+                             old_choice_id, instance.choice_id)
+        _sync_cached_choice(instance, 1)
+        _results_changed(instance.question_id)
+    instance._tallied_choice_id = instance.choice_id
+
+
+@receiver(post_delete, sender=Vote)
+def uncount_deleted_vote(sender, instance, **kwargs):
+    """Remove a deleted vote from its choice counter."""
+    choice_id = getattr(instance, '_tallied_choice_id', instance.choice_id)
+    tally.record_vote(choice_id, None)
+    snapshots.log_change(
+        instance.user_id, instance.question_id, choice_id, None)
+    _results_changed(instance.question_id)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    """Choice text or the set of choices changed."""
+    snapshots.sync_choices(instance.question_id)
+    _results_changed(instance.question_id)
+    bump_choices_version(instance.question_id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    """Voting periods changed: reload the schedule now and after commit."""
+    refresh_schedule()
+    transaction.on_commit(refresh_schedule)
+
+
+@receiver(post_save, sender=Question)
+def create_result_snapshot(sender, instance, created, **kwargs):
+    """A new question starts with an empty results snapshot."""
+    if created and not kwargs.get('raw'):
+        QuestionResultSnapshot.objects.create(question=instance)
+
+
+@receiver(post_delete, sender=Question)
+def forget_question_changes(sender, instance, **kwargs):
+    """The vote changelog and vote rate series of a deleted question go
+    with it."""
+    VoteChange.objects.filter(question_id=instance.pk).delete()
+    VoteRateBucket.objects.filter(question_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Question)
+def restore_reopened_question(sender, instance, created, **kwargs):
+    """A reopened question gets its archived votes back before new ones."""
+    if created or kwargs.get('raw'):
+        return
+    if instance.end_date is not None and instance.end_date < timezone.now():
+        return
+    if archive.is_archived(instance.pk):
+        archive.restore_question(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """Drop the cached user now and after commit, so a concurrent request
+    cannot cache the old row again."""
+    forget_user(instance.pk)
+    transaction.on_commit(lambda: forget_user(instance.pk))
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+    """A logout drops the cached user."""
+    if user is not None:
+        forget_user(user.pk)
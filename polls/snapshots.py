@@ -0,0 +1,271 @@
+"""Per-question results snapshots refreshed from the vote changelog.
+
+Every write that changes votes appends VoteChange rows in its transaction
+(`log_changes()`) and applies them to the QuestionResultSnapshot of each
+question it touched: the counts of the old and new choices move by one,
+the version is bumped and `change_id` records how far the changelog was
+applied. Nothing is recounted, and the results of a question are read
+from one row. A single vote (`log_change()`) is applied by one UPDATE
+editing the JSON in SQLite, the snapshot never leaving the database. The
+vote rate series of polls.history are counted along.
+
+A new question starts with an empty snapshot. Questions created without
+the signals get theirs counted from their votes the first time their
+results are read, and bulk loads (fixture import, benchmark data) rebuild
+the snapshots of their questions the same way. `find_drift()` compares the
+snapshots with counts of the votes and `repair()` rewrites the ones that
+drifted (`python manage.py check_result_snapshots`).
+"""
+from django.db import connections, router, transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from . import history, tally
+from .models import Choice, Question, QuestionResultSnapshot, VoteChange
+
+# questions handled per query: SQLite limits the number of parameters.
+CHUNK_SIZE = 500
+SNAPSHOT_FIELDS = ['choices', 'total', 'version', 'change_id']
+
+# JSON path of the vote count of the choice given as parameter, and the
+# condition that the snapshot lists that choice.
+CHOICE_PATH = ("'$[' || (SELECT key FROM json_each(choices)"
+               " WHERE json_extract(value, '$[0]') = %s) || '][2]'")
+KNOWS_CHOICE = ("EXISTS (SELECT 1 FROM json_each(choices)"
+                " WHERE json_extract(value, '$[0]') = %s)")
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def _snapshots():
+    # read from the primary (see polls.routers): snapshots are written
+    # from what they held before.
+    return QuestionResultSnapshot.objects.db_manager(hints={'fresh': True})
+
+
+def log_changes(changes):
+    """Append (user id, question id, old choice id, new choice id) vote
+    changes to the changelog and apply them to the snapshots."""
+    now = timezone.now()
+    rows = [VoteChange(user_id=user_id, question_id=question_id,
+                       old_choice_id=old, new_choice_id=new, changed_at=now)
+            for user_id, question_id, old, new in changes if old != new]
+    if not rows:
+        return
+    with transaction.atomic(savepoint=False):
+        VoteChange.objects.bulk_create(rows, batch_size=CHUNK_SIZE)
+        history.count_changes(
+            [(row.question_id, row.old_choice_id, row.new_choice_id)
+             for row in rows], now)
+        refresh({row.question_id for row in rows})
+
+
+def log_change(user_id, question_id, old, new):
+    """log_changes() of one vote change, applied to the snapshot with a
+    single UPDATE."""
+    if old == new:
+        return
+    using = router.db_for_write(VoteChange)
+    connection = connections[using]
+    changes = connection.ops.quote_name(VoteChange._meta.db_table)
+    snapshots = connection.ops.quote_name(
+        QuestionResultSnapshot._meta.db_table)
+    choices, guards = 'choices', []
+    choices_params, guard_params = [], []
+    for choice_id, delta in ((old, '- 1'), (new, '+ 1')):
+        if choice_id is not None:
+            choices = (f'json_set({choices}, {CHOICE_PATH},'
+                       f' json_extract(choices, {CHOICE_PATH}) {delta})')
+            choices_params += [choice_id, choice_id]
+            guards.append(KNOWS_CHOICE)
+            guard_params.append(choice_id)
+    total = (new is not None) - (old is not None)
+    now = timezone.now()
+    with transaction.atomic(using=using, savepoint=False), \
+            connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {changes} (question_id, user_id, old_choice_id,'
+            f' new_choice_id, changed_at) VALUES (%s, %s, %s, %s, %s)'
+            f' RETURNING id',
+            [question_id, user_id, old, new,
+             connection.ops.adapt_datetimefield_value(now)])
+        change_id = cursor.fetchone()[0]
+        history.count_changes([(question_id, old, new)], now)
+        # only a snapshot with every earlier change applied is moved on
+        cursor.execute(
+            f'UPDATE {snapshots} SET choices = {choices},'
+            f' total = total + %s, version = version + 1, change_id = %s'
+            f' WHERE question_id = %s AND change_id = COALESCE((SELECT'
+            f' max(id) FROM {changes} WHERE question_id = %s AND id < %s), 0)'
+            f' AND {" AND ".join(guards)}',
+            [*choices_params, total, change_id, question_id, question_id,
+             change_id, *guard_params])
+        if not cursor.rowcount:
+            refresh([question_id])
+
+
+def _apply(snapshot, changes):
+    """Apply (old choice id, new choice id) changes to a snapshot; return
+    False if one names a choice the snapshot does not know."""
+    rows = {row[0]: row for row in snapshot.choices}
+    for old, new in changes:
+        for choice_id, delta in ((old, -1), (new, 1)):
+            if choice_id is None:
+                continue
+            if choice_id not in rows:
+                return False
+            rows[choice_id][2] += delta
+    snapshot.total = sum(votes for _, _, votes in snapshot.choices)
+    snapshot.version += 1
+    return True
+
+
+def _refresh_chunk(question_ids):
+    snapshots = {snapshot.pk: snapshot
+                 for snapshot in _snapshots().filter(pk__in=question_ids)}
+    if not snapshots:
+        return 0
+    pending = {}
+    for change_id, question_id, old, new in (
+            VoteChange.objects.filter(
+                question_id__in=list(snapshots),
+                id__gt=min(snapshot.change_id
+                           for snapshot in snapshots.values()))
+            .order_by('id').values_list(
+                'id', 'question_id', 'old_choice_id', 'new_choice_id')):
+        snapshot = snapshots[question_id]
+        if change_id > snapshot.change_id:
+            pending.setdefault(question_id, []).append((old, new))
+            snapshot.change_id = change_id
+    updated, unknown = [], []
+    for question_id, changes in pending.items():
+        snapshot = snapshots[question_id]
+        (updated if _apply(snapshot, changes) else unknown).append(question_id)
+    _snapshots().bulk_update([snapshots[pk] for pk in updated],
+                             SNAPSHOT_FIELDS)
+    if unknown:
+        # a choice added behind the signals' back: count these again
+        rebuild(unknown)
+    return sum(len(changes) for changes in pending.values())
+
+
+def refresh(question_ids=None):
+    """Apply the logged changes not yet in the snapshots of some questions,
+    or of all; return how many were applied. Questions without a snapshot
+    are left to be counted when read."""
+    if question_ids is None:
+        question_ids = _snapshots().filter(Exists(VoteChange.objects.filter(
+            question_id=OuterRef('pk'), id__gt=OuterRef('change_id')),
+        )).values_list('pk', flat=True)
+    applied = 0
+    with transaction.atomic(savepoint=False):
+        for chunk in _chunks(question_ids):
+            applied += _refresh_chunk(chunk)
+    return applied
+
+
+def count_results(question_ids):
+    """return {question id: [[choice id, choice text, votes], ...]} of the
+    existing questions among `question_ids`, counted from their votes."""
+    results = {pk: [] for pk in Question.objects.db_manager(
+        hints={'fresh': True}).filter(pk__in=question_ids)
+        .values_list('pk', flat=True)}
+    counted = tally.count_votes(list(results))
+    for pk, question_id, text in (
+            Choice.objects.db_manager(hints={'fresh': True})
+            .filter(question_id__in=list(results)).order_by('pk')
+            .values_list('pk', 'question_id', 'choice_text')):
+        results[question_id].append([pk, text, counted.get(pk, 0)])
+    return results
+
+
+def _rebuild_chunk(question_ids):
+    results = count_results(question_ids)
+    last_changes = dict(
+        VoteChange.objects.filter(question_id__in=list(results))
+        .values('question').annotate(last=Max('id'))
+        .values_list('question', 'last'))
+    versions = dict(_snapshots().filter(pk__in=list(results))
+                    .values_list('pk', 'version'))
+    snapshots = [
+        QuestionResultSnapshot(
+            question_id=question_id, choices=choices,
+            total=sum(votes for _, _, votes in choices),
+            version=versions.get(question_id, 0) + 1,
+            change_id=last_changes.get(question_id, 0))
+        for question_id, choices in results.items()]
+    _snapshots().bulk_create(
+        snapshots, update_conflicts=True, unique_fields=['question'],
+        update_fields=SNAPSHOT_FIELDS)
+    return snapshots
+
+
+def rebuild(question_ids=None):
+    """Count the snapshots of some questions, or of all, from their votes;
+    return the new snapshots."""
+    if question_ids is None:
+        question_ids = Question.objects.db_manager(
+            hints={'fresh': True}).values_list('pk', flat=True)
+    snapshots = []
+    with transaction.atomic():
+        for chunk in _chunks(question_ids):
+            snapshots.extend(_rebuild_chunk(chunk))
+    return snapshots
+
+
+def get_snapshot(question_id):
+    """return ([[choice id, choice text, votes], ...], version) of a
+    question from its snapshot, counting the snapshot first if it has none."""
+    snapshot = _snapshots().filter(pk=question_id).values_list(
+        'choices', 'version').first()
+    if snapshot is None:
+        snapshots = rebuild([question_id])
+        snapshot = ((snapshots[0].choices, snapshots[0].version)
+                    if snapshots else ([], 0))
+    return snapshot
+
+
+def sync_choices(question_id):
+    """Follow an added, edited or deleted choice in the snapshot of its
+    question."""
+    snapshot = _snapshots().filter(pk=question_id).first()
+    if snapshot is None:
+        return
+    votes = {pk: count for pk, _, count in snapshot.choices}
+    snapshot.choices = [
+        [pk, text, votes.get(pk, 0)] for pk, text in
+        Choice.objects.db_manager(hints={'fresh': True})
+        .filter(question_id=question_id).order_by('pk')
+        .values_list('pk', 'choice_text')]
+    snapshot.total = sum(count for _, _, count in snapshot.choices)
+    snapshot.version += 1
+    snapshot.save(update_fields=['choices', 'total', 'version'])
+
+
+def find_drift():
+    """return [(question id, snapshot choices, counted choices)] for every
+    snapshot that differs from a count of the votes."""
+    drift = []
+    for chunk in _chunks(_snapshots().order_by('pk').values_list(
+            'pk', flat=True)):
+        with transaction.atomic():
+            counted = count_results(chunk)
+            for snapshot in _snapshots().filter(pk__in=chunk).only(
+                    'choices', 'total'):
+                expected = counted.get(snapshot.pk, [])
+                if (snapshot.choices != expected or snapshot.total
+                        != sum(votes for _, _, votes in expected)):
+                    drift.append((snapshot.pk, snapshot.choices, expected))
+    return drift
+
+
+def repair():
+    """Rewrite every snapshot that drifted from the votes and return the
+    drift found."""
+    drift = find_drift()
+    rebuild(question_id for question_id, _, _ in drift)
+    return drift
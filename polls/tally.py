@@ -0,0 +1,69 @@
+"""Bookkeeping for the denormalized per-choice vote counters."""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import ArchivedVote, Choice, Vote
+
+
+def record_vote(old_choice_id, new_choice_id):
+    """Move one vote from `old_choice_id` to `new_choice_id`.
+
+    Either side may be None (a new vote has no old choice, a deleted vote
+    has no new one). Counters are changed with F() expressions so concurrent
+    writers never lose an increment.
+    """
+    if old_choice_id == new_choice_id:
+        return
+    deltas = {}
+    if old_choice_id is not None:
+        deltas[old_choice_id] = -1
+    if new_choice_id is not None:
+        deltas[new_choice_id] = 1
+    apply_deltas(deltas)
+
+
+def apply_deltas(deltas):
+    """Add {choice_id: change} to the counters, one UPDATE per choice."""
+    with transaction.atomic():
+        for choice_id, delta in deltas.items():
+            if delta:
+                Choice.objects.filter(pk=choice_id).update(
+                    vote_count=F('vote_count') + delta)
+
+
+def count_votes(question_ids=None):
+    """return {choice_id: vote amount} counted from the Vote table and the
+    archived votes (see polls.archive), of some questions or of all."""
+    counted = Counter()
+    for model in (Vote, ArchivedVote):
+        votes = model.objects.db_manager(hints={'fresh': True})
+        if question_ids is not None:
+            votes = votes.filter(question_id__in=question_ids)
+        for choice_id, total in (
+                votes.values('choice').annotate(total=Count('id'))
+                .values_list('choice', 'total')):
+            counted[choice_id] += total
+    return counted
+
+
+def find_drift():
+    """return [(choice, stored count, real count)] for every wrong counter."""
+    counted = count_votes()
+    drift = []
+    for choice in (Choice.objects.db_manager(hints={'fresh': True})
+                   .only('id', 'vote_count').iterator()):
+        real = counted.get(choice.id, 0)
+        if choice.vote_count != real:
+            drift.append((choice, choice.vote_count, real))
+    return drift
+
+
+def rebuild():
+    """Recount every choice from the Vote table and return what was fixed."""
+    with transaction.atomic():
+        drift = find_drift()
+        for choice, _, real in drift:
+            Choice.objects.filter(pk=choice.pk).update(vote_count=real)
+    return drift
@@ -0,0 +1,12 @@
+"""Template tags for caching poll page fragments."""
+from django import template
+
+from ..cache import choices_version as _choices_version
+
+register = template.Library()
+
+
+@register.simple_tag
+def choices_version(question_id):
+    """return the choice set version of a question, to key {% cache %}."""
+    return _choices_version(question_id)
@@ -1,10 +1,42 @@
 import datetime
+import json
+import sqlite3
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.http import HttpResponse
+from django.test import (RequestFactory, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from django.urls import reverse
+from django.urls import include, path, reverse
 
-from .models import Question, Vote, User
+from . import api, archive, benchmark, export, history, snapshots, tally
+from . import schedule as schedule_module
+from .cache import LRUStore, choices_version, get_results_cache
+from .ingest import VoteIngestor
+from .live import ResultsPublisher, publisher
+from .middleware import QueryRecorder, request_metrics
+from .pagination import encode_cursor
+from .models import (ArchivedVote, Choice, Question, QuestionArchive,
+                     QuestionResultSnapshot, ResultsCheckpoint, User, Vote,
+                     VoteChange, VoteRateBucket)
+from .ratelimit import (MemoryBuckets, SQLiteBuckets, get_vote_limiter,
+                        reset_vote_limiter)
+from .routers import (STICKY_COOKIE, PrimaryReplicaRouter,
+                      StickyPrimaryMiddleware, sync_replica, use_primary)
+from .schedule import QuestionSchedule, get_schedule, to_micros
+from .urls import build_urlpatterns
+from .voting import cast_vote
 
 
 def create_question(question_text, pub_days, end_days):
@@ -93,6 +125,84 @@ class QuestionModelTests(TestCase):
         self.assertIs(question.can_vote(), True)
 
 
+class QuestionScheduleTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize questions with different voting periods for test"""
+        self.open = create_question('Open', pub_days=-1, end_days=3)
+        self.closed = create_question('Closed', pub_days=-3, end_days=-1)
+        self.future = create_question('Future', pub_days=2, end_days=5)
+        self.endless = Question.objects.create(
+            question_text='Endless',
+            pub_date=timezone.localtime() - datetime.timedelta(days=1))
+
+    def test_open_ids(self):
+        """The schedule lists the questions open now."""
+        self.assertEqual({self.open.pk, self.endless.pk},
+                         get_schedule().open_ids())
+
+    def test_transitions(self):
+        """Open sets change exactly at pub_date and just after end_date."""
+        schedule = get_schedule()
+        start = to_micros(self.future.pub_date)
+        end = to_micros(self.future.end_date)
+        self.assertNotIn(self.future.pk, schedule.open_ids(start - 1))
+        self.assertIn(self.future.pk, schedule.open_ids(start))
+        self.assertIn(self.future.pk, schedule.open_ids(end))
+        self.assertNotIn(self.future.pk, schedule.open_ids(end + 1))
+        self.assertEqual(schedule.periods[self.future.pk],
+                         schedule.period(self.future))
+
+    def test_is_open_reads_the_period(self):
+        """One question is answered from its period, without building
+        the open set of a segment."""
+        schedule = get_schedule()
+        segment = schedule._segment
+        start = to_micros(self.future.pub_date)
+        end = to_micros(self.future.end_date)
+        self.assertEqual(
+            [False, True, True, False],
+            [schedule.is_open(self.future, now)
+             for now in (start - 1, start, end, end + 1)])
+        self.assertIs(segment, schedule._segment)
+
+    def test_saving_a_question_refreshes_the_schedule(self):
+        """A closed question reopened is open right away."""
+        get_schedule()
+        self.closed.end_date = timezone.localtime() + datetime.timedelta(days=1)
+        self.closed.save()
+        self.assertIn(self.closed.pk, get_schedule().open_ids())
+
+    def test_closed_questions_are_left_out(self):
+        """Questions closed at load time are answered from their dates."""
+        schedule = get_schedule()
+        self.assertNotIn(self.closed.pk, schedule.periods)
+        self.assertIs(False, self.closed.can_vote(schedule))
+
+    def test_stale_schedule_served_while_reloading(self):
+        """Other threads keep the old schedule while one reloads it."""
+        schedule = get_schedule()
+        with override_settings(POLLS_SCHEDULE_TTL=-1), schedule_module._lock:
+            self.assertIs(schedule, get_schedule())
+
+    def test_unknown_dates_fall_back_to_the_question(self):
+        """Questions edited elsewhere are answered from their own dates."""
+        schedule = QuestionSchedule([])
+        self.assertIsNone(schedule.is_open(self.open))
+        self.assertIs(True, self.open.can_vote(schedule))
+        self.assertIs(False, self.closed.can_vote(schedule))
+
+    def test_closed_question_rejects_votes(self):
+        """vote() refuses questions outside their voting period."""
+        user = User.objects.create_user('Test15', password='password')
+        self.client.force_login(user)
+        choice = self.closed.choice_set.create(choice_text='late')
+        response = self.client.post(
+            reverse('polls:vote', args=(self.closed.id,)),
+            {'choice': choice.id})
+        self.assertRedirects(response, reverse('polls:index'))
+        self.assertFalse(Vote.objects.exists())
+
+
 class QuestionIndexViewTests(TestCase):
     def test_no_questions(self):
         """
@@ -156,10 +266,47 @@ class QuestionIndexViewTests(TestCase):
             [question2, question1],
         )
 
+    def test_index_pages_with_cursor(self):
+        """
+        The index shows every published question, one page at a time,
+        marking which ones are open for voting.
+        """
+        questions = [create_question(question_text=f'Question {number}',
+                                     pub_days=-number - 1, end_days=2 * number - 1)
+                     for number in range(5)]
+        with self.settings(POLLS_INDEX_PAGE_SIZE=2):
+            pages, cursor = [], None
+            while True:
+                response = self.client.get(reverse('polls:index'),
+                                           {'after': cursor} if cursor else {})
+                pages.append(response.context['latest_question_list'])
+                cursor = response.context['next_cursor']
+                if cursor is None:
+                    break
+        self.assertEqual([2, 2, 1], [len(page) for page in pages])
+        shown = [question for page in pages for question in page]
+        self.assertEqual(questions, shown)
+        self.assertEqual([False, True, True, True, True],
+                         [question.is_open for question in shown])
+
+    def test_tampered_cursor_shows_first_page(self):
+        """A cursor with values that cannot be queried shows the first page."""
+        question = create_question(question_text='Only', pub_days=-1,
+                                   end_days=1)
+        for values in (['2022-01-01', 99999999999999999999999],
+                       ['yesterday', 1]):
+            cursor = encode_cursor(values)
+            for url in (reverse('polls:index'), reverse('polls:api-polls')):
+                response = self.client.get(url, {'after': cursor})
+                self.assertEqual(200, response.status_code)
+            self.assertEqual([question.id], [
+                poll['id'] for poll in response.json()['polls']])
+
 
 class QuestionDetailViewTests(TestCase):
     def setUp(self) -> None:
         """Initialize user for test"""
+        caches['template_fragments'].clear()
         self.user = User.objects.create_user('Test1', password='password')
         self.user.save()
         self.client.login(username='Test1', password='password')
@@ -190,6 +337,7 @@ class QuestionDetailViewTests(TestCase):
 class VoteViewTests(TestCase):
     def setUp(self) -> None:
         """Initialize user for test"""
+        reset_vote_limiter()
         self.user = User.objects.create_user('Test2', password='password')
         self.user.save()
         self.client.login(username='Test2', password='password')
@@ -245,3 +393,1420 @@ class VoteViewTests(TestCase):
         self.assertEqual(Vote.objects.get(
             user=self.user, choice__in=ques.choice_set.all()).choice, choice2)
         self.assertEqual(Vote.objects.all().count(), 1)
+
+
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+@override_settings(POLLS_USER_CACHE_SECONDS=300, AUTHENTICATION_BACKENDS=[
+    'polls.auth.CachedModelBackend', MODEL_BACKEND])
+class CachedSessionUserTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize user, question and empty auth cache for test"""
+        caches['auth'].clear()
+        self.user = User.objects.create_user('Test16', password='password')
+        self.question = create_question(
+            question_text='Cached user', pub_days=-1, end_days=3)
+        self.choice = self.question.choice_set.create(choice_text='one')
+        self.url = reverse('polls:detail', args=(self.question.id,))
+
+    def auth_queries(self, path):
+        """return the session and user queries of a GET of `path`."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(200, response.status_code)
+        return [query['sql'] for query in queries.captured_queries
+                if 'django_session' in query['sql']
+                or 'auth_user' in query['sql']]
+
+    def test_user_loaded_once(self):
+        """The user of a session is read once, then from the cache."""
+        self.client.force_login(self.user)
+        self.assertEqual(2, len(self.auth_queries(self.url)))
+        self.assertEqual(1, len(self.auth_queries(self.url)))
+
+    @override_settings(
+        SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions_skip_the_database(self):
+        """With signed cookies and the user cache, no auth query is left."""
+        self.client.force_login(self.user)
+        self.auth_queries(self.url)
+        self.assertEqual([], self.auth_queries(self.url))
+
+    def test_password_change_ends_other_sessions(self):
+        """A cached user does not keep a session with an old password."""
+        self.client.force_login(self.user)
+        self.auth_queries(self.url)
+        self.user.set_password('changed')
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertRedirects(response, f'/accounts/login/?next={self.url}',
+                             fetch_redirect_response=False)
+
+    def test_sessions_of_the_model_backend_stay(self):
+        """Sessions started before the user cache was turned on are kept."""
+        self.client.force_login(self.user, backend=MODEL_BACKEND)
+        self.assertEqual(200, self.client.get(self.url).status_code)
+
+    def test_logout_forgets_the_user(self):
+        """Logging out drops the cached user."""
+        self.client.force_login(self.user)
+        self.auth_queries(self.url)
+        self.assertIsNotNone(caches['auth'].get(f'polls:user:{self.user.pk}'))
+        self.client.post(reverse('logout'))
+        self.assertIsNone(caches['auth'].get(f'polls:user:{self.user.pk}'))
+
+
+class VoteLimiterTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize logged in user and question for test"""
+        self.user = User.objects.create_user('Test17', password='password')
+        self.client.force_login(self.user)
+        self.question = create_question(
+            question_text='Limited', pub_days=-1, end_days=3)
+        self.choice1 = self.question.choice_set.create(choice_text='one')
+        self.choice2 = self.question.choice_set.create(choice_text='two')
+        self.url = reverse('polls:vote', args=(self.question.id,))
+
+    def test_token_bucket_refills(self):
+        """A bucket allows `burst` takes, then one per 1/rate seconds."""
+        buckets = MemoryBuckets()
+        takes = [buckets.take('k', 2, 3, 100)[0] for _ in range(4)]
+        self.assertEqual([True, True, True, False], takes)
+        self.assertIs(False, buckets.take('k', 2, 3, 100.4)[0])
+        self.assertIs(True, buckets.take('k', 2, 3, 100.6)[0])
+
+    def test_shared_sqlite_buckets(self):
+        """The SQLite buckets behave like the in-process ones."""
+        with tempfile.TemporaryDirectory() as directory:
+            buckets = SQLiteBuckets(str(Path(directory) / 'limits.sqlite3'))
+            takes = [buckets.take('k', 2, 3, 100)[0] for _ in range(4)]
+            self.assertEqual([True, True, True, False], takes)
+            self.assertIs(True, buckets.take('k', 2, 3, 100.6)[0])
+            buckets._connection().close()
+
+    @override_settings(POLLS_VOTE_RATE=1, POLLS_VOTE_BURST=2,
+                       POLLS_VOTE_COALESCE_SECONDS=0)
+    def test_user_limit_answers_429(self):
+        """Votes beyond the user's burst are rejected before any query."""
+        for choice in (self.choice1, self.choice2):
+            self.client.post(self.url, {'choice': choice.id})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'choice': self.choice1.id})
+        self.assertEqual(429, response.status_code)
+        self.assertEqual('1', response['Retry-After'])
+        self.assertFalse(any('polls_' in query['sql']
+                             for query in queries.captured_queries))
+        self.assertEqual(1, get_vote_limiter().stats()['rejected_user'])
+        self.assertEqual(self.choice2.id, Vote.objects.get().choice_id)
+
+    @override_settings(POLLS_VOTE_IP_RATE=1, POLLS_VOTE_IP_BURST=1)
+    def test_ip_limit(self):
+        """The client IP has its own bucket."""
+        self.client.post(self.url, {'choice': self.choice1.id})
+        response = self.client.post(self.url, {'choice': self.choice2.id},
+                                    REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(429, response.status_code)
+        response = self.client.post(self.url, {'choice': self.choice2.id},
+                                    REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(302, response.status_code)
+
+    @override_settings(POLLS_VOTE_COALESCE_SECONDS=60)
+    def test_double_click_is_coalesced(self):
+        """An identical vote right after the first one skips the database."""
+        first = self.client.post(self.url, {'choice': self.choice1.id})
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.post(self.url, {'choice': self.choice1.id})
+        self.assertEqual(first['Location'], second['Location'])
+        self.assertFalse(any('polls_' in query['sql']
+                             for query in queries.captured_queries))
+        stats = get_vote_limiter().stats()
+        self.assertEqual((1, 1), (stats['allowed'], stats['coalesced']))
+        self.client.post(self.url, {'choice': self.choice2.id})
+        self.assertEqual(self.choice2.id, Vote.objects.get().choice_id)
+
+    @override_settings(POLLS_VOTE_COALESCE_SECONDS=60)
+    def test_vote_back_is_not_coalesced(self):
+        """Voting A, B and A again stores A: only a repeat of the last
+        accepted choice is coalesced."""
+        for choice in (self.choice1, self.choice2, self.choice1):
+            self.client.post(self.url, {'choice': choice.id})
+        self.assertEqual(self.choice1.id, Vote.objects.get().choice_id)
+        self.assertEqual(0, get_vote_limiter().stats()['coalesced'])
+
+    @override_settings(POLLS_VOTE_COALESCE_SECONDS=60)
+    def test_failed_vote_is_not_coalesced(self):
+        """A vote that was refused can be retried at once."""
+        self.question.end_date = timezone.now() - datetime.timedelta(days=1)
+        self.question.save()
+        self.client.post(self.url, {'choice': self.choice1.id})
+        self.question.end_date = timezone.now() + datetime.timedelta(days=1)
+        self.question.save()
+        self.client.post(self.url, {'choice': self.choice1.id})
+        self.assertEqual(1, Vote.objects.count())
+
+
+class VoteCounterTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize user and question for test"""
+        self.user = User.objects.create_user('Test3', password='password')
+        self.question = create_question(
+            question_text='Counter', pub_days=-1, end_days=3)
+        self.choice1 = self.question.choice_set.create(choice_text='one')
+        self.choice2 = self.question.choice_set.create(choice_text='two')
+
+    def test_change_vote_moves_count(self):
+        """Changing a vote moves it from the old choice to the new one."""
+        vote = Vote.objects.create(user=self.user, choice=self.choice1)
+        vote = Vote.objects.get(pk=vote.pk)
+        vote.choice = self.choice2
+        vote.save()
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual(0, self.choice1.votes())
+        self.assertEqual(1, self.choice2.votes())
+
+    def test_delete_vote_decreases_count(self):
+        """Deleting votes (also through a queryset) decreases the count."""
+        Vote.objects.create(user=self.user, choice=self.choice1)
+        Vote.objects.filter(choice=self.choice1).delete()
+        self.choice1.refresh_from_db()
+        self.assertEqual(0, self.choice1.votes())
+
+    def test_rebuild_vote_counts(self):
+        """rebuild_vote_counts fixes counters that drifted from Vote rows."""
+        Vote.objects.create(user=self.user, choice=self.choice1)
+        Choice.objects.filter(pk=self.choice1.pk).update(vote_count=7)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_vote_counts', '--check', stdout=StringIO())
+        call_command('rebuild_vote_counts', stdout=StringIO())
+        self.choice1.refresh_from_db()
+        self.assertEqual(1, self.choice1.votes())
+        call_command('rebuild_vote_counts', '--check', stdout=StringIO())
+
+    def test_saving_stale_choice_keeps_count(self):
+        """Saving a choice loaded before a vote doesn't reset its count."""
+        stale = Choice.objects.get(pk=self.choice1.pk)
+        cast_vote(self.user.id, self.question.id, self.choice1.id)
+        stale.choice_text = 'first'
+        stale.save()
+        self.choice1.refresh_from_db()
+        self.assertEqual('first', self.choice1.choice_text)
+        self.assertEqual(1, self.choice1.votes())
+        self.assertEqual([], snapshots.find_drift())
+
+
+class QuestionResultsViewTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize question with votes for test"""
+        get_results_cache().clear()
+        self.question = create_question(
+            question_text='Results', pub_days=-1, end_days=3)
+        self.choice1 = self.question.choice_set.create(choice_text='one')
+        self.choice2 = self.question.choice_set.create(choice_text='two')
+        for name in ('a', 'b', 'c'):
+            user = User.objects.create_user(name, password='password')
+            Vote.objects.create(user=user, choice=self.choice1)
+        Vote.objects.create(
+            user=User.objects.create_user('d', password='password'),
+            choice=self.choice2)
+
+    def test_results_total_and_percent(self):
+        """Results hold every choice count with total and percentages."""
+        response = self.client.get(
+            reverse('polls:results', args=(self.question.id,)))
+        results = response.context['results']
+        self.assertEqual(4, results.total)
+        self.assertEqual([(self.choice1.id, 3, 75.0), (self.choice2.id, 1, 25.0)],
+                         [(c.id, c.votes, c.percent) for c in results.choices])
+
+    def test_results_query_count_does_not_grow_with_choices(self):
+        """Results page runs the same number of queries for any choice count."""
+        url = reverse('polls:results', args=(self.question.id,))
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(10):
+                self.question.choice_set.create(choice_text=f'extra {number}')
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize logged in user and question with choices for test"""
+        caches['template_fragments'].clear()
+        get_results_cache().clear()
+        self.user = User.objects.create_user('Test13', password='password')
+        self.client.force_login(self.user)
+        self.question = create_question(
+            question_text='Cached', pub_days=-1, end_days=3)
+        self.choice = self.question.choice_set.create(choice_text='first')
+        self.question.choice_set.create(choice_text='second')
+        self.url = reverse('polls:detail', args=(self.question.id,))
+
+    def test_choice_list_is_cached(self):
+        """The choices of the detail page are not queried again."""
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.url)
+        self.assertFalse(any('polls_choice' in query['sql']
+                             and 'polls_vote' not in query['sql']
+                             for query in first.captured_queries))
+
+    def test_changed_choice_is_shown(self):
+        """Editing a choice starts a new choice set version."""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice.choice_text = 'renamed'
+            self.choice.save()
+        self.assertContains(self.client.get(self.url), 'renamed')
+
+    def test_previous_select_is_per_vote(self):
+        """Users with different votes do not share the choice list."""
+        self.client.get(self.url)
+        cast_vote(self.user.id, self.question.id, self.choice.id)
+        self.assertContains(self.client.get(self.url),
+                            'first -> Previous select')
+
+    def test_results_follow_votes(self):
+        """The cached results table changes with the counts."""
+        url = reverse('polls:results', args=(self.question.id,))
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.user.id, self.question.id, self.choice.id)
+        self.assertContains(self.client.get(url), '100.0%')
+
+    def test_results_fragment_keyed_on_version(self):
+        """The results table is keyed on the snapshot version, not on
+        the counts it shows."""
+        results = get_results_cache().get(self.question.id)
+        self.assertIsInstance(results.version, int)
+        self.client.get(reverse('polls:results', args=(self.question.id,)))
+        key = make_template_fragment_key(
+            'poll_results', [self.question.id,
+                             choices_version(self.question.id),
+                             results.version])
+        self.assertIsNotNone(caches['template_fragments'].get(key))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize question with a choice and a voter for test"""
+        get_results_cache().clear()
+        self.user = User.objects.create_user('Test14', password='password')
+        self.question = create_question(
+            question_text='Conditional', pub_days=-1, end_days=3)
+        self.choice = self.question.choice_set.create(choice_text='one')
+        self.results_url = reverse('polls:results', args=(self.question.id,))
+
+    def test_unchanged_results_are_not_modified(self):
+        """A matching ETag gets 304 without loading the results."""
+        response = self.client.get(self.results_url)
+        self.assertIn('Last-Modified', response)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn(f's-maxage={settings.POLLS_PUBLIC_MAX_AGE}',
+                      response['Cache-Control'])
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                self.results_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+    def test_vote_changes_results_version(self):
+        """Votes, through cast_vote() or the ORM, move the ETag on."""
+        etag = self.client.get(self.results_url)['ETag']
+        cast_vote(self.user.id, self.question.id, self.choice.id)
+        response = self.client.get(self.results_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        etag = response['ETag']
+        Vote.objects.filter(user=self.user).delete()
+        response = self.client.get(self.results_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+
+    def test_index_version(self):
+        """The poll list is not modified until a question is added."""
+        url = reverse('polls:index')
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        create_question(question_text='Another', pub_days=-1, end_days=3)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Another')
+
+    def test_logged_in_pages_are_private(self):
+        """Pages of signed in users are not stored by shared caches."""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('polls:index'))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+
+class ResultsCacheTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize question and voter for test"""
+        self.cache = get_results_cache()
+        self.cache.clear()
+        self.user = User.objects.create_user('Test4', password='password')
+        self.question = create_question(
+            question_text='Cached', pub_days=-1, end_days=3)
+        self.choice = self.question.choice_set.create(choice_text='one')
+
+    def test_second_request_is_cache_hit(self):
+        """Results are loaded once and then served from the cache."""
+        url = reverse('polls:results', args=(self.question.id,))
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertContains(response, 'one')
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+
+    def test_vote_invalidates_cache(self):
+        """Saving or deleting a vote drops the cached results."""
+        self.assertEqual(0, self.cache.get(self.question.id).total)
+        with self.captureOnCommitCallbacks(execute=True):
+            vote = Vote.objects.create(user=self.user, choice=self.choice)
+        self.assertEqual(1, self.cache.get(self.question.id).total)
+        with self.captureOnCommitCallbacks(execute=True):
+            vote.delete()
+        self.assertEqual(0, self.cache.get(self.question.id).total)
+
+    def test_results_loaded_before_a_vote_are_not_kept(self):
+        """Results loaded while a vote commits are not served after it."""
+        stale = self.cache.get(self.question.id)
+        self.cache.clear()
+
+        def load_during_vote(question_id):
+            with self.captureOnCommitCallbacks(execute=True):
+                cast_vote(self.user.id, question_id, self.choice.id)
+            return stale
+
+        with mock.patch('polls.cache.load_results',
+                        side_effect=load_during_vote):
+            self.assertEqual(0, self.cache.get(self.question.id).total)
+        self.assertEqual(1, self.cache.get(self.question.id).total)
+        self.assertEqual((0, 2), (self.cache.hits, self.cache.misses))
+
+    def test_lru_store_evicts_least_recently_used(self):
+        """LRUStore keeps at most max_entries keys."""
+        store = LRUStore(max_entries=2)
+        store.set('a', 1)
+        store.set('b', 2)
+        store.get('a')
+        store.set('c', 3)
+        self.assertEqual(2, len(store))
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(1, store.get('a'))
+
+    def test_stats_only_for_staff(self):
+        """Monitoring counters are shown to staff users only."""
+        self.client.login(username='Test4', password='password')
+        self.assertEqual(302, self.client.get(reverse('polls:stats')).status_code)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('polls:stats'))
+        self.assertIn('hits', response.json()['results_cache'])
+
+
+class VoteIngestorTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize users, question and an unstarted ingestor for test"""
+        self.user1 = User.objects.create_user('Test5', password='password')
+        self.user2 = User.objects.create_user('Test6', password='password')
+        self.question = create_question(
+            question_text='Batched', pub_days=-1, end_days=3)
+        self.choice1 = self.question.choice_set.create(choice_text='one')
+        self.choice2 = self.question.choice_set.create(choice_text='two')
+        self.ingestor = VoteIngestor(batch_size=2)
+
+    def test_flush_writes_one_vote_per_user_and_question(self):
+        """The last queued ballot of a user wins and counters follow it."""
+        self.ingestor.submit(self.user1.id, self.question.id, self.choice1.id)
+        self.ingestor.submit(self.user2.id, self.question.id, self.choice1.id)
+        self.ingestor.submit(self.user1.id, self.question.id, self.choice2.id)
+        self.assertEqual(3, self.ingestor.flush())
+        self.assertEqual(2, Vote.objects.count())
+        self.assertEqual(self.choice2, Vote.objects.get(user=self.user1).choice)
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual((1, 1), (self.choice1.votes(), self.choice2.votes()))
+
+    def test_flush_updates_existing_vote(self):
+        """A queued ballot changes the vote the user already has."""
+        Vote.objects.create(user=self.user1, choice=self.choice1)
+        self.ingestor.submit(self.user1.id, self.question.id, self.choice2.id)
+        self.ingestor.flush()
+        self.assertEqual(self.choice2, Vote.objects.get(user=self.user1).choice)
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual((0, 1), (self.choice1.votes(), self.choice2.votes()))
+        self.assertEqual([], tally.find_drift())
+
+
+class VoteIngestorRetryTests(TransactionTestCase):
+    def setUp(self) -> None:
+        """Initialize users, question and an unstarted ingestor for test"""
+        self.user1 = User.objects.create_user('Test25', password='password')
+        self.user2 = User.objects.create_user('Test26', password='password')
+        self.question = create_question(
+            question_text='Retried', pub_days=-1, end_days=3)
+        self.choice = self.question.choice_set.create(choice_text='one')
+        self.ingestor = VoteIngestor(batch_size=10)
+
+    def test_bad_ballot_drops_only_itself(self):
+        """A ballot for a deleted choice doesn't lose the rest of its batch."""
+        deleted = self.question.choice_set.create(choice_text='gone')
+        deleted_id = deleted.id
+        deleted.delete()
+        self.ingestor.submit(self.user1.id, self.question.id, self.choice.id)
+        self.ingestor.submit(self.user2.id, self.question.id, deleted_id)
+        with self.assertLogs('polls.ingest', 'WARNING'):
+            self.assertEqual(1, self.ingestor.flush())
+        self.assertEqual([self.user1.id],
+                         list(Vote.objects.values_list('user', flat=True)))
+        self.choice.refresh_from_db()
+        self.assertEqual(1, self.choice.votes())
+        self.assertEqual([], tally.find_drift())
+
+
+class CastVoteTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize user and question for test"""
+        self.user = User.objects.create_user('Test7', password='password')
+        self.question = create_question(
+            question_text='Upsert', pub_days=-1, end_days=3)
+        self.choice1 = self.question.choice_set.create(choice_text='one')
+        self.choice2 = self.question.choice_set.create(choice_text='two')
+
+    def test_cast_vote_inserts_then_updates(self):
+        """cast_vote() keeps a single row per user and question."""
+        self.assertIs(True, cast_vote(self.user.id, self.question.id,
+                                      self.choice1.id))
+        self.assertIs(False, cast_vote(self.user.id, self.question.id,
+                                       self.choice1.id))
+        self.assertIs(True, cast_vote(self.user.id, self.question.id,
+                                      self.choice2.id))
+        vote = Vote.objects.get(user=self.user, question=self.question)
+        self.assertEqual(self.choice2, vote.choice)
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual((0, 1), (self.choice1.votes(), self.choice2.votes()))
+
+    def test_duplicate_vote_is_rejected_by_database(self):
+        """The database refuses a second vote of a user on a question."""
+        Vote.objects.create(user=self.user, choice=self.choice1)
+        with self.assertRaises(IntegrityError):
+            Vote.objects.create(user=self.user, choice=self.choice2)
+
+
+class ExportTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize staff user, questions and votes for test"""
+        self.user = User.objects.create_user(
+            'Test8', password='password', is_staff=True)
+        self.question = create_question(
+            question_text='Export', pub_days=-1, end_days=3)
+        self.choice1 = self.question.choice_set.create(choice_text='one')
+        self.choice2 = self.question.choice_set.create(choice_text='two')
+        self.vote = Vote.objects.create(user=self.user, choice=self.choice1)
+        other = create_question(question_text='Other', pub_days=-9, end_days=3)
+        other.choice_set.create(choice_text='three')
+
+    def test_export_results_csv_is_streamed(self):
+        """The export view streams the results of the selected question."""
+        self.client.login(username='Test8', password='password')
+        response = self.client.get(reverse('polls:export'),
+                                   {'question': self.question.id})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([
+            'question_id,question_text,choice_id,choice_text,votes',
+            f'{self.question.id},Export,{self.choice1.id},one,1',
+            f'{self.question.id},Export,{self.choice2.id},two,0',
+        ], lines)
+
+    def test_export_votes_jsonl_filtered_by_date(self):
+        """export_polls writes raw votes of questions in the date range."""
+        out = StringIO()
+        since = (timezone.localtime() - datetime.timedelta(days=2)).date()
+        call_command('export_polls', 'votes', '--format', 'jsonl',
+                     '--since', since.isoformat(), stdout=out)
+        self.assertEqual([{'vote_id': self.vote.id,
+                           'question_id': self.question.id,
+                           'choice_id': self.choice1.id,
+                           'user_id': self.user.id}],
+                         [json.loads(line) for line in out.getvalue().splitlines()])
+
+    def test_export_rejects_bad_filter(self):
+        """An unparsable filter is a bad request."""
+        self.client.login(username='Test8', password='password')
+        response = self.client.get(reverse('polls:export'), {'since': 'soon'})
+        self.assertEqual(400, response.status_code)
+
+
+class ResultSnapshotTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize question with choices and voters for test"""
+        get_results_cache().clear()
+        self.user = User.objects.create_user('Test18', password='password')
+        self.other = User.objects.create_user('Test19', password='password')
+        self.question = create_question(
+            question_text='Snapshot', pub_days=-1, end_days=3)
+        self.choice1 = self.question.choice_set.create(choice_text='one')
+        self.choice2 = self.question.choice_set.create(choice_text='two')
+
+    def snapshot(self):
+        return QuestionResultSnapshot.objects.get(pk=self.question.pk)
+
+    def test_votes_are_logged_and_applied(self):
+        """Each vote change is appended to the changelog and moves the
+        snapshot counts without recounting."""
+        version = self.snapshot().version
+        cast_vote(self.user.id, self.question.id, self.choice1.id)
+        cast_vote(self.other.id, self.question.id, self.choice1.id)
+        with CaptureQueriesContext(connection) as queries:
+            cast_vote(self.user.id, self.question.id, self.choice2.id)
+        self.assertFalse(any('COUNT(' in query['sql']
+                             for query in queries.captured_queries))
+        self.assertEqual(
+            [(None, self.choice1.id), (None, self.choice1.id),
+             (self.choice1.id, self.choice2.id)],
+            list(VoteChange.objects.order_by('id').values_list(
+                'old_choice', 'new_choice')))
+        snapshot = self.snapshot()
+        self.assertEqual([[self.choice1.id, 'one', 1],
+                          [self.choice2.id, 'two', 1]], snapshot.choices)
+        self.assertEqual((2, version + 3), (snapshot.total, snapshot.version))
+        self.assertEqual(VoteChange.objects.latest('id').id,
+                         snapshot.change_id)
+        self.question.delete()
+        self.assertFalse(VoteChange.objects.exists())
+
+    def test_orm_votes_and_choice_edits(self):
+        """Votes deleted through the ORM and renamed choices reach the
+        snapshot."""
+        vote = Vote.objects.create(user=self.user, choice=self.choice1)
+        vote.delete()
+        self.choice2.choice_text = 'renamed'
+        self.choice2.save()
+        self.assertEqual([[self.choice1.id, 'one', 0],
+                          [self.choice2.id, 'renamed', 0]],
+                         self.snapshot().choices)
+
+    def test_results_page_reads_one_snapshot_row(self):
+        """The results come from the snapshot, not from the choices."""
+        cast_vote(self.user.id, self.question.id, self.choice2.id)
+        Choice.objects.filter(pk=self.choice2.pk).update(vote_count=9)
+        with CaptureQueriesContext(connection) as queries:
+            results = get_results_cache().get(self.question.pk)
+        self.assertEqual(1, len(queries.captured_queries))
+        self.assertEqual((1, 1), (results.total, results.choices[1].votes))
+
+    def test_missing_snapshot_is_counted(self):
+        """A question without a snapshot gets one counted from its votes."""
+        cast_vote(self.user.id, self.question.id, self.choice2.id)
+        QuestionResultSnapshot.objects.all().delete()
+        self.assertEqual(1, get_results_cache().get(self.question.pk).total)
+        cast_vote(self.other.id, self.question.id, self.choice2.id)
+        self.assertEqual(2, self.snapshot().total)
+
+    def test_unknown_choice_recounts_the_question(self):
+        """A vote for a choice added without the signals counts the
+        question again instead of losing the vote."""
+        choice = Choice.objects.bulk_create(
+            [Choice(question=self.question, choice_text='three')])[0]
+        cast_vote(self.user.id, self.question.id, choice.id)
+        self.assertEqual([0, 0, 1], [votes for _, _, votes
+                                     in self.snapshot().choices])
+        self.assertEqual([], snapshots.find_drift())
+
+    def test_checker_repairs_drift(self):
+        """check_result_snapshots reports drift and --repair fixes it."""
+        cast_vote(self.user.id, self.question.id, self.choice1.id)
+        QuestionResultSnapshot.objects.filter(pk=self.question.pk).update(
+            total=5, choices=[[self.choice1.id, 'one', 5]])
+        with self.assertRaises(CommandError):
+            call_command('check_result_snapshots', stdout=StringIO())
+        out = StringIO()
+        call_command('check_result_snapshots', '--repair', stdout=out)
+        self.assertIn('1 results snapshot(s) repaired', out.getvalue())
+        self.assertEqual([], snapshots.find_drift())
+        cast_vote(self.other.id, self.question.id, self.choice2.id)
+        self.assertEqual([1, 1], [votes for _, _, votes
+                                  in self.snapshot().choices])
+
+    def test_ingested_votes_reach_the_snapshot(self):
+        """Batched votes are logged and applied together."""
+        ingestor = VoteIngestor(batch_size=10)
+        ingestor.submit(self.user.id, self.question.id, self.choice1.id)
+        ingestor.submit(self.other.id, self.question.id, self.choice2.id)
+        ingestor.flush()
+        self.assertEqual(2, VoteChange.objects.count())
+        self.assertEqual(2, self.snapshot().total)
+        self.assertEqual([], snapshots.find_drift())
+
+
+class ApiTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize open, closed and future questions with a voter for test"""
+        self.user = User.objects.create_user('Test20', password='password')
+        self.open = create_question(
+            question_text='Open poll', pub_days=-1, end_days=3)
+        self.closed = create_question(
+            question_text='Closed poll', pub_days=-5, end_days=-2)
+        self.future = create_question(
+            question_text='Future poll', pub_days=2, end_days=5)
+        self.choice = self.open.choice_set.create(choice_text='yes')
+        self.open.choice_set.create(choice_text='no')
+        cast_vote(self.user.id, self.open.id, self.choice.id)
+        self.results_url = reverse('polls:api-results')
+
+    def test_poll_list_by_status(self):
+        """The poll list shows published polls, filtered by status."""
+        url = reverse('polls:api-polls')
+        polls = self.client.get(url).json()['polls']
+        self.assertEqual([self.open.id, self.closed.id],
+                         [poll['id'] for poll in polls])
+        self.assertEqual([True, False], [poll['is_open'] for poll in polls])
+        self.assertEqual(1, polls[0]['total_votes'])
+        for status, question in (('open', self.open),
+                                 ('closed', self.closed)):
+            polls = self.client.get(url, {'status': status}).json()['polls']
+            self.assertEqual([question.id], [poll['id'] for poll in polls])
+        self.assertEqual(
+            400, self.client.get(url, {'status': 'soon'}).status_code)
+
+    @override_settings(POLLS_API_PAGE_SIZE=1)
+    def test_poll_list_pages(self):
+        """The next cursor leads to the following page, read in one query."""
+        url = reverse('polls:api-polls')
+        first = self.client.get(url).json()
+        with self.assertNumQueries(1):
+            second = self.client.get(url, {'after': first['next']}).json()
+        self.assertEqual([self.closed.id],
+                         [poll['id'] for poll in second['polls']])
+        self.assertIsNone(second['next'])
+
+    def test_results_of_many_polls(self):
+        """Results of several polls come from one query; unknown and
+        unpublished ids are reported missing."""
+        ids = f'{self.closed.id},{self.open.id},{self.future.id},999'
+        with self.assertNumQueries(1):
+            data = self.client.get(self.results_url, {'ids': ids}).json()
+        self.assertEqual([self.closed.id, self.open.id],
+                         [result['id'] for result in data['results']])
+        self.assertEqual([self.future.id, 999], data['missing'])
+        self.assertEqual(
+            [{'id': self.choice.id, 'text': 'yes', 'votes': 1,
+              'percent': 100.0}],
+            data['results'][1]['choices'][:1])
+
+    @override_settings(POLLS_API_MAX_IDS=2)
+    def test_bad_ids(self):
+        """Missing, malformed or too many ids are answered 400."""
+        for ids in ('', '1,x', '1,2,3', '99999999999999999999999'):
+            response = self.client.get(self.results_url, {'ids': ids})
+            self.assertEqual(400, response.status_code)
+            self.assertIn('error', response.json())
+
+    def test_results_etag_follows_votes(self):
+        """An unchanged answer is a 304 until a vote changes the results."""
+        params = {'ids': str(self.open.id)}
+        response = self.client.get(self.results_url, params)
+        self.assertIn('public', response['Cache-Control'])
+        etag = response['ETag']
+        version = response.json()['results'][0]['version']
+        response = self.client.get(self.results_url, params,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        cast_vote(self.user.id, self.open.id,
+                  self.open.choice_set.get(choice_text='no').id)
+        response = self.client.get(self.results_url, params,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertGreater(response.json()['results'][0]['version'], version)
+
+    def test_encoders_agree(self):
+        """The orjson and the json module encodings decode the same."""
+        data = {'text': 'café', 'votes': [1, 2], 'percent': 33.3,
+                'end_date': None}
+        with mock.patch.object(api, 'orjson', None):
+            plain = api.dumps(data)
+        self.assertEqual(data, json.loads(plain))
+        self.assertEqual(json.loads(plain), json.loads(api.dumps(data)))
+
+
+class VoteHistoryTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize a question voted on over the last hours for test"""
+        self.first = User.objects.create_user('Test23', password='password')
+        self.second = User.objects.create_user('Test24', password='password')
+        self.question = create_question(
+            question_text='History poll', pub_days=-1, end_days=3)
+        self.yes = self.question.choice_set.create(choice_text='yes')
+        self.no = self.question.choice_set.create(choice_text='no')
+        self.start = (timezone.now().replace(minute=0, second=0,
+                                             microsecond=0)
+                      - datetime.timedelta(hours=2))
+        self.history_url = reverse('polls:api-history',
+                                   args=(self.question.id,))
+        self.rate_url = reverse('polls:api-rate', args=(self.question.id,))
+
+    def at(self, minutes):
+        return self.start + datetime.timedelta(minutes=minutes)
+
+    def vote_at(self, minutes, user, choice=None):
+        """Vote for `choice`, or withdraw the vote, `minutes` after start."""
+        with mock.patch('django.utils.timezone.now',
+                        return_value=self.at(minutes)):
+            if choice is None:
+                Vote.objects.get(user=user, question=self.question).delete()
+            else:
+                cast_vote(user.id, self.question.id, choice.id)
+
+    def vote_history(self):
+        """Two votes, a checkpoint, a changed vote and a withdrawn one."""
+        self.vote_at(10, self.first, self.yes)
+        self.vote_at(20, self.second, self.yes)
+        self.assertEqual(1, history.checkpoint())
+        self.vote_at(30, self.first, self.no)
+        self.vote_at(40, self.second)
+
+    def results_at(self, minutes):
+        response = self.client.get(self.history_url,
+                                   {'at': self.at(minutes).isoformat()})
+        self.assertEqual(200, response.status_code)
+        data = response.json()
+        return data['total'], {choice['text']: choice['votes']
+                               for choice in data['choices']}
+
+    def test_results_at(self):
+        """Past results replay the changes from the nearest checkpoint."""
+        self.vote_history()
+        self.assertEqual((0, {'yes': 0, 'no': 0}), self.results_at(5))
+        self.assertEqual((1, {'yes': 1, 'no': 0}), self.results_at(15))
+        self.assertEqual((2, {'yes': 2, 'no': 0}), self.results_at(25))
+        self.assertEqual((2, {'yes': 1, 'no': 1}), self.results_at(35))
+        self.assertEqual((1, {'yes': 0, 'no': 1}), self.results_at(45))
+        # the same replayed backwards from the snapshot alone
+        ResultsCheckpoint.objects.all().delete()
+        self.assertEqual((0, {'yes': 0, 'no': 0}), self.results_at(5))
+        self.assertEqual((2, {'yes': 2, 'no': 0}), self.results_at(25))
+        self.assertEqual((2, {'yes': 1, 'no': 1}), self.results_at(35))
+
+    def test_results_at_errors(self):
+        """A bad moment is a 400 and an unknown poll a 404."""
+        response = self.client.get(self.history_url, {'at': 'yesterday'})
+        self.assertEqual(400, response.status_code)
+        response = self.client.get(
+            reverse('polls:api-history', args=(self.question.id + 1,)),
+            {'at': self.at(0).isoformat()})
+        self.assertEqual(404, response.status_code)
+
+    def test_checkpoint_only_changed_results(self):
+        """A checkpoint is taken only of the results that changed."""
+        self.vote_at(10, self.first, self.yes)
+        out = StringIO()
+        call_command('checkpoint_results', stdout=out)
+        self.assertIn('1 checkpoint(s) taken', out.getvalue())
+        self.assertEqual(0, history.checkpoint())
+        self.vote_at(20, self.second, self.no)
+        self.assertEqual(1, history.checkpoint())
+        self.assertEqual([1, 2], [
+            sum(votes for _, _, votes in checkpoint.choices)
+            for checkpoint in self.question.checkpoints.order_by('change_id')])
+
+    def test_vote_rate(self):
+        """Votes, changes and withdrawals are counted per window."""
+        self.vote_history()
+        response = self.client.get(self.rate_url, {
+            'since': self.at(0).isoformat(),
+            'until': self.at(50).isoformat(), 'step': 600})
+        self.assertEqual(200, response.status_code)
+        data = response.json()
+        self.assertEqual(600, data['step'])
+        self.assertEqual(self.at(0), datetime.datetime.fromisoformat(
+            data['windows'][0]['start']))
+        self.assertEqual(
+            [(0, 0, 0), (1, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)],
+            [(window['votes'], window['changes'], window['withdrawals'])
+             for window in data['windows']])
+
+    def test_vote_rate_limits(self):
+        """Too many windows or a bad step are a 400."""
+        for params in ({'step': 60}, {'step': 'often'}):
+            response = self.client.get(self.rate_url, params)
+            self.assertEqual(400, response.status_code)
+        self.assertEqual(200, self.client.get(
+            self.rate_url, {'step': 3600}).status_code)
+
+    def test_vote_rate_out_of_range(self):
+        """Steps and dates too far out are a 400, not an error."""
+        for params in ({'step': '99999999999999999999'},
+                       {'step': '9' * 400},
+                       {'until': '0001-01-01'},
+                       {'since': '0001-01-01', 'until': '9999-12-31'},
+                       {'since': '0001-01-01', 'until': '9999-12-31',
+                        'step': 10 ** 12}):
+            response = self.client.get(self.rate_url, params)
+            self.assertEqual(400, response.status_code)
+            self.assertIn('error', response.json())
+
+    def test_vote_rate_default_step(self):
+        """Without a step the range is split in at most MAX_WINDOWS."""
+        response = self.client.get(self.rate_url)
+        self.assertEqual(200, response.status_code)
+        data = response.json()
+        self.assertEqual(120, data['step'])
+        self.assertLessEqual(len(data['windows']), history.MAX_WINDOWS)
+
+    def test_delete_question_forgets_history(self):
+        """Deleting a question deletes its rate buckets and checkpoints."""
+        self.vote_history()
+        self.assertTrue(VoteRateBucket.objects.exists())
+        self.question.delete()
+        self.assertFalse(VoteRateBucket.objects.exists())
+        self.assertFalse(ResultsCheckpoint.objects.exists())
+
+
+class ArchiveTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize a closed and an open question with votes for test"""
+        caches['template_fragments'].clear()
+        self.closed = create_question(
+            question_text='Closed', pub_days=-5, end_days=-2)
+        self.yes = self.closed.choice_set.create(choice_text='yes')
+        self.no = self.closed.choice_set.create(choice_text='no')
+        self.open = create_question(
+            question_text='Open', pub_days=-1, end_days=3)
+        maybe = self.open.choice_set.create(choice_text='maybe')
+        for number, choice in enumerate((self.yes, self.yes, self.no, maybe)):
+            user = User.objects.create_user(f'Archive{number}')
+            Vote.objects.create(user=user, choice=choice)
+
+    def test_archive_freezes_results_and_moves_votes(self):
+        """Only the votes of polls closed long enough leave the Vote table."""
+        out = StringIO()
+        call_command('archive_polls', stdout=out)
+        self.assertIn('1 poll(s) archived, 3 vote(s) moved.', out.getvalue())
+        self.assertEqual([self.open.id], list(
+            Vote.objects.values_list('question_id', flat=True)))
+        self.assertEqual(3, ArchivedVote.objects.count())
+        summary = QuestionArchive.objects.get(question=self.closed)
+        self.assertEqual(3, summary.total)
+        self.assertEqual([[self.yes.id, 'yes', 2], [self.no.id, 'no', 1]],
+                         summary.choices)
+        self.assertEqual([], tally.find_drift())
+        call_command('archive_polls', stdout=out)
+        self.assertIn('0 poll(s) archived', out.getvalue())
+
+    def test_results_page_reads_the_summary(self):
+        """The results of an archived poll come from one query."""
+        archive.archive_closed()
+        get_results_cache().clear()
+        url = reverse('polls:results', args=(self.closed.id,))
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(2, response.context['results'].choices[0].votes)
+        self.assertEqual(3, response.context['results'].total)
+
+    def test_archived_again_shows_new_results(self):
+        """A poll archived, restored, voted on and archived again doesn't
+        show the table of its first archive."""
+        url = reverse('polls:results', args=(self.closed.id,))
+        archive.archive_closed()
+        self.assertContains(self.client.get(url), '<td id="total">3</td>')
+        archive.restore_question(self.closed.id)
+        Vote.objects.create(user=User.objects.create_user('Archive9'),
+                            choice=self.no)
+        archive.archive_closed()
+        self.assertContains(self.client.get(url), '<td id="total">4</td>')
+
+    @override_settings(POLLS_ARCHIVE_AFTER=3 * 24 * 60 * 60)
+    def test_recently_closed_poll_is_not_archived_yet(self):
+        """Polls closed less than POLLS_ARCHIVE_AFTER ago stay as they are."""
+        self.assertEqual([], archive.archive_closed())
+
+    def test_restore_and_reopen(self):
+        """Restoring, or reopening the poll, puts the votes back."""
+        archive.archive_closed()
+        call_command('archive_polls', '--restore', str(self.closed.id),
+                     stdout=StringIO())
+        self.assertEqual(4, Vote.objects.count())
+        self.assertFalse(QuestionArchive.objects.exists())
+        with self.assertRaises(CommandError):
+            call_command('archive_polls', '--restore', str(self.closed.id))
+        archive.archive_closed()
+        self.closed.end_date = timezone.now() + datetime.timedelta(days=1)
+        self.closed.save()
+        self.assertEqual(4, Vote.objects.count())
+        self.assertFalse(ArchivedVote.objects.exists())
+
+    def test_export_includes_archived_votes(self):
+        """Raw vote exports still list the archived votes."""
+        archive.archive_closed()
+        lines = list(export.export_lines('votes', 'jsonl', {}))
+        self.assertEqual(4, len(lines))
+
+
+class ImportPollsTests(TestCase):
+    def test_import_demo_fixtures(self):
+        """import_polls loads the demo data and counts its votes."""
+        call_command('import_polls', 'data/users.json', 'data/polls.json',
+                     '--batch-size', '4', stdout=StringIO())
+        self.assertEqual(3, Question.objects.count())
+        self.assertEqual(5, Vote.objects.count())
+        self.assertEqual(2, Choice.objects.get(pk=8).votes())
+        self.assertEqual(3, Vote.objects.get(pk=1).question_id)
+        self.assertEqual([], tally.find_drift())
+        self.assertTrue(User.objects.get(username='harry').has_usable_password())
+
+    def test_loaddata_demo_fixtures(self):
+        """The demo data of the README also loads with loaddata."""
+        call_command('loaddata', 'data/polls.json', 'data/users.json',
+                     stdout=StringIO())
+        self.assertEqual(3, Question.objects.count())
+        self.assertEqual(5, Vote.objects.count())
+        self.assertFalse(Question.objects.filter(updated_at=None).exists())
+
+    def test_import_fails_as_a_whole(self):
+        """Nothing is imported if one of the fixtures is broken."""
+        with self.assertRaises(CommandError):
+            call_command('import_polls', 'data/polls.json', 'README.md',
+                         stdout=StringIO())
+        self.assertEqual(0, Question.objects.count())
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize full vote rate limits for test"""
+        reset_vote_limiter()
+
+    def test_percentile(self):
+        """percentile() uses the nearest rank."""
+        samples = list(range(1, 101))
+        self.assertEqual(50, benchmark.percentile(samples, 50))
+        self.assertEqual(99, benchmark.percentile(samples, 99))
+        self.assertIsNone(benchmark.percentile([], 50))
+
+    def test_every_scenario_runs_without_errors(self):
+        """Each scenario runs against generated polls without errors."""
+        dataset = benchmark.generate(questions=3, choices=2, users=4, votes=6)
+        self.assertEqual(6, Vote.objects.count())
+        for scenario in benchmark.SCENARIOS.values():
+            report = benchmark.run_scenario(
+                scenario, dataset, requests=3, concurrency=1)
+            self.assertEqual((3, 0), (report['requests'], report['errors']),
+                             scenario.name)
+            self.assertGreater(report['queries_per_request'], 0)
+
+    def test_render_times_every_page(self):
+        """run_render() reports each poll page."""
+        dataset = benchmark.generate(questions=2, choices=3, users=2, votes=2)
+        report = benchmark.run_render(dataset, repeat=2)
+        self.assertEqual(set(benchmark.RENDER_PAGES), set(report))
+        self.assertEqual(2, report['detail']['requests'])
+
+    def test_refuses_to_overwrite_a_database(self):
+        """--db is never the site's database, nor an existing file
+        without --force."""
+        with self.assertRaisesMessage(CommandError, "'default' database"):
+            call_command('benchmark', '--db',
+                         str(settings.DATABASES['default']['NAME']),
+                         '--force', stdout=StringIO())
+        with tempfile.NamedTemporaryFile(suffix='.sqlite3') as existing:
+            with self.assertRaisesMessage(CommandError, 'exists'):
+                call_command('benchmark', '--db', existing.name,
+                             stdout=StringIO())
+
+    def test_vote_stress_counts_votes(self):
+        """The vote stress run casts rate * seconds votes."""
+        dataset = benchmark.generate(questions=3, choices=2, users=4, votes=0)
+        report = benchmark.run_vote_stress(
+            dataset, rate=200, seconds=0.1, concurrency=1)
+        self.assertEqual((20, 0, 0), (report['requests'], report['errors'],
+                                      report['lock_errors']))
+        self.assertEqual([], tally.find_drift())
+
+
+class SQLiteProfileTests(TestCase):
+    def test_pragmas_are_applied(self):
+        """Connections of the tuned profile run with the configured pragmas."""
+        if settings.SQLITE_PROFILE != 'tuned':
+            self.skipTest('SQLITE_PROFILE is not tuned')
+        pragmas = settings.DATABASES['default']['OPTIONS']['pragmas']
+        with connection.cursor() as cursor:
+            for name in ('synchronous', 'busy_timeout', 'cache_size'):
+                cursor.execute(f'PRAGMA {name}')
+                value = cursor.fetchone()[0]
+                if name == 'synchronous':
+                    value = ('OFF', 'NORMAL', 'FULL', 'EXTRA')[value]
+                self.assertEqual(pragmas[name], value, name)
+
+
+@override_settings(MIDDLEWARE=[
+    'polls.middleware.RequestMetricsMiddleware', *settings.MIDDLEWARE])
+class RequestMetricsTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize staff user and a question for test"""
+        request_metrics.clear()
+        self.user = User.objects.create_user(
+            'Test9', password='password', is_staff=True)
+        self.question = create_question(
+            question_text='Timed', pub_days=-1, end_days=3)
+        get_schedule()  # loaded once per change, not per request
+
+    def test_server_timing_header(self):
+        """Responses carry total and database time."""
+        with self.assertLogs('polls.metrics', 'INFO') as logs:
+            response = self.client.get(reverse('polls:index'))
+        self.assertRegex(response['Server-Timing'],
+                         r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="1 queries"$')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(('polls:index', 200, 1),
+                         (line['endpoint'], line['status'], line['queries']))
+
+    def test_duplicate_queries_are_counted(self):
+        """QueryRecorder counts queries repeated with the same parameters."""
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            Question.objects.filter(pk=self.question.pk).exists()
+            Question.objects.filter(pk=self.question.pk).exists()
+        self.assertEqual((2, 1), (recorder.count, recorder.duplicates))
+
+    def test_histograms_on_stats_page(self):
+        """Staff can see the histogram of every view."""
+        with self.assertLogs('polls.metrics', 'INFO'):
+            for _ in range(3):
+                self.client.get(
+                    reverse('polls:results', args=(self.question.id,)))
+            self.client.login(username='Test9', password='password')
+            endpoints = self.client.get(reverse('polls:stats')).json()['requests']
+        self.assertEqual(3, endpoints['polls:results']['requests'])
+        self.assertEqual(3, sum(endpoints['polls:results']['histogram'].values()))
+
+
+# URLconf of AsyncViewTests: the polls app served by its async views.
+FORM = 'application/x-www-form-urlencoded'
+urlpatterns = [
+    path('polls/', include((
+        build_urlpatterns(use_async=True, live_results=True), 'polls'))),
+    path('accounts/', include('django.contrib.auth.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF='polls.tests')
+class AsyncViewTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize logged in user and question for test"""
+        get_results_cache().clear()
+        caches['template_fragments'].clear()
+        reset_vote_limiter()
+        self.user = User.objects.create_user('Test10', password='password')
+        self.async_client.force_login(self.user)
+        self.question = create_question(
+            question_text='Async', pub_days=-1, end_days=3)
+        self.choice1 = self.question.choice_set.create(choice_text='one')
+        self.choice2 = self.question.choice_set.create(choice_text='two')
+
+    async def test_index_and_results(self):
+        """Index and results render through the async ORM."""
+        response = await self.async_client.get(reverse('polls:index'))
+        self.assertContains(response, 'Async')
+        self.assertIs(True, response.context['latest_question_list'][0].is_open)
+        response = await self.async_client.get(
+            reverse('polls:results', args=(self.question.id,)))
+        self.assertEqual(2, len(response.context['results'].choices))
+
+    async def test_vote_and_previous_select(self):
+        """A vote is stored and shown as the previous select on detail."""
+        response = await self.async_client.post(
+            reverse('polls:vote', args=(self.question.id,)),
+            f'choice={self.choice2.id}', content_type=FORM)
+        self.assertRedirects(response, reverse(
+            'polls:results', args=(self.question.id,)),
+            fetch_redirect_response=False)
+        response = await self.async_client.get(
+            reverse('polls:detail', args=(self.question.id,)))
+        self.assertEqual(self.choice2, response.context['vote_info'])
+        self.assertContains(response, 'two -> Previous select')
+
+    async def test_vote_requires_login_and_choice(self):
+        """Anonymous users are sent to login; a missing choice re-renders."""
+        url = reverse('polls:vote', args=(self.question.id,))
+        response = await self.async_client.post(url, '', content_type=FORM)
+        self.assertContains(response, 'select a choice.')
+        self.async_client.cookies.clear()
+        response = await self.async_client.post(url, '', content_type=FORM)
+        self.assertEqual(302, response.status_code)
+        self.assertIn('/accounts/login/', response['Location'])
+
+
+@override_settings(ROOT_URLCONF='polls.tests', POLLS_LIVE_RESULTS=True)
+class LiveResultsTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize question, choices and publisher for test"""
+        self.user = User.objects.create_user('Test11', password='password')
+        self.question = create_question(
+            question_text='Live', pub_days=-1, end_days=3)
+        self.choice1 = self.question.choice_set.create(choice_text='one')
+        self.choice2 = self.question.choice_set.create(choice_text='two')
+        self.publisher = ResultsPublisher(interval=0.05)
+
+    async def test_stream_starts_with_current_results(self):
+        """The stream first sends the current results as an event."""
+        response = await self.async_client.get(
+            reverse('polls:results-stream', args=(self.question.id,)))
+        self.assertEqual('text/event-stream', response['Content-Type'])
+        self.assertEqual('no-cache', response['Cache-Control'])
+        stream = response.streaming_content.__aiter__()
+        event = await stream.__anext__()
+        await stream.aclose()
+        event = event.decode() if isinstance(event, bytes) else event
+        self.assertTrue(event.startswith('data: '))
+        data = json.loads(event[len('data: '):])
+        self.assertEqual(self.question.id, data['question_id'])
+        self.assertEqual(0, data['total'])
+
+    async def test_stream_of_unknown_question(self):
+        """No stream is opened for a question that doesn't exist."""
+        response = await self.async_client.get(
+            reverse('polls:results-stream', args=(self.question.id + 1,)))
+        self.assertEqual(404, response.status_code)
+
+    def test_no_stream_under_wsgi(self):
+        """Under WSGI the stream answers 204 at once instead of hanging."""
+        response = self.client.get(
+            reverse('polls:results-stream', args=(self.question.id,)))
+        self.assertEqual(204, response.status_code)
+        self.assertFalse(response.streaming)
+
+    @override_settings(ROOT_URLCONF='mysite.urls', POLLS_LIVE_RESULTS=False)
+    def test_live_results_off(self):
+        """By default the results page doesn't open the live stream."""
+        response = self.client.get(
+            reverse('polls:results', args=(self.question.id,)))
+        self.assertNotContains(response, 'EventSource')
+
+    async def test_updates_are_coalesced_and_shared(self):
+        """Many changes in a tick cost one load and one broadcast for all."""
+        first = self.publisher.subscribe(self.question.id)
+        second = self.publisher.subscribe(self.question.id)
+        await first.current()
+        await second.current()
+        self.assertEqual(1, self.publisher.loads)
+        await sync_to_async(cast_vote)(
+            self.user.id, self.question.id, self.choice1.id)
+        for _ in range(5):
+            self.publisher.notify(self.question.id)
+        message = await first.next(timeout=1)
+        self.assertEqual(message, await second.next(timeout=1))
+        self.assertEqual(1, json.loads(message)['total'])
+        self.assertEqual(2, self.publisher.loads)
+        self.assertEqual(1, self.publisher.broadcasts)
+        self.assertIsNone(await first.next(timeout=0.2))
+        first.close()
+        second.close()
+        self.assertEqual(0, self.publisher.stats()['channels'])
+
+    async def test_committed_vote_marks_results_stale(self):
+        """A committed vote notifies the live results publisher."""
+        subscription = publisher.subscribe(self.question.id)
+        await subscription.current()
+
+        def vote():
+            with self.captureOnCommitCallbacks(execute=True):
+                cast_vote(self.user.id, self.question.id, self.choice2.id)
+
+        await sync_to_async(vote)()
+        channel = subscription.channel
+        self.assertNotEqual(channel.sent_version, channel.version)
+        subscription.close()
+
+
+class SearchViewTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize questions and choices for test"""
+        self.coffee = create_question(
+            question_text='Coffee or tea?', pub_days=-2, end_days=3)
+        self.coffee.choice_set.create(choice_text='Espresso')
+        self.mention = create_question(
+            question_text='Best breakfast?', pub_days=-3, end_days=-1)
+        self.mention.choice_set.create(choice_text='Toast with coffee')
+        self.future = create_question(
+            question_text='Coffee of the future?', pub_days=2, end_days=5)
+
+    def search(self, **params):
+        response = self.client.get(reverse('polls:search'), params)
+        self.assertEqual(200, response.status_code)
+        return response
+
+    def test_ranked_published_matches(self):
+        """A match in the question ranks above one in a choice, and
+        unpublished questions are never found."""
+        response = self.search(q='coffee')
+        self.assertEqual([self.coffee, self.mention],
+                         response.context['question_list'])
+        detail = 'href="{}"'.format
+        self.assertContains(response, detail(reverse(
+            'polls:detail', args=(self.coffee.id,))))
+        self.assertNotContains(response, detail(reverse(
+            'polls:detail', args=(self.mention.id,))))
+
+    def test_prefix_and_every_word(self):
+        """Words match as prefixes and all of them have to match."""
+        self.assertEqual([self.coffee],
+                         self.search(q='espr').context['question_list'])
+        self.assertEqual([self.mention], self.search(
+            q='breakfast coff').context['question_list'])
+        self.assertEqual([], self.search(
+            q='tea toast').context['question_list'])
+        self.assertEqual([], self.search(q='"*)(').context['question_list'])
+
+    @override_settings(POLLS_INDEX_PAGE_SIZE=1)
+    def test_keyset_pages(self):
+        """The cursor continues after the last match of the page."""
+        first = self.search(q='coffee')
+        self.assertEqual([self.coffee], first.context['question_list'])
+        second = self.search(q='coffee', after=first.context['next_cursor'])
+        self.assertEqual([self.mention], second.context['question_list'])
+        self.assertIsNone(second.context['next_cursor'])
+        self.assertEqual([self.coffee], self.search(
+            q='coffee', after='bogus').context['question_list'])
+
+    def test_rebuild_command(self):
+        """rebuild_search_index refills a stale index."""
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM polls_question_search')
+        self.assertEqual([], self.search(q='coffee').context['question_list'])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('3 question(s) indexed.', out.getvalue())
+        self.assertEqual(2, len(self.search(q='coffee')
+                                .context['question_list']))
+
+
+class QuestionAdminTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize admin user, questions and votes for test"""
+        self.admin = User.objects.create_superuser(
+            'Admin1', password='password')
+        self.client.force_login(self.admin)
+        self.open = create_question(
+            question_text='Favourite programming language?',
+            pub_days=-2, end_days=3)
+        self.open.choice_set.create(choice_text='Python', vote_count=3)
+        self.open.choice_set.create(choice_text='Haskell', vote_count=4)
+        self.closed = create_question(
+            question_text='Best editor?', pub_days=-5, end_days=-1)
+        self.closed.choice_set.create(choice_text='Emacs', vote_count=1)
+        self.url = reverse('admin:polls_question_changelist')
+
+    def test_columns_computed_by_the_database(self):
+        """Vote totals and open status are annotated and sortable."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'o': '-6'})
+        questions = list(response.context['cl'].result_list)
+        self.assertEqual([self.open, self.closed], questions)
+        self.assertEqual([7, 1], [q.total_votes for q in questions])
+        self.assertEqual([True, False], [q.is_open for q in questions])
+        self.assertFalse(any('polls_choice' in query['sql']
+                             and 'polls_question' not in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_search_questions_and_choices(self):
+        """Admin search finds word prefixes in questions and choices."""
+        response = self.client.get(self.url, {'q': 'program'})
+        self.assertEqual([self.open], list(response.context['cl'].result_list))
+        response = self.client.get(self.url, {'q': 'emac'})
+        self.assertEqual([self.closed],
+                         list(response.context['cl'].result_list))
+        response = self.client.get(self.url, {'q': '"*)('})
+        self.assertEqual([], list(response.context['cl'].result_list))
+
+    def test_search_index_follows_changes(self):
+        """Saving, renaming and deleting keeps the search index in sync."""
+        choice = self.closed.choice_set.get()
+        choice.choice_text = 'Vim'
+        choice.save()
+        self.assertEqual([self.closed], list(Question.objects.search('vim')))
+        self.assertEqual([], list(Question.objects.search('emacs')))
+        self.closed.question_text = 'Worst editor?'
+        self.closed.save()
+        self.assertEqual([self.closed], list(Question.objects.search('worst')))
+        self.closed.delete()
+        self.assertEqual([], list(Question.objects.search('editor')))
+
+    def test_choice_inline_shows_counts(self):
+        """The change form lists choices with their vote counters."""
+        response = self.client.get(
+            reverse('admin:polls_question_change', args=(self.open.id,)))
+        self.assertContains(response, 'Haskell')
+        formset = response.context['inline_admin_formsets'][0]
+        self.assertIn('vote_count', formset.readonly_fields)
+
+
+@override_settings(POLLS_REPLICAS=['replica1'])
+class ReplicaRouterTests(TestCase):
+    def setUp(self) -> None:
+        """Initialize router, user and question for test"""
+        self.router = PrimaryReplicaRouter()
+        self.user = User.objects.create_user('Test12', password='password')
+        self.question = create_question(
+            question_text='Replicated', pub_days=-1, end_days=3)
+        self.choice = self.question.choice_set.create(choice_text='one')
+
+    def test_reads_and_writes(self):
+        """Poll reads go to a replica; votes and writes to the primary."""
+        self.assertEqual('replica1', self.router.db_for_read(Question))
+        self.assertEqual('replica1', self.router.db_for_read(Choice))
+        self.assertIsNone(self.router.db_for_read(Vote))
+        self.assertIsNone(self.router.db_for_read(User))
+        self.assertIsNone(self.router.db_for_read(Choice, fresh=True))
+        vote = Vote.objects.create(user=self.user, choice=self.choice)
+        self.assertEqual('default',
+                         self.router.db_for_read(Choice, instance=vote))
+        self.assertEqual('default', self.router.db_for_write(Choice))
+        self.assertIs(False, self.router.allow_migrate('replica1', 'polls'))
+        with use_primary():
+            self.assertIsNone(self.router.db_for_read(Question))
+
+    def test_vote_sets_sticky_cookie(self):
+        """A vote keeps the voter on the primary for a while."""
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse('polls:vote', args=(self.question.id,)),
+            {'choice': self.choice.id})
+        cookie = response.cookies[STICKY_COOKIE]
+        self.assertEqual(settings.POLLS_PRIMARY_STICKY_SECONDS,
+                         cookie['max-age'])
+
+    def test_sticky_cookie_routes_request_to_primary(self):
+        """Requests carrying the sticky cookie read from the primary."""
+        routed = []
+
+        def view(request):
+            routed.append(self.router.db_for_read(Question))
+            return HttpResponse()
+
+        middleware = StickyPrimaryMiddleware(view)
+        factory = RequestFactory()
+        middleware(factory.get('/'))
+        factory.cookies[STICKY_COOKIE] = '1'
+        middleware(factory.get('/'))
+        self.assertEqual(['replica1', None], routed)
+
+
+class SyncReplicaTests(TransactionTestCase):
+    def test_sync_replica_copies_primary(self):
+        """sync_replica() copies the committed primary database to a file."""
+        create_question(question_text='Replicated', pub_days=-1, end_days=3)
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'replica.sqlite3'
+            sync_replica(path)
+            replica = sqlite3.connect(path)
+            try:
+                texts = replica.execute(
+                    'SELECT question_text FROM polls_question').fetchall()
+            finally:
+                replica.close()
+        self.assertEqual([('Replicated',)], texts)
@@ -1,11 +1,44 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import api, async_views, views
 
 app_name = 'polls'
-urlpatterns = [
-    path('', views.IndexView.as_view(), name='index'),
-    path('<int:pk>/', views.DetailView.as_view(), name='detail'),
-    path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
-    path('<int:question_id>/vote/', views.vote, name='vote'),
-]
+
+
+def build_urlpatterns(use_async, live_results=False):
+    """return the polls URL patterns with the sync or the async views, and
+    the live results stream if `live_results`."""
+    if use_async:
+        index_view = async_views.AsyncIndexView.as_view()
+        detail_view = async_views.AsyncDetailView.as_view()
+        results_view = async_views.AsyncResultsView.as_view()
+        vote_view = async_views.vote
+    else:
+        index_view = views.IndexView.as_view()
+        detail_view = views.DetailView.as_view()
+        results_view = views.ResultsView.as_view()
+        vote_view = views.vote
+    patterns = [
+        path('', index_view, name='index'),
+        path('<int:pk>/', detail_view, name='detail'),
+        path('<int:pk>/results/', results_view, name='results'),
+        path('<int:question_id>/vote/', vote_view, name='vote'),
+        path('search/', views.search, name='search'),
+        path('stats/', views.stats, name='stats'),
+        path('export/', views.export_view, name='export'),
+        path('api/polls/', api.poll_list, name='api-polls'),
+        path('api/results/', api.results, name='api-results'),
+        path('api/polls/<int:pk>/history/', api.results_at,
+             name='api-history'),
+        path('api/polls/<int:pk>/rate/', api.vote_rate, name='api-rate'),
+    ]
+    if live_results:
+        patterns.append(path('<int:pk>/results/stream/',
+                             async_views.results_stream,
+                             name='results-stream'))
+    return patterns
+
+
+urlpatterns = build_urlpatterns(settings.POLLS_ASYNC_VIEWS,
+                                settings.POLLS_LIVE_RESULTS)
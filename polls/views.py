@@ -1,5 +1,7 @@
 """Views for Polls Application"""
-from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.http import (HttpResponseBadRequest, HttpResponseRedirect,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from django.views import generic
@@ -7,8 +9,21 @@ from django.utils import timezone
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.admin.views.decorators import staff_member_required
 
-from .models import Choice, Question, Vote
+from .models import Choice, Question
+from .pagination import keyset_paginate
+from .ratelimit import client_ip, get_vote_limiter, too_many_votes
+from .routers import stick_to_primary
+from .schedule import get_schedule
+from .search import search_questions
+from .voting import cast_vote
+from . import conditional, export
+from .archive import archived_results
+from .cache import get_results_cache
+from .ingest import get_vote_ingestor
+from .live import publisher
+from .middleware import request_metrics
 
 
 class IndexView(generic.ListView):
@@ -16,14 +31,35 @@ class IndexView(generic.ListView):
     template_name = 'polls/index.html'
     context_object_name = 'latest_question_list'
 
+    def get(self, request, *args, **kwargs):
+        """Answer 304 Not Modified when the client has this poll list."""
+        self.object_list = self.get_queryset()
+        version = conditional.index_version(
+            request, self.object_list, self.page.next_cursor)
+        response = conditional.not_modified(request, version)
+        if response is None:
+            response = self.render_to_response(self.get_context_data())
+        return conditional.add_headers(request, response, version)
+
     def get_queryset(self):
         """
-        Return the last five published questions (not including those set to be
-        published in the future).
+        Return one page of published questions, newest first (not including
+        those set to be published in the future), with `is_open` looked up
+        in the question schedule.
         """
-        return Question.objects.filter(
-            pub_date__lte=timezone.localtime()
-        ).order_by('-pub_date')[:5]
+        self.page = keyset_paginate(
+            Question.objects.published(), ('pub_date', 'pk'),
+            self.request.GET.get('after'), settings.POLLS_INDEX_PAGE_SIZE)
+        schedule = get_schedule()
+        for question in self.page.items:
+            question.is_open = question.can_vote(schedule)
+        return self.page.items
+
+    def get_context_data(self, **kwargs):
+        """Add the cursor of the next page of questions."""
+        context = super().get_context_data(**kwargs)
+        context['next_cursor'] = self.page.next_cursor
+        return context
 
 
 class EyesOnlyView(LoginRequiredMixin, generic.ListView):
@@ -53,11 +89,11 @@ class DetailView(LoginRequiredMixin, generic.DetailView):
         if not question.can_vote():
             messages.error(request, "Voting is not allowed on this question")
             return HttpResponseRedirect(reverse('polls:index'))
-        try:
-            # get choice
-            vote_info = Vote.objects.get(
-                user=user, choice__in=question.choice_set.all()).choice
-        except Vote.DoesNotExist:
+        # get choice; the user's own vote is read from the primary
+        vote_info = Choice.objects.db_manager(
+            hints={'fresh': True}).filter(
+            vote__user=user, vote__question=question).first()
+        if vote_info is None:
             return render(request, 'polls/detail.html', {'question': question})
         return render(request, 'polls/detail.html',
                       {'question': question, 'vote_info': vote_info})
@@ -68,27 +104,117 @@ class ResultsView(generic.DetailView):
     model = Question
     template_name = 'polls/results.html'
 
+    def get(self, request, *args, **kwargs):
+        """Answer 304 Not Modified when the client has these results."""
+        self.object = self.get_object()
+        version = conditional.results_version(self.object)
+        response = conditional.not_modified(request, version)
+        if response is None:
+            response = self.render_to_response(
+                self.get_context_data(object=self.object))
+        return conditional.add_headers(request, response, version)
+
+    def get_queryset(self):
+        """Load the frozen results of archived questions with them."""
+        return Question.objects.select_related('archive')
+
+    def get_context_data(self, **kwargs):
+        """Add every choice count of the question, frozen for archived
+        questions, from the results cache otherwise."""
+        context = super().get_context_data(**kwargs)
+        context['results'] = (archived_results(self.object)
+                              or get_results_cache().get(self.object.pk))
+        context['live_results'] = settings.POLLS_LIVE_RESULTS
+        return context
+
+
+def search(request):
+    """Search the published polls by words of their question or choices,
+    best match first."""
+    query = request.GET.get('q', '').strip()
+    page = search_questions(query, request.GET.get('after'),
+                            settings.POLLS_INDEX_PAGE_SIZE)
+    schedule = get_schedule()
+    for question in page.items:
+        question.is_open = question.can_vote(schedule)
+    return render(request, 'polls/search.html', {
+        'query': query,
+        'question_list': page.items,
+        'next_cursor': page.next_cursor,
+    })
+
 
 @login_required
 def vote(request, question_id):
     """Vote function for voting button"""
-    question = get_object_or_404(Question, pk=question_id)
     user = request.user
+    choice_id = request.POST.get('choice')
+    results = stick_to_primary(HttpResponseRedirect(
+        reverse('polls:results', args=(question_id,))))
+    limiter = get_vote_limiter()
+    if choice_id and limiter.coalesce(user.id, question_id, choice_id):
+        # the same vote was accepted a moment ago (e.g. a double click)
+        return results
+    retry_after = limiter.check(user.id, client_ip(request))
+    if retry_after:
+        limiter.forget(user.id, question_id, choice_id)
+        return too_many_votes(retry_after)
+    question = get_object_or_404(Question, pk=question_id)
+    if not question.can_vote():
+        limiter.forget(user.id, question_id, choice_id)
+        messages.error(request, "Voting is not allowed on this question")
+        return HttpResponseRedirect(reverse('polls:index'))
     try:
-        selected_choice = question.choice_set.get(pk=request.POST['choice'])
-    except (KeyError, Choice.DoesNotExist):
+        selected_choice = question.choice_set.get(pk=choice_id)
+    except (ValueError, Choice.DoesNotExist):
+        limiter.forget(user.id, question_id, choice_id)
         # Redisplay the question voting form.
         return render(request, 'polls/detail.html', {
             'question': question,
             'error_message': "You didn't select a choice.",
         })
+    if settings.POLLS_VOTE_INGEST:
+        # written later by the background batch writer.
+        get_vote_ingestor().submit(user.id, question.id, selected_choice.id)
+        return results
     try:
-        # check this user vote history.
-        vote = Vote.objects.get(
-            user=user, choice__in=question.choice_set.all())
-        vote.choice = selected_choice
-        vote.save()
-    except Vote.DoesNotExist:
-        Vote.objects.create(user=user, choice=selected_choice).save()
+        cast_vote(user.id, question.id, selected_choice.id)
+    except Exception:
+        limiter.forget(user.id, question_id, choice_id)
+        raise
     # after vote its will redirect to results page.
-    return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+    return results
+
+
+@staff_member_required
+def stats(request):
+    """Monitoring counters of the polls application."""
+    return JsonResponse({
+        'results_cache': get_results_cache().stats(),
+        'requests': request_metrics.snapshot(),
+        'live_results': publisher.stats(),
+        'vote_limits': get_vote_limiter().stats(),
+    })
+
+
+@staff_member_required
+def export_view(request):
+    """Stream results or raw votes as CSV or JSON Lines."""
+    kind = request.GET.get('kind', 'results')
+    fmt = request.GET.get('format', 'csv')
+    if kind not in export.KINDS or fmt not in export.FORMATS:
+        return HttpResponseBadRequest('Unknown export kind or format.')
+    try:
+        filters = export.parse_filters(
+            question=request.GET.get('question'),
+            choice=request.GET.get('choice'),
+            since=request.GET.get('since'),
+            until=request.GET.get('until'))
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    response = StreamingHttpResponse(
+        export.export_lines(kind, fmt, filters),
+        content_type=export.FORMATS[fmt])
+    response['Content-Disposition'] = (
+        f'attachment; filename="polls-{kind}.{fmt}"')
+    return response
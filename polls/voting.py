@@ -0,0 +1,43 @@
+"""Casting a vote as one upsert statement instead of read-then-write."""
+from django.db import connection, transaction
+
+from .cache import invalidate_results
+from .models import Choice, Question, Vote
+from .snapshots import log_change
+
+
+def cast_vote(user_id, question_id, choice_id):
+    """Store the vote of a user on a question, replacing an earlier one.
+
+    The (user, question) unique constraint settles concurrent votes inside
+    the INSERT ... ON CONFLICT DO UPDATE, so there is no window in which two
+    requests can both decide the user has not voted yet. The counter of the
+    previous choice is decreased first, which also takes the write lock and
+    tells which choice the vote moves from for the vote changelog.
+    return True if the stored vote changed.
+    """
+    votes = connection.ops.quote_name(Vote._meta.db_table)
+    choices = connection.ops.quote_name(Choice._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {choices} SET vote_count = vote_count - 1 '
+            f'WHERE id = (SELECT choice_id FROM {votes} WHERE user_id = %s '
+            f'AND question_id = %s AND choice_id <> %s) RETURNING id',
+            [user_id, question_id, choice_id])
+        old_choice = cursor.fetchone()
+        cursor.execute(
+            f'INSERT INTO {votes} (user_id, question_id, choice_id) '
+            f'VALUES (%s, %s, %s) ON CONFLICT (user_id, question_id) '
+            f'DO UPDATE SET choice_id = excluded.choice_id '
+            f'WHERE {votes}.choice_id <> excluded.choice_id RETURNING id',
+            [user_id, question_id, choice_id])
+        if cursor.fetchone() is None:
+            return False
+        cursor.execute(
+            f'UPDATE {choices} SET vote_count = vote_count + 1 WHERE id = %s',
+            [choice_id])
+        log_change(user_id, question_id,
+                   old_choice[0] if old_choice else None, choice_id)
+        Question.objects.filter(pk=question_id).touch_results()
+        invalidate_results(question_id)
+    return True